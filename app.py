@@ -10,7 +10,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from utils import file_manager, state_manager, context_manager, llm_client, text_analyzer, reference_manager, extractor
-from utils import smart_extractor, info_panel
+from utils import smart_extractor, info_panel, incremental_extractor, body_index, rename_propagator, json_repair
 
 # Page Config
 st.set_page_config(
@@ -136,6 +136,17 @@ with st.sidebar:
     else:
         st.warning("⚠️ 请配置 API 密钥")
 
+    # 响应缓存统计
+    from utils import llm_cache
+    cache_stats = llm_cache.get_stats()
+    st.caption(f"响应缓存: 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']}，共 {cache_stats['entries']} 条 ({cache_stats['size_mb']} MB)")
+    from utils import file_cache
+    fc_stats = file_cache.get_stats()
+    st.caption(f"文件缓存: 命中 {fc_stats['hits']} / 未命中 {fc_stats['misses']}，缓存 {fc_stats['entries']} 个文件")
+    if st.button("🧹 清空响应缓存", use_container_width=True):
+        removed = llm_cache.clear()
+        st.success(f"已清除 {removed} 条缓存")
+
 
 # ==================== 辅助函数 V2 ====================
 
@@ -147,6 +158,7 @@ def _save_with_style_analysis_v2(chapter_title, final_content, original_content)
     # 保存新内容
     with open(save_path, 'w', encoding='utf-8') as f:
         f.write(final_content)
+    body_index.update_chapter(save_path)
     
     # 执行风格分析
     with st.spinner("正在分析您的写作风格..."):
@@ -174,6 +186,7 @@ def _save_with_full_features_v2(chapter_title, final_content, original_content):
     # 保存
     with open(save_path, 'w', encoding='utf-8') as f:
         f.write(final_content)
+    body_index.update_chapter(save_path)
     
     # 1. 风格分析
     try:
@@ -240,7 +253,7 @@ if app_mode == "初始化":
         # 提取模式选择
         extraction_mode = st.radio(
             "选择提取模式：",
-            ["标准模式", "智能分段模式（保持上下文）"],
+            ["标准模式", "智能分段模式（保持上下文）", "增量模式（按章节）"],
             index=0,
             horizontal=True
         )
@@ -248,18 +261,57 @@ if app_mode == "初始化":
         # 窗口参数设置
         window_size = 8000
         overlap_size = 1500
+        max_workers = 1
         if extraction_mode == "智能分段模式（保持上下文）":
-            w_col1, w_col2 = st.columns(2)
+            w_col1, w_col2, w_col3 = st.columns(3)
             with w_col1:
                 window_size = st.slider("窗口大小", 5000, 15000, 8000, 1000)
             with w_col2:
                 overlap_size = st.slider("重叠大小", 500, 3000, 1500, 500)
+            with w_col3:
+                max_workers = st.slider("并发请求数", 1, 8, 3, 1, help="同时处理的窗口数量，受服务商限流约束")
+        order_dependent = False
+        if extraction_mode == "增量模式（按章节）":
+            st.caption("仅对内容变化的章节重新调用模型，其余章节复用上次提取结果。")
+            i_col1, i_col2 = st.columns(2)
+            with i_col1:
+                max_workers = st.slider("并发请求数", 1, 8, 3, 1, help="同时提取的章节数量，受服务商限流约束")
+            with i_col2:
+                order_dependent = st.checkbox("变更章节之后全部重新提取", value=False, help="逐章按顺序提取，每章提示词附带前文累计状态（人物、境界、伏笔），不并发、不使用响应缓存")
+        
+        use_async = False
+        if extraction_mode != "标准模式":
+            use_async = st.checkbox("自适应限速（异步批量请求）", value=False, help="按 LLM_RPM / LLM_TPM 限流，被限流时自动降低并发；并发请求数作为上限")
+        stream_sections = False
+        if extraction_mode != "增量模式（按章节）":
+            stream_sections = st.checkbox("实时显示已解析字段（流式解析）", value=False, help="每个字段（角色、敌人、伏笔……）解析完成即显示；响应被截断时保留已完成的字段")
+        bypass_cache = st.checkbox("忽略响应缓存（强制重新调用模型）", value=False)
         
         if st.button("🚀 开始全量提取 (消耗 Token)", type="primary", use_container_width=True):
             current_model = st.session_state.get("DEFAULT_MODEL_NAME", None)
             full_text = ""
             chapters = context_manager.get_sorted_chapters()
-            if chapters:
+            if extraction_mode == "增量模式（按章节）":
+                full_text = None
+                if not chapters:
+                    st.error("增量模式需要章节文件，请先执行单文件正文拆分。")
+                else:
+                    with st.spinner("AI 正在扫描变更章节..."):
+                        try:
+                            extracted_data, report = incremental_extractor.extract_incremental(
+                                chapters, model_name=current_model,
+                                order_dependent=order_dependent, max_workers=max_workers,
+                                use_async=use_async, bypass_cache=bypass_cache
+                            )
+                            st.caption(f"本次提取 {len(report['extracted'])} 章，复用 {len(report['reused'])} 章，失败 {len(report['failed'])} 章")
+                            if report["failed"]:
+                                st.warning(f"以下章节提取失败，未计入结果: {', '.join(report['failed'])}")
+                            st.session_state.last_extracted_data = extracted_data
+                            extractor.save_extracted_data(extracted_data, model_name=current_model)
+                            st.success("✅ 增量提取并持久化完成！")
+                        except Exception as e:
+                            st.error(f"提取失败: {e}")
+            elif chapters:
                 for ch_path in chapters:
                     with open(ch_path, 'r', encoding='utf-8') as f:
                         full_text += f.read() + "\n\n"
@@ -271,19 +323,36 @@ if app_mode == "初始化":
                 full_text = None
                 
             if full_text:
+                partial_view = st.empty() if stream_sections else None
+                partial_sections = {}
+
+                def show_section(key, value, window_index=None):
+                    label = key if window_index is None else f"窗口{window_index + 1} · {key}"
+                    partial_sections[label] = value
+                    with partial_view.container():
+                        st.caption(f"已解析 {len(partial_sections)} 个字段")
+                        st.json(partial_sections, expanded=False)
+
                 with st.spinner("AI 正在深度扫描全文..."):
                     try:
                         if extraction_mode == "智能分段模式（保持上下文）":
                             extracted_data = smart_extractor.smart_extract_large_text(
                                 full_text, model_name=current_model, 
-                                window_size=window_size, overlap=overlap_size
+                                window_size=window_size, overlap=overlap_size,
+                                max_workers=max_workers, use_async=use_async,
+                                on_section=(lambda i, key, value: show_section(key, value, i)) if stream_sections else None,
+                                bypass_cache=bypass_cache
                             )
                         else:
-                            extracted_data = extractor.extract_all_from_text(full_text, model_name=current_model)
+                            extracted_data = extractor.extract_all_from_text(
+                                full_text, model_name=current_model,
+                                on_section=show_section if stream_sections else None,
+                                bypass_cache=bypass_cache
+                            )
                         
                         if extracted_data:
                             st.session_state.last_extracted_data = extracted_data
-                            extractor.save_extracted_data(extracted_data)
+                            extractor.save_extracted_data(extracted_data, model_name=current_model)
                             st.success("✅ 全量提取并持久化完成！")
                     except Exception as e:
                         st.error(f"提取失败: {e}")
@@ -306,9 +375,9 @@ if app_mode == "初始化":
         st.markdown("### 📥 章节导入")
         if status['my_body']:
             if st.button("执行单文件正文拆分", use_container_width=True):
-                chapters = file_manager.parse_chapters(config.FILE_MY_BODY)
-                if chapters:
-                    saved_files = file_manager.save_chapters_to_files(chapters, config.DIR_BODY)
+                # 边解析边写入，超大正文文件也不会一次性载入内存
+                saved_files = file_manager.save_chapters_to_files(file_manager.iter_chapters(config.FILE_MY_BODY), config.DIR_BODY)
+                if saved_files:
                     st.success(f"成功拆分并导入 {len(saved_files)} 章！")
                 else:
                     st.warning("解析失败，请检查章节标题格式（如：第x章）。")
@@ -423,14 +492,7 @@ elif app_mode == "探讨设定":
                             ai_response = llm_client.generate_content(split_prompt, model_name=current_model)
                             
                             # 解析 JSON
-                            import json
-                            json_str = ai_response.strip()
-                            if "```json" in json_str:
-                                json_str = json_str.split("```json")[1].split("```")[0].strip()
-                            elif "```" in json_str:
-                                json_str = json_str.split("```")[1].split("```")[0].strip()
-                            
-                            st.session_state.pending_split_results = json.loads(json_str)
+                            st.session_state.pending_split_results = json_repair.loads(ai_response)
                             st.rerun()
                             
                         except Exception as e:
@@ -552,16 +614,26 @@ elif app_mode == "续写正文":
         
         st.subheader("📜 当前参考细纲")
         user_outline = st.text_area("细纲内容 (可实时调整)", outline_content, height=200)
+        use_relevant_settings = st.checkbox("仅注入与细纲相关的设定片段", value=True, help="设定较多时可显著缩短提示词")
         
         if st.button("🚀 开始生成正文", type="primary", use_container_width=True):
             with st.spinner("极道流文风注入中，正在撰写..."):
                 # 自动加载文风
+                current_model = st.session_state.get("DEFAULT_MODEL_NAME", None)
                 full_prompt = context_manager.build_context_prompt(
                     f"请根据以下细纲续写小说正文，严格模仿文风素材：\n\n{user_outline}",
-                    include_style=True
+                    include_style=True,
+                    settings_top_k=8 if use_relevant_settings else None,
+                    model_name=current_model,
+                    settings_query=user_outline
                 )
-                current_model = st.session_state.get("DEFAULT_MODEL_NAME", None)
-                generated_text = llm_client.generate_content(full_prompt, model_name=current_model)
+            # 流式输出：边生成边显示，结束后再进入编辑器
+            try:
+                with st.container(height=500):
+                    generated_text = st.write_stream(llm_client.stream_content(full_prompt, model_name=current_model))
+            except Exception as e:
+                st.error(f"生成失败：{e}")
+            else:
                 st.session_state.generated_chapter = generated_text
                 st.session_state.ai_draft = generated_text  # 新增：锁定原始草稿作为风格对比基准
                 st.rerun()
@@ -581,6 +653,7 @@ elif app_mode == "续写正文":
                         save_path = os.path.join(config.DIR_BODY, chapter_title)
                         with open(save_path, 'w', encoding='utf-8') as f:
                             f.write(final_content)
+                        body_index.update_chapter(save_path)
                         st.session_state.generated_chapter = final_content # 保存时更新状态
                         st.success(f"✅ 章节已保存: {chapter_title}")
                     else:
@@ -639,13 +712,21 @@ elif app_mode == "改文与冲突提示":
             if st.button("💾 保存并执行冲突扫描", type="primary", use_container_width=True):
                 with open(file_path, 'w', encoding='utf-8') as f:
                     f.write(new_content)
+                body_index.update_chapter(file_path)
                 
-                removed_terms = text_analyzer.get_text_diff(st.session_state.original_content, new_content)
-                removed_terms = [t.strip() for t in removed_terms if len(t.strip()) > 1]
-                
+                changes = text_analyzer.diff_changes(st.session_state.original_content, new_content)
+                replacements = text_analyzer.extract_replacements(changes, st.session_state.original_content, new_content)
+                # 单字改动（沈仪 -> 沈毅 只差 "仪"）按扩展后的完整词语扫描
+                removed_terms = [r["old"] for r in replacements]
+                removed_terms += [c["old"].strip() for c in changes if c["type"] in ("replace", "delete")]
+                removed_terms = list(dict.fromkeys(t for t in removed_terms if len(t) > 1))
+
+                hits = text_analyzer.find_conflict_hits(removed_terms, file_names.index(selected_file), files, max_workers=4) if removed_terms else {}
                 st.session_state.audit_results = {
                     "removed": removed_terms,
-                    "conflicts": text_analyzer.scan_chapters_for_conflict(removed_terms, file_names.index(selected_file), files) if removed_terms else {}
+                    "conflicts": {fname: list(dict.fromkeys(h["term"] for h in file_hits)) for fname, file_hits in hits.items()},
+                    "hits": hits,
+                    "replacements": replacements
                 }
                 st.session_state.current_content = new_content
                 st.session_state.original_content = new_content
@@ -655,12 +736,19 @@ elif app_mode == "改文与冲突提示":
         st.markdown("### ⚠️ 冲突审计报告")
         if "audit_results" in st.session_state:
             res = st.session_state.audit_results
+            if res.get("replacements"):
+                st.info("检测到替换: " + "；".join(f"{r['old']} → {r['new']}（{r['count']} 处）" for r in res["replacements"]))
             if res["removed"]:
                 st.warning(f"检测到关键删改: {', '.join(res['removed'])}")
                 if res["conflicts"]:
                     st.error("发现潜在因果冲突：")
                     for fname, terms in res["conflicts"].items():
                         st.markdown(f"- **{fname}**: 涉及 `{', '.join(terms)}`")
+                        file_hits = res.get("hits", {}).get(fname, [])
+                        if file_hits:
+                            with st.expander(f"查看 {len(file_hits)} 处命中"):
+                                for hit in file_hits:
+                                    st.caption(f"第 {hit['position']} 字 · `{hit['term']}`：…{hit['context']}…")
                 else:
                     st.success("后续章节未发现文本层面的直接冲突。")
             else:
@@ -668,6 +756,54 @@ elif app_mode == "改文与冲突提示":
         else:
             st.info("请在左侧点击保存并执行审计。")
         
+        # 批量改名：把检测到的替换应用到后续章节、设定与状态文件
+        if "audit_results" in st.session_state and st.session_state.audit_results.get("replacements"):
+            st.divider()
+            st.markdown("### ✏️ 批量改名")
+            candidates = st.session_state.audit_results["replacements"]
+            labels = [f"{r['old']} → {r['new']}" for r in candidates]
+            chosen = st.multiselect("选择要传播的替换", labels, default=[])
+            chosen_replacements = [candidates[labels.index(label)] for label in chosen]
+            if st.button("🔎 预览替换", use_container_width=True, disabled=not chosen_replacements):
+                audited_file = st.session_state.current_editing_file
+                rename_plan = rename_propagator.plan(chosen_replacements, file_names.index(audited_file), files)
+                st.session_state.rename_plan = {"replacements": chosen_replacements, "changes": rename_plan}
+            
+            if "rename_plan" in st.session_state:
+                rename_plan = st.session_state.rename_plan
+                if not rename_plan["changes"]:
+                    st.info("后续章节与设定中没有需要替换的内容。")
+                else:
+                    st.caption(f"将修改 {len(rename_plan['changes'])} 个文件")
+                    for change in rename_plan["changes"]:
+                        counts = "，".join(f"{k} ×{v}" for k, v in change["counts"].items())
+                        with st.expander(f"{change['name']}（{counts}）"):
+                            for sample in change["samples"]:
+                                st.caption(f"L{sample['line']}: {sample['before']}")
+                                st.caption(f"→ {sample['after']}")
+                    if st.button("✅ 应用替换", type="primary", use_container_width=True):
+                        try:
+                            snapshot_dir = rename_propagator.apply(rename_plan["changes"], rename_plan["replacements"])
+                            st.session_state.pop("rename_plan", None)
+                            st.success(f"已替换 {len(rename_plan['changes'])} 个文件，原文件已备份到 {os.path.basename(snapshot_dir)}")
+                        except rename_propagator.StaleFileError as e:
+                            st.warning(f"{e}（未做任何修改）")
+                        except Exception as e:
+                            st.error(f"替换失败，已恢复原文件: {e}")
+        
+        snapshots = rename_propagator.list_snapshots()
+        if snapshots:
+            latest = snapshots[0]
+            summary = "，".join(f"{r['old']}→{r['new']}" for r in latest["replacements"])
+            conflicts = rename_propagator.rollback_conflicts(latest["path"])
+            if conflicts:
+                st.warning(f"以下文件在改名后又被修改过，撤销会丢失这些修改: {', '.join(conflicts)}")
+            force_rollback = bool(conflicts) and st.checkbox("仍然撤销（丢弃上述修改）", value=False)
+            if st.button(f"↩️ 撤销最近一次批量改名（{summary}）", use_container_width=True,
+                         disabled=bool(conflicts) and not force_rollback):
+                restored = rename_propagator.rollback(latest["path"], force=force_rollback)
+                st.success(f"已恢复 {restored} 个文件")
+        
         st.divider()
         if st.button("🤖 AI 深度分析本章伏笔变动", use_container_width=True):
             if 'current_content' in st.session_state:
@@ -10,6 +10,7 @@ DIR_BODY = os.path.join(PROJECT_ROOT, "正文")
 DIR_OUTLINES = os.path.join(PROJECT_ROOT, "细纲")
 DIR_HISTORY = os.path.join(PROJECT_ROOT, "历史版本") # For conflict detection snapshots
 DIR_ASSETS = os.path.join(PROJECT_ROOT, "assets") # 文风素材
+DIR_CACHE = os.path.join(PROJECT_ROOT, ".cache") # 运行时缓存（LLM 响应、索引等），可随时删除
 
 # Key Files
 FILE_ORIGINAL = os.path.join(DIR_REF, "从斩妖除魔开始长生不死.txt")
@@ -19,6 +20,12 @@ FILE_MY_BODY = os.path.join(PROJECT_ROOT, "我的正文.txt")
 # State Files (New)
 FILE_FORESHADOWING = os.path.join(DIR_SETTINGS, "设定_伏笔.json")
 FILE_CHARACTER_STATE = os.path.join(DIR_SETTINGS, "设定_角色状态.json")
+# Append-only change logs, folded into the JSON snapshots above on compaction
+FILE_CHARACTER_LOG = os.path.join(DIR_SETTINGS, "设定_角色状态.jsonl")
+FILE_FORESHADOWING_LOG = os.path.join(DIR_SETTINGS, "设定_伏笔.jsonl")
+FILE_STATE_HISTORY = os.path.join(DIR_SETTINGS, "设定_状态历史.jsonl")
+# SQLite state backend, used when STATE_BACKEND=sqlite
+FILE_STATE_DB = os.path.join(DIR_SETTINGS, "设定_状态.db")
 
 # Ensure all directories exist
 REQUIRED_DIRS = [DIR_REF, DIR_SETTINGS, DIR_BODY, DIR_OUTLINES, DIR_HISTORY, DIR_ASSETS]
@@ -0,0 +1,56 @@
+import os
+import random
+import sys
+import tempfile
+sys.path.append('.')
+
+from utils import text_analyzer
+from utils.aho_corasick import AhoCorasick
+
+def _naive(patterns, text):
+    hits = set()
+    for pattern in set(p for p in patterns if p):
+        start = text.find(pattern)
+        while start != -1:
+            hits.add((start, pattern))
+            start = text.find(pattern, start + 1)
+    return hits
+
+def test_matches_naive_search():
+    rng = random.Random(15)
+    alphabet = "沈仪妖魔刀"
+    for _ in range(200):
+        patterns = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 200)))
+        matches = list(AhoCorasick(patterns).iter_matches(text))
+        assert set(matches) == _naive(patterns, text)
+        assert len(matches) == len(set(matches))
+        # 按结束位置递增产出
+        ends = [start + len(pattern) for start, pattern in matches]
+        assert ends == sorted(ends)
+
+def test_overlaps_and_nesting():
+    matcher = AhoCorasick(["沈仪", "仪", "沈仪刀", "刀刀", ""])
+    assert matcher.patterns == ["沈仪", "仪", "沈仪刀", "刀刀"]
+    assert matcher.find_all("沈仪刀刀刀") == {"沈仪": [0], "仪": [1], "沈仪刀": [0], "刀刀": [2, 3]}
+    assert not AhoCorasick([])
+    assert AhoCorasick(["妖"]).find_all("") == {}
+
+def test_find_conflict_hits_scans_later_chapters():
+    with tempfile.TemporaryDirectory() as root:
+        paths = []
+        for i, text in enumerate(["沈仪出场。", "沈仪与黑獒交手，黑獒败走。", "无关章节。", "黑獒再现"]):
+            path = os.path.join(root, f"第{i + 1}章.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            paths.append(path)
+        hits = text_analyzer.find_conflict_hits(["沈仪", "黑獒", "妖"], 0, paths, use_index=False)
+        assert list(hits) == ["第2章.txt", "第4章.txt"]
+        assert [(h["term"], h["position"]) for h in hits["第2章.txt"]] == [("沈仪", 0), ("黑獒", 3), ("黑獒", 8)]
+        assert text_analyzer.scan_chapters_for_conflict(["黑獒"], 2, paths) == {"第4章.txt": ["黑獒"]}
+
+if __name__ == "__main__":
+    test_matches_naive_search()
+    test_overlaps_and_nesting()
+    test_find_conflict_hits_scans_later_chapters()
+    print("✅ Aho-Corasick 测试通过")
@@ -0,0 +1,87 @@
+import os
+import random
+import re
+import sys
+import tempfile
+sys.path.append('.')
+
+import config
+from utils import body_index
+
+ALPHABET = "沈仪刀妖血煞镇司斩山"
+
+def _use_dirs(body_dir, cache_dir):
+    """把正文目录与缓存目录指向临时目录，返回恢复函数"""
+    saved = (config.DIR_BODY, config.DIR_CACHE)
+    config.DIR_BODY, config.DIR_CACHE = body_dir, cache_dir
+    body_index._loaded_dir = None
+    def restore():
+        config.DIR_BODY, config.DIR_CACHE = saved
+        body_index._loaded_dir = None
+    return restore
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def _brute_force(texts, term):
+    """逐章扫描（含重叠命中）作为对照"""
+    results = {}
+    for name, text in texts.items():
+        positions = [m.start() for m in re.finditer(f"(?={re.escape(term)})", text)]
+        if positions:
+            results[name] = positions
+    return results
+
+def test_lookup_matches_brute_force():
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as root:
+        body_dir = os.path.join(root, "正文")
+        os.makedirs(body_dir)
+        restore = _use_dirs(body_dir, os.path.join(root, ".cache"))
+        try:
+            texts = {f"第{i}章.txt": "".join(rng.choice(ALPHABET) for _ in range(3000)) for i in range(1, 6)}
+            for name, text in texts.items():
+                _write(os.path.join(body_dir, name), text)
+            body_index.refresh()
+            for _ in range(300):
+                term = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(2, 5)))
+                assert body_index.lookup_term(term) == _brute_force(texts, term), term
+            # 重叠命中（"仪仪" 在 "仪仪仪" 中出现两次）
+            texts["第6章.txt"] = "仪仪仪"
+            _write(os.path.join(body_dir, "第6章.txt"), texts["第6章.txt"])
+            body_index.update_chapter(os.path.join(body_dir, "第6章.txt"))
+            assert body_index.lookup_term("仪仪")["第6章.txt"] == [0, 1]
+        finally:
+            restore()
+
+def test_shards_follow_body_dir():
+    """同一缓存目录下切换正文目录时不会读到其它目录的分片；加载时过期的分片会重建"""
+    with tempfile.TemporaryDirectory() as root:
+        cache_dir = os.path.join(root, ".cache")
+        dir_a, dir_b = os.path.join(root, "a"), os.path.join(root, "b")
+        os.makedirs(dir_a)
+        os.makedirs(dir_b)
+        _write(os.path.join(dir_a, "第1章.txt"), "沈仪挥刀斩妖")
+        _write(os.path.join(dir_b, "第1章.txt"), "镇妖司夜巡")
+        restore = _use_dirs(dir_a, cache_dir)
+        try:
+            body_index.refresh()
+            restore()
+            _use_dirs(dir_b, cache_dir)
+            assert body_index.lookup_term("沈仪") == {}
+            body_index.refresh()
+            assert body_index.lookup_term("夜巡") == {"第1章.txt": [3]}
+
+            # 进程外修改了章节：重新加载时按签名重建该分片
+            _write(os.path.join(dir_b, "第1章.txt"), "镇妖司白日巡街")
+            body_index._loaded_dir = None
+            assert body_index.lookup_term("白日") == {"第1章.txt": [3]}
+            assert body_index.lookup_term("夜巡") == {}
+        finally:
+            restore()
+
+if __name__ == "__main__":
+    test_lookup_matches_brute_force()
+    test_shards_follow_body_dir()
+    print("✅ 正文索引测试通过")
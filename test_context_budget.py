@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+sys.path.append('.')
+
+import config
+from utils import context_manager, token_budget
+
+_PATCHED = ["DIR_SETTINGS", "DIR_BODY", "DIR_OUTLINES", "DIR_ASSETS", "DIR_HISTORY", "DIR_CACHE",
+            "FILE_CHARACTER_STATE", "FILE_CHARACTER_LOG", "FILE_FORESHADOWING", "FILE_FORESHADOWING_LOG",
+            "FILE_STATE_HISTORY", "FILE_STATE_DB"]
+
+def _use_project(root):
+    """把 config 中的目录与状态文件指向临时项目，返回恢复函数"""
+    saved = {name: getattr(config, name) for name in _PATCHED}
+    for name, value in saved.items():
+        setattr(config, name, os.path.join(root, os.path.relpath(value, config.PROJECT_ROOT)))
+    for name in _PATCHED:
+        if name.startswith("DIR_"):
+            os.makedirs(getattr(config, name), exist_ok=True)
+    return lambda: [setattr(config, name, value) for name, value in saved.items()]
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def _build_project(root, chapter_chars=30000):
+    for i in range(1, 6):
+        _write(os.path.join(config.DIR_BODY, f"第{i}章.txt"), "沈仪挥刀斩妖，血雾翻涌。" * (chapter_chars // 12))
+    _write(os.path.join(config.DIR_SETTINGS, "设定_通用.txt"),
+           "\n\n".join(f"杂项设定{i}：城中市集的日常琐事与物价变动。" for i in range(40)))
+    _write(os.path.join(config.DIR_SETTINGS, "设定_战力_功法设定.txt"),
+           "幽煞刀法：镇妖司秘传刀法，第三重可引煞气入刃。\n\n金刚不坏体：肉身天赋，大成后刀枪难伤。")
+    _write(os.path.join(config.DIR_ASSETS, "样本.txt"), "风格样本：刀光一闪，妖头落地。" * 200)
+
+def test_settings_and_style_survive_default_budget():
+    """默认预算下最近章节不会挤掉设定与文风样本"""
+    with tempfile.TemporaryDirectory() as root:
+        restore = _use_project(root)
+        try:
+            _build_project(root)
+            prompt = context_manager.build_context_prompt("请根据以下细纲续写：沈仪修炼幽煞刀法", model_name="gpt-3.5-turbo")
+            assert "幽煞刀法" in prompt
+            assert "风格样本" in prompt
+            assert token_budget.estimate_tokens(prompt) <= token_budget.get_prompt_budget(model_name="gpt-3.5-turbo")
+        finally:
+            restore()
+
+def test_retrieved_settings_reach_prompt():
+    """检索模式：按细纲检索到的设定片段出现在最终提示词中，且不被任务模板文字带偏"""
+    with tempfile.TemporaryDirectory() as root:
+        restore = _use_project(root)
+        try:
+            _build_project(root)
+            outline = "沈仪突破幽煞刀法第三重"
+            prompt = context_manager.build_context_prompt(
+                f"请根据以下细纲续写小说正文，严格模仿文风素材：\n\n{outline}",
+                settings_top_k=2, settings_query=outline, model_name="gpt-3.5-turbo")
+            assert "幽煞刀法：镇妖司秘传刀法" in prompt
+            assert "杂项设定" not in prompt
+        finally:
+            restore()
+
+def test_allocate_shares():
+    sections = [
+        {"name": "state", "text": "状" * 1000, "priority": 1},
+        {"name": "recent", "text": "近" * 50000, "priority": 2, "keep": "tail", "max_share": 0.5},
+        {"name": "settings", "text": "设" * 5000, "priority": 3, "min_share": 0.2},
+    ]
+    fitted = token_budget.allocate(sections, 10000)
+    tokens = {name: token_budget.estimate_tokens(text) for name, text in fitted.items()}
+    assert tokens["state"] == 1000
+    assert tokens["settings"] >= 2000
+    assert sum(tokens.values()) <= 10000
+    # 预算充足时上限不浪费空间
+    fitted = token_budget.allocate(sections[:2], 100000)
+    assert fitted["recent"] == sections[1]["text"]
+
+if __name__ == "__main__":
+    test_allocate_shares()
+    test_settings_and_style_survive_default_budget()
+    test_retrieved_settings_reach_prompt()
+    print("✅ 上下文预算测试通过")
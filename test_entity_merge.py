@@ -0,0 +1,87 @@
+import random
+import sys
+import time
+sys.path.append('.')
+
+from utils import entity_merge, smart_extractor
+
+def test_canonical_key():
+    key = entity_merge.canonical_key
+    assert key("断山刀") == key("断山刀（在手）") == key(" 断山刀 ")
+    assert key("金刚不坏体·大成") == key("金刚不坏体")
+    assert key("幽煞刀法第三重") == key("幽煞刀法")
+    assert key("ＡＢＣ刀") == key("abc刀")
+    # 只有后缀时保留原文
+    assert key("大成") == "大成"
+    assert key("青狼帮三品", strip_grade=False) != key("青狼帮五品", strip_grade=False)
+    assert key("青狼帮三品 ", strip_grade=False) == key("青狼帮三品（残部）", strip_grade=False)
+
+def test_split_grade():
+    assert entity_merge.split_grade("幽煞刀·大成") == ("幽煞刀", "大成")
+    assert entity_merge.split_grade("幽煞刀") == ("幽煞刀", "")
+    assert entity_merge.split_grade("大成") == ("大成", "")
+
+def test_merge_value_policies():
+    merge = entity_merge.merge_value
+    assert merge("旧", "新") == "新"
+    assert merge("旧", "") == "旧"
+    assert merge("旧", "新", "first") == "旧"
+    assert merge("短", "长一些", "longest") == "长一些"
+    assert merge(3, 4, "sum") == 7
+    assert merge([{"name": "断山刀"}], [{"name": "断山刀（在手）"}, {"name": "镇妖司腰牌"}], "union") == \
+        [{"name": "断山刀（在手）"}, {"name": "镇妖司腰牌"}]
+
+def test_entity_index_dedup_and_grade():
+    skills = entity_merge.EntityIndex(key_field="name", grade_field="level")
+    skills.extend([{"name": "幽煞刀法·小成", "level": ""}, "金刚不坏体", {"name": "幽煞刀法", "level": "大成"}])
+    assert skills.items == [{"name": "幽煞刀法", "level": "大成"}, {"name": "金刚不坏体"}]
+
+def test_entity_map_keeps_grade_distinct():
+    enemies = entity_merge.EntityMap()
+    enemies.update({"青狼帮三品": {"status": "败走"}, "青狼帮五品": {"status": "死亡"}})
+    enemies.update({"青狼帮三品（残部）": {"status": "重伤"}, " 黑獒 ": {"realm": "七品"}, "黑獒": {"status": "逃走"}})
+    assert enemies.mapping == {
+        "青狼帮三品": {"status": "重伤"},
+        "青狼帮五品": {"status": "死亡"},
+        " 黑獒 ": {"realm": "七品", "status": "逃走"},
+    }
+
+def test_fuzzy_ledger():
+    ledger = entity_merge.EntityIndex(key_field="desc", policies=entity_merge.LEDGER_POLICIES, fuzzy=True)
+    ledger.add({"id": "1", "desc": "古井下传来刀鸣声", "status": "active"})
+    ledger.add({"id": "9", "desc": "古井下传来刀鸣声。", "status": "recovered"})
+    ledger.add({"id": "2", "desc": "镇妖司内司的密令", "status": "active"})
+    assert [(item["id"], item["status"]) for item in ledger.items] == [("1", "recovered"), ("2", "active")]
+
+def test_window_merge_uses_indexes():
+    window = lambda data: {"success": True, "result": data}
+    merged = smart_extractor.merge_window_results([
+        window({"enemy_tracker": {"青狼帮三品": {"status": "败走"}}, "world_event": {"镇妖司": {"current_action": "巡夜"}}}),
+        window({"enemy_tracker": {"青狼帮五品": {"status": "死亡"}}, "world_event": {"镇妖司（外司）": {"current_action": "收兵"}}}),
+    ])
+    assert set(merged["enemy_tracker"]) == {"青狼帮三品", "青狼帮五品"}
+    assert merged["world_event"] == {"镇妖司": {"current_action": "收兵"}}
+
+def test_fuzzy_merge_is_linear():
+    """大量相互不同但共享常见二元组的伏笔，合并耗时不随条目数平方增长"""
+    rng = random.Random(25)
+    alphabet = "沈仪刀妖血煞镇司斩山古井夜巡黑獒青狼帮"
+    def run(count):
+        ledger = entity_merge.EntityIndex(key_field="desc", fuzzy=True)
+        start = time.perf_counter()
+        for i in range(count):
+            ledger.add({"desc": "沈仪" + "".join(rng.choice(alphabet) for _ in range(12)) + str(i)})
+        return time.perf_counter() - start
+    small, large = run(500), run(4000)
+    assert large < small * 8 * 4
+
+if __name__ == "__main__":
+    test_canonical_key()
+    test_split_grade()
+    test_merge_value_policies()
+    test_entity_index_dedup_and_grade()
+    test_entity_map_keeps_grade_distinct()
+    test_fuzzy_ledger()
+    test_window_merge_uses_indexes()
+    test_fuzzy_merge_is_linear()
+    print("✅ 实体合并测试通过")
@@ -0,0 +1,93 @@
+import json
+import random
+import sys
+sys.path.append('.')
+
+from utils import json_repair
+
+SAMPLE = {
+    "shen_yi": {"realm": "气血境后期", "assets": {"killing_points": 1200, "monster_cores": {"八品": 3}}},
+    "enemy_tracker": {"黑獒": {"realm": "七品", "status": "重伤逃走"}},
+    "ledger_update": [{"id": "1", "desc": "古井下的\"刀鸣\"", "status": "active"}],
+    "settings": "镇妖司分为内外两司\n外司负责巡夜",
+    "outline": ""
+}
+
+def test_valid_json_unchanged():
+    text = json.dumps(SAMPLE, ensure_ascii=False, indent=2)
+    assert json_repair.loads(text) == SAMPLE
+    assert json_repair.repair(text) == SAMPLE
+
+def test_fence_and_prose():
+    body = json.dumps(SAMPLE, ensure_ascii=False)
+    assert json_repair.loads(f"```json\n{body}\n```") == SAMPLE
+    assert json_repair.loads(f"好的，以下是提取结果：\n{body}\n以上。") == SAMPLE
+
+def test_common_defects():
+    assert json_repair.loads('{"a": [1, 2,], "b": {"c": "d",},}') == {"a": [1, 2], "b": {"c": "d"}}
+    assert json_repair.loads("{'a': 'b'}") == {"a": "b"}
+    assert json_repair.loads('{"a": True, "b": None, "c": -1.5e3}') == {"a": True, "b": None, "c": -1500.0}
+    assert json_repair.loads('{"a": 1, // 注释\n "b": 2}') == {"a": 1, "b": 2}
+    # 正文里未转义的引号保留为字符
+    assert json_repair.loads('{"desc": "他说"走"就走", "n": 1}') == {"desc": '他说"走"就走', "n": 1}
+    # 字符串里的裸换行
+    assert json_repair.loads('{"a": "第一行\n第二行"}') == {"a": "第一行\n第二行"}
+
+def test_truncation():
+    assert json_repair.loads('{"a": "未写完') == {"a": "未写完"}
+    assert json_repair.loads('{"a": [1, 2') == {"a": [1, 2]}
+    assert json_repair.loads('{"a": {"b": 1}, "c"') == {"a": {"b": 1}}
+    assert json_repair.loads('{"a": {"b": 1}, "c":') == {"a": {"b": 1}}
+    assert json_repair.loads('[{"a": 1}, {"b": 2') == [{"a": 1}, {"b": 2}]
+
+def test_every_prefix_parses():
+    """任意位置截断都能解析出对象，已完整输出的顶层字段与原文一致"""
+    text = json.dumps(SAMPLE, ensure_ascii=False, indent=2)
+    # 每个顶层字段的值在下一个顶层字段开始前结束
+    starts = [text.find(f'\n  "{key}":') for key in SAMPLE] + [len(text) - 1]
+    complete_at = dict(zip(SAMPLE, starts[1:]))
+    for cut in range(1, len(text) + 1):
+        data = json_repair.loads(text[:cut])
+        assert isinstance(data, dict), cut
+        for key, value in data.items():
+            if cut >= complete_at[key]:
+                assert value == SAMPLE[key], (cut, key)
+
+def test_random_damage_never_raises():
+    rng = random.Random(21)
+    text = json.dumps(SAMPLE, ensure_ascii=False)
+    for _ in range(500):
+        chars = list(text)
+        for _ in range(rng.randint(1, 5)):
+            pos = rng.randrange(len(chars))
+            op = rng.random()
+            if op < 0.4:
+                del chars[pos]
+            elif op < 0.8:
+                chars.insert(pos, rng.choice('{}[],:"\' 沈x'))
+            else:
+                chars = chars[:pos]
+                break
+        damaged = "".join(chars)
+        result = json_repair.loads(damaged, default=None)
+        assert result is None or isinstance(result, (dict, list))
+
+def test_failures():
+    assert json_repair.loads("没有任何结构", default={}) == {}
+    assert json_repair.loads(None, default=[]) == []
+    try:
+        json_repair.loads("没有任何结构")
+    except json_repair.JSONRepairError:
+        pass
+    else:
+        raise AssertionError("应抛出 JSONRepairError")
+
+if __name__ == "__main__":
+    test_valid_json_unchanged()
+    test_fence_and_prose()
+    test_common_defects()
+    test_truncation()
+    test_every_prefix_parses()
+    test_random_damage_never_raises()
+    test_failures()
+    print("✅ JSON 容错解析测试通过")
@@ -0,0 +1,83 @@
+import json
+import random
+import sys
+sys.path.append('.')
+
+from utils import json_stream
+
+SAMPLE = {
+    "shen_yi": {"realm": "气血境后期", "equipment": ["斩妖刀", "镇妖司腰牌"], "note": "刀身刻着\"镇\"字 {不是括号}"},
+    "enemy_tracker": {"黑獒": {"realm": "七品", "status": "重伤逃走"}},
+    "ledger_update": [{"id": "1", "desc": "古井下的刀鸣，\\疑似旧物", "status": "active"}],
+    "settings": "外司负责巡夜, 内司: 负责审讯",
+    "killing_points": 1200,
+    "outline": ""
+}
+
+def _random_split(text, rng):
+    """把文本切成随机长度的增量（含长度为 1 和空串）"""
+    deltas = []
+    i = 0
+    while i < len(text):
+        size = rng.choice([0, 1, 1, 2, 3, 7, 20, 200])
+        deltas.append(text[i:i + size])
+        i += size
+    return deltas
+
+def test_random_splits_match_json_loads():
+    rng = random.Random(22)
+    text = "```json\n" + json.dumps(SAMPLE, ensure_ascii=False, indent=2) + "\n```"
+    for _ in range(300):
+        seen = []
+        result, parser = json_stream.parse_stream(_random_split(text, rng), on_section=lambda k, v: seen.append((k, v)))
+        assert result == SAMPLE
+        assert seen == list(SAMPLE.items())
+        assert parser.done and parser.partial_key is None
+
+def test_sections_emitted_as_soon_as_closed():
+    parser = json_stream.SectionParser()
+    assert parser.feed('好的：{"a": {"b": [1, 2]}') == []
+    assert parser.feed(', "c"') == [("a", {"b": [1, 2]})]
+    assert parser.feed(': "x,y"}') == [("c", "x,y")]
+    assert parser.done and parser.feed('{"ignored": 1}') == []
+    assert parser.finish() == {"a": {"b": [1, 2]}, "c": "x,y"}
+
+def test_truncated_stream_keeps_completed_sections():
+    rng = random.Random(5)
+    text = json.dumps(SAMPLE, ensure_ascii=False)
+    keys = list(SAMPLE)
+    for _ in range(200):
+        cut = rng.randrange(1, len(text))
+        result, parser = json_stream.parse_stream(_random_split(text[:cut], rng))
+        for key, value in result.items():
+            if key != parser.partial_key:
+                assert value == SAMPLE[key], (cut, key)
+        # 截断位置之前已完整输出（后面跟着逗号）的字段都必须在结果里
+        for key in keys[:-1]:
+            next_key = json.dumps(keys[keys.index(key) + 1], ensure_ascii=False)
+            if text.find(", " + next_key) < cut - 1:
+                assert result.get(key) == SAMPLE[key], (cut, key)
+
+def test_interrupted_stream():
+    def deltas():
+        yield '{"a": 1, "b": [1,'
+        raise ConnectionError("断流")
+    result, parser = json_stream.parse_stream(deltas())
+    assert result["a"] == 1 and isinstance(parser.error, ConnectionError)
+
+    def nothing_completed():
+        yield '{"a": '
+        raise ConnectionError("断流")
+    try:
+        json_stream.parse_stream(nothing_completed())
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError("没有完成的字段时应原样抛出")
+
+if __name__ == "__main__":
+    test_random_splits_match_json_loads()
+    test_sections_emitted_as_soon_as_closed()
+    test_truncated_stream_keeps_completed_sections()
+    test_interrupted_stream()
+    print("✅ 流式 JSON 解析测试通过")
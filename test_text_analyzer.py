@@ -0,0 +1,93 @@
+import random
+import sys
+sys.path.append('.')
+
+from utils import text_analyzer
+
+def _lcs_length(a, b):
+    prev = [0] * (len(b) + 1)
+    for x in a:
+        cur = [0]
+        for j, y in enumerate(b):
+            cur.append(prev[j] + 1 if x == y else max(prev[j + 1], cur[j]))
+        prev = cur
+    return prev[-1]
+
+def _mutate(rng, text, alphabet, edits):
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randint(0, len(chars))
+        op = rng.random()
+        if op < 0.33 and pos < len(chars):
+            del chars[pos]
+        elif op < 0.66 and pos < len(chars):
+            chars[pos] = rng.choice(alphabet)
+        else:
+            chars.insert(pos, rng.choice(alphabet))
+    return "".join(chars)
+
+def _check_opcodes(a, b, opcodes):
+    """opcodes 首尾相接覆盖两个序列，equal 区间内容相同，按 opcodes 可由 a 重建 b"""
+    i = j = 0
+    rebuilt = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        if tag == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+        rebuilt.append(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    assert "".join(rebuilt) == b
+
+def test_myers_random_edits():
+    rng = random.Random(17)
+    alphabet = "沈仪刀妖血。"
+    for _ in range(300):
+        a = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        b = _mutate(rng, a, alphabet, rng.randint(0, 10)) if rng.random() < 0.8 else \
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        opcodes = text_analyzer.myers_opcodes(a, b)
+        _check_opcodes(a, b, opcodes)
+        # Myers 给出最短编辑脚本：相同部分的总长等于最长公共子序列
+        equal = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'equal')
+        assert equal == _lcs_length(a, b), (a, b)
+
+def test_myers_max_edits():
+    assert text_analyzer.myers_opcodes("abcdef", "uvwxyz", max_edits=3) is None
+    assert text_analyzer.myers_opcodes("abcdef", "abXdef", max_edits=3) == [
+        ('equal', 0, 2, 0, 2), ('replace', 2, 3, 2, 3), ('equal', 3, 6, 3, 6)]
+    # 序列（按句子）同样适用
+    assert text_analyzer.myers_opcodes(["甲。", "乙。"], ["甲。", "丙。", "乙。"]) == [
+        ('equal', 0, 1, 0, 1), ('insert', 1, 1, 1, 2), ('equal', 1, 2, 2, 3)]
+
+def test_diff_changes_rebuild_new_text():
+    rng = random.Random(3)
+    alphabet = "沈仪挥刀斩妖，血雾翻涌"
+    sentences = ["".join(rng.choice(alphabet) for _ in range(rng.randint(5, 20))) + "。" for _ in range(40)]
+    old_text = "".join(sentences)
+    for _ in range(50):
+        new_text = _mutate(rng, old_text, alphabet + "。", rng.randint(1, 30))
+        changes = text_analyzer.diff_changes(old_text, new_text)
+        rebuilt, pos = [], 0
+        for change in changes:
+            assert old_text[change["old_start"]:change["old_end"]] == change["old"]
+            assert new_text[change["new_start"]:change["new_end"]] == change["new"]
+            rebuilt.append(old_text[pos:change["old_start"]])
+            rebuilt.append(change["new"])
+            pos = change["old_end"]
+        rebuilt.append(old_text[pos:])
+        assert "".join(rebuilt) == new_text
+
+def test_extract_replacements_name_change():
+    old_text = "沈仪拔刀。沈仪转身离去。"
+    new_text = "陆沉拔刀。陆沉转身离去。"
+    changes = text_analyzer.diff_changes(old_text, new_text)
+    replacements = text_analyzer.extract_replacements(changes, old_text, new_text)
+    assert replacements[0]["old"] == "沈仪" and replacements[0]["new"] == "陆沉"
+
+if __name__ == "__main__":
+    test_myers_random_edits()
+    test_myers_max_edits()
+    test_diff_changes_rebuild_new_text()
+    test_extract_replacements_name_change()
+    print("✅ 差分测试通过")
@@ -0,0 +1,98 @@
+import os
+import random
+import sys
+sys.path.append('.')
+
+from utils import token_budget
+
+def _with_env(**values):
+    """临时设置环境变量（值为 None 表示删除），返回恢复函数"""
+    saved = {key: os.environ.get(key) for key in values}
+    for key, value in values.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    def restore():
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return restore
+
+def test_estimate_tokens():
+    assert token_budget.estimate_tokens("") == 0
+    assert token_budget.estimate_tokens("沈仪挥刀") == 4
+    assert token_budget.estimate_tokens("abcd") == 1
+    assert token_budget.estimate_tokens("abcde") == 2
+    assert token_budget.estimate_tokens("沈仪，go!") == 3 + 1
+
+def test_context_tokens_resolution():
+    restore = _with_env(LLM_CONTEXT_TOKENS=None, OPENAI_MODEL_NAME=None)
+    try:
+        assert token_budget.get_context_tokens("gpt-3.5-turbo") == 16000
+        assert token_budget.get_context_tokens("deepseek-v3.2-251201-hs") == 64000
+        assert token_budget.get_context_tokens("unknown-model") == token_budget.DEFAULT_CONTEXT_TOKENS
+        os.environ["OPENAI_MODEL_NAME"] = "qwen-max"
+        assert token_budget.get_context_tokens() == 32000
+        os.environ["LLM_CONTEXT_TOKENS"] = "50000"
+        assert token_budget.get_context_tokens("gpt-4o") == 50000
+        os.environ["LLM_CONTEXT_TOKENS"] = "abc"
+        assert token_budget.get_context_tokens("gpt-4o") == 128000
+        assert token_budget.get_prompt_budget(context_tokens=10000, output_reserve=4000) == 6000
+        assert token_budget.get_prompt_budget(context_tokens=1000) == 0
+    finally:
+        restore()
+
+def test_truncate_to_tokens():
+    text = "".join(f"第{i}段。" for i in range(500))
+    head = token_budget.truncate_to_tokens(text, 200, keep="head")
+    tail = token_budget.truncate_to_tokens(text, 200, keep="tail")
+    assert token_budget.estimate_tokens(head) <= 200 and token_budget.estimate_tokens(tail) <= 200
+    assert head.startswith("第0段") and head.endswith(token_budget.TRUNCATION_MARKER)
+    assert tail.endswith("第499段。") and tail.startswith(token_budget.TRUNCATION_MARKER)
+    assert token_budget.truncate_to_tokens(text, 5) == ""
+    assert token_budget.truncate_to_tokens("短文本", 200) == "短文本"
+
+def test_allocate_priority_and_shares():
+    sections = [
+        {"name": "state", "text": "状" * 3000, "priority": 1},
+        {"name": "recent", "text": "近" * 3000, "priority": 2, "keep": "tail", "max_share": 0.5},
+        {"name": "settings", "text": "设" * 3000, "priority": 3, "min_share": 0.2},
+    ]
+    tokens = {name: token_budget.estimate_tokens(text) for name, text in token_budget.allocate(sections, 4000).items()}
+    # 保底 800 给设定，剩余按优先级：状态 3000，最近章节只剩 200
+    assert tokens["state"] == 3000
+    assert 700 <= tokens["settings"] <= 800
+    assert tokens["recent"] <= 200
+    # 保底总和超出预算时按比例缩减
+    shares = [{"name": n, "text": "字" * 1000, "priority": i, "min_share": 0.6} for i, n in enumerate("ab")]
+    tokens = {name: token_budget.estimate_tokens(text) for name, text in token_budget.allocate(shares, 1000).items()}
+    assert sum(tokens.values()) <= 1000 and abs(tokens["a"] - tokens["b"]) <= 1
+
+def test_allocate_never_exceeds_budget():
+    rng = random.Random(6)
+    for _ in range(200):
+        sections = []
+        for i in range(rng.randint(1, 5)):
+            section = {"name": f"s{i}", "text": "文" * rng.randint(0, 3000), "priority": rng.randint(1, 5),
+                       "keep": rng.choice(["head", "tail"])}
+            if rng.random() < 0.3:
+                section["min_share"] = rng.choice([0.05, 0.2, 0.5])
+            if rng.random() < 0.3:
+                section["max_share"] = rng.choice([0.3, 0.5])
+            sections.append(section)
+        budget = rng.randint(0, 6000)
+        fitted = token_budget.allocate(sections, budget)
+        assert sum(token_budget.estimate_tokens(text) for text in fitted.values()) <= budget
+        if sum(token_budget.estimate_tokens(s["text"]) for s in sections) <= budget:
+            assert all(fitted[s["name"]] == s["text"] for s in sections)
+
+if __name__ == "__main__":
+    test_estimate_tokens()
+    test_context_tokens_resolution()
+    test_truncate_to_tokens()
+    test_allocate_priority_and_shares()
+    test_allocate_never_exceeds_budget()
+    print("✅ Token 预算测试通过")
@@ -0,0 +1,74 @@
+"""
+Aho-Corasick 多模式匹配
+一次扫描文本即可找出所有关键词的全部出现位置，耗时与关键词数量无关。
+用于素材批量定位、正文冲突扫描等需要同时查找大量词条的场景。
+"""
+
+from collections import deque
+
+class AhoCorasick:
+    """
+    用法：
+        matcher = AhoCorasick(["沈仪", "妖魔"])
+        for start, keyword in matcher.iter_matches(text):
+            ...
+    """
+
+    def __init__(self, patterns):
+        # 节点 0 为根；每个节点: 转移表 / 失配指针 / 以该节点结尾的模式
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self.patterns = []
+        for pattern in dict.fromkeys(p for p in patterns if p):
+            self._add(pattern)
+            self.patterns.append(pattern)
+        self._build()
+
+    def _add(self, pattern):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append(pattern)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # 合并失配链上的输出，匹配时无需再沿失配链回溯
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def iter_matches(self, text):
+        """逐个产出 (起始下标, 关键词)，按结束位置递增；重叠的匹配全部产出"""
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern in output[node]:
+                yield i - len(pattern) + 1, pattern
+
+    def find_all(self, text):
+        """返回 {关键词: [起始下标, ...]}，未出现的关键词不在结果中"""
+        hits = {}
+        for start, pattern in self.iter_matches(text):
+            hits.setdefault(pattern, []).append(start)
+        return hits
@@ -0,0 +1,276 @@
+"""
+异步 LLM 客户端
+与同步的 llm_client 并存，供分窗提取、增量提取等批量任务使用：
+- 令牌桶同时限制每分钟请求数 (RPM) 与每分钟 token 数 (TPM)
+- 遇到 429 / 5xx 时优先遵循 Retry-After，否则按带抖动的指数退避重试
+- 并发度按 AIMD 自适应：成功时缓慢加一，被限流时减半
+响应缓存与同步客户端共用 llm_cache，键的计算方式一致。
+"""
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from utils import llm_client, llm_cache, token_budget
+
+# 默认参数（可通过环境变量 LLM_RPM / LLM_TPM / LLM_MAX_CONCURRENCY 覆盖，0 表示不限制）
+DEFAULT_RPM = 60
+DEFAULT_TPM = 0
+DEFAULT_MAX_CONCURRENCY = 8
+MAX_RETRIES = 5
+BASE_BACKOFF = 1.0   # 秒
+MAX_BACKOFF = 60.0   # 秒
+DEFAULT_OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class RateLimitError(Exception):
+    """重试次数用尽后仍被限流"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟配额，按秒匀速补充。
+    内部状态用线程锁保护、等待用 asyncio.sleep，因此可以跨多次 asyncio.run 共享同一份配额。
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    async def acquire(self, amount=1):
+        # 单次需求超过桶容量时按满桶处理，避免永久等待
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                now = self._refill()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                else:
+                    wait = (amount - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def refund(self, amount):
+        """预估用量多扣时归还差额"""
+        if amount <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def pause(self, seconds):
+        """服务端要求等待时，所有请求一起暂停"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class AdaptiveConcurrency:
+    """
+    AIMD 并发控制：每次成功 limit += 1/limit（约每轮加一），被限流时 limit 减半。
+    """
+    def __init__(self, max_limit, initial=None):
+        self.max_limit = max(1, int(max_limit))
+        self.limit = float(initial or max(1, self.max_limit // 2))
+        self.in_flight = 0
+        self.peak = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        self.limit = max(1.0, self.limit / 2.0)
+
+_buckets_lock = threading.Lock()
+_buckets = {}
+_stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+def _get_rate_settings():
+    """读取限流配置（每次调用时读取，兼容运行时修改环境变量）"""
+    def _read(name, default):
+        try:
+            return max(0, int(os.environ.get(name, default)))
+        except ValueError:
+            return default
+    return _read("LLM_RPM", DEFAULT_RPM), _read("LLM_TPM", DEFAULT_TPM), _read("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+
+def _get_bucket(kind, per_minute):
+    """进程级共享的令牌桶，配额变化时重建；per_minute 为 0 时不限制"""
+    if not per_minute:
+        return None
+    with _buckets_lock:
+        bucket = _buckets.get(kind)
+        if bucket is None or bucket.capacity != float(per_minute):
+            bucket = TokenBucket(per_minute)
+            _buckets[kind] = bucket
+        return bucket
+
+def _parse_retry_after(headers):
+    """解析 Retry-After（秒数或 HTTP 日期），无法解析时返回 None"""
+    value = headers.get("retry-after") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff_delay(attempt, retry_after=None):
+    """服务端给出 Retry-After 时照办（加少量抖动）；否则使用 full-jitter 指数退避"""
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 1)
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * (2 ** attempt)))
+
+def _build_request(prompt, target_model):
+    base_url = os.environ.get("OPENAI_BASE_URL")
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("❌ 错误：未检测到 API 密钥。请在侧边栏配置或检查 .env 文件。")
+
+    if llm_client._is_company_platform(base_url):
+        return llm_client._build_company_request(prompt, target_model, base_url, api_key, stream=False)
+
+    # 标准 OpenAI 兼容 API，参数与同步客户端保持一致（不显式传 temperature）
+    root = (base_url or DEFAULT_OPENAI_BASE_URL).rstrip("/")
+    full_url = root if root.endswith("/chat/completions") else f"{root}/chat/completions"
+    headers = {
+        "Authorization": f"Bearer {llm_client._strip_bearer(api_key)}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": target_model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": llm_client.DEFAULT_MAX_TOKENS
+    }
+    return full_url, headers, payload
+
+async def _generate(http, limiter, prompt, target_model):
+    rpm, tpm, _ = _get_rate_settings()
+    request_bucket = _get_bucket("rpm", rpm)
+    token_bucket = _get_bucket("tpm", tpm)
+    full_url, headers, payload = _build_request(prompt, target_model)
+    # 服务商按 prompt + max_tokens 预扣 TPM，这里同样预扣，拿到 usage 后归还差额
+    reserved = token_budget.estimate_tokens(prompt) + llm_client.DEFAULT_MAX_TOKENS
+
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        async with limiter:
+            if request_bucket:
+                await request_bucket.acquire(1)
+            if token_bucket:
+                await token_bucket.acquire(reserved)
+            _stats["requests"] += 1
+            try:
+                response = await http.post(full_url, headers=headers, json=payload)
+            except Exception as e:
+                if attempt >= MAX_RETRIES:
+                    _stats["failures"] += 1
+                    raise
+                print(f"⚠️ 请求异常，准备重试 ({attempt + 1}/{MAX_RETRIES}): {e}")
+                status = None
+            else:
+                status = response.status_code
+                if status == 200:
+                    data = response.json()
+                    limiter.on_success()
+                    usage = (data.get("usage") or {}).get("total_tokens")
+                    if token_bucket and usage:
+                        token_bucket.refund(reserved - usage)
+                    return data["choices"][0]["message"]["content"]
+                if status not in RETRYABLE_STATUS or attempt >= MAX_RETRIES:
+                    _stats["failures"] += 1
+                    if status == 429:
+                        raise RateLimitError(f"API Error 429: {response.text}", _parse_retry_after(response.headers))
+                    raise Exception(f"API Error {status}: {response.text}")
+                retry_after = _parse_retry_after(response.headers)
+                if status == 429:
+                    _stats["throttled"] += 1
+                    limiter.on_throttle()
+                    print(f"🚦 触发限流，并发上限降至 {int(limiter.limit)}")
+
+        delay = _backoff_delay(attempt, retry_after)
+        if status == 429 and request_bucket:
+            request_bucket.pause(delay)
+        _stats["retries"] += 1
+        await asyncio.sleep(delay)
+
+async def generate_many(prompts, model_name=None, use_cache=False, max_concurrency=None, return_exceptions=True,
+                        bypass_cache=False):
+    """
+    并发生成多条提示词的结果，返回顺序与 prompts 一致。
+    Args:
+        prompts: 提示词列表
+        model_name: 模型名称
+        use_cache: 是否读写响应缓存
+        max_concurrency: 并发上限（默认读取 LLM_MAX_CONCURRENCY）
+        return_exceptions: 为真时失败项以异常对象返回，不中断其余请求
+        bypass_cache: 跳过缓存读取强制调用模型（结果仍会写回缓存）
+    """
+    import httpx
+
+    target_model = llm_client._resolve_model(model_name)
+    temperature = llm_client._effective_temperature()
+    if max_concurrency is None:
+        _, _, max_concurrency = _get_rate_settings()
+    limiter = AdaptiveConcurrency(max_concurrency or DEFAULT_MAX_CONCURRENCY)
+
+    async def _one(http, prompt):
+        cache_key = None
+        if use_cache:
+            cache_key = llm_cache.make_key(target_model, prompt, temperature, llm_client.DEFAULT_MAX_TOKENS)
+            if not (bypass_cache or llm_cache.bypass_enabled()):
+                cached = llm_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+        response = await _generate(http, limiter, prompt, target_model)
+        if cache_key:
+            llm_cache.put(cache_key, response, model=target_model)
+        return response
+
+    limits = httpx.Limits(max_connections=limiter.max_limit, max_keepalive_connections=limiter.max_limit)
+    async with httpx.AsyncClient(limits=limits, timeout=llm_client.REQUEST_TIMEOUT) as http:
+        results = await asyncio.gather(*(_one(http, p) for p in prompts), return_exceptions=return_exceptions)
+    print(f"📈 批量请求完成：峰值并发 {limiter.peak}，最终并发上限 {int(limiter.limit)}")
+    return results
+
+def run_batch(prompts, model_name=None, use_cache=False, max_concurrency=None, return_exceptions=True, bypass_cache=False):
+    """generate_many 的同步封装，供 Streamlit 等同步代码调用"""
+    return asyncio.run(generate_many(prompts, model_name=model_name, use_cache=use_cache,
+                                     max_concurrency=max_concurrency, return_exceptions=return_exceptions,
+                                     bypass_cache=bypass_cache))
+
+def get_stats():
+    """返回累计请求、重试、限流次数"""
+    return dict(_stats)
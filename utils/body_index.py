@@ -0,0 +1,226 @@
+"""
+正文倒排索引
+对 正文/ 下每个章节的相邻字符二元组建立位置倒排表（章节 -> 偏移列表），
+每章一个分片持久化到 .cache/body_index/<正文目录哈希> 下；保存章节时只重建该章的分片。
+分片记录来源目录与章节文件签名，加载时与当前 正文/ 不一致的分片会被丢弃或重建。
+查询词的每个二元组依次求交并校验相邻位置，结果与逐章 `term in content` 完全一致，
+但无需读取任何章节文件。
+"""
+
+import bisect
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict
+import config
+
+INDEX_VERSION = 2
+
+_lock = threading.Lock()
+# 章节文件名 -> {"signature": [mtime_ns, size], "length": 字符数, "grams": 该章出现的二元组}
+_chapters = {}
+# 二元组 -> {章节文件名: [偏移, ...]}
+_postings = defaultdict(dict)
+_loaded_dir = None
+
+def _source_dir():
+    return os.path.abspath(config.DIR_BODY)
+
+def _index_dir():
+    """每个正文目录使用独立的分片子目录"""
+    digest = hashlib.sha256(_source_dir().encode("utf-8")).hexdigest()[:16]
+    return os.path.join(config.DIR_CACHE, "body_index", digest)
+
+def _shard_path(name):
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(_index_dir(), f"{digest}.json")
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+def build_postings(text):
+    """统计文本中每个相邻字符二元组出现的所有偏移"""
+    postings = defaultdict(list)
+    for i in range(len(text) - 1):
+        postings[text[i:i + 2]].append(i)
+    return postings
+
+def _remove_chapter(name):
+    entry = _chapters.pop(name, None)
+    if entry is None:
+        return
+    for gram in entry["grams"]:
+        chapter_map = _postings.get(gram)
+        if chapter_map is not None:
+            chapter_map.pop(name, None)
+            if not chapter_map:
+                del _postings[gram]
+
+def _add_chapter(name, signature, length, postings):
+    _remove_chapter(name)
+    for gram, offsets in postings.items():
+        _postings[gram][name] = offsets
+    _chapters[name] = {"signature": signature, "length": length, "grams": list(postings.keys())}
+
+def _write_shard(name, signature, length, postings):
+    path = _shard_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": INDEX_VERSION, "source_dir": _source_dir(), "name": name, "signature": signature,
+                   "length": length, "postings": postings}, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def _load_shards():
+    """
+    首次使用（或正文目录切换后）从磁盘加载全部分片。
+    来源目录不符的分片跳过；章节已删除的分片移除，章节签名变化的重新建立。
+    """
+    global _loaded_dir
+    source_dir = _source_dir()
+    if _loaded_dir == source_dir:
+        return
+    _chapters.clear()
+    _postings.clear()
+    stale = []
+    for path in glob.glob(os.path.join(_index_dir(), "*.json")):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                shard = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if shard.get("version") != INDEX_VERSION or shard.get("source_dir") != source_dir:
+            continue
+        chapter_path = os.path.join(source_dir, shard["name"])
+        try:
+            signature = _signature(chapter_path)
+        except OSError:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        if signature != shard["signature"]:
+            stale.append(chapter_path)
+            continue
+        _add_chapter(shard["name"], shard["signature"], shard["length"], shard["postings"])
+    for chapter_path in stale:
+        _index_file(chapter_path)
+    if stale:
+        print(f"🗂️ 正文索引已重建 {len(stale)} 个过期分片")
+    _loaded_dir = source_dir
+
+def _index_file(path):
+    name = os.path.basename(path)
+    signature = _signature(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    postings = build_postings(text)
+    _add_chapter(name, signature, len(text), postings)
+    _write_shard(name, signature, len(text), postings)
+
+def update_chapter(path):
+    """章节保存后调用：只重建该章节的索引分片"""
+    with _lock:
+        _load_shards()
+        _index_file(path)
+
+def remove_chapter(name):
+    """章节删除后调用"""
+    with _lock:
+        _load_shards()
+        _remove_chapter(name)
+        try:
+            os.remove(_shard_path(name))
+        except OSError:
+            pass
+
+def refresh():
+    """
+    与 正文/ 目录同步：签名变化的章节重建，已删除的章节移出索引。
+    Returns:
+        本次重建的章节数
+    """
+    rebuilt = 0
+    with _lock:
+        _load_shards()
+        paths = {os.path.basename(p): p for p in glob.glob(os.path.join(config.DIR_BODY, "*.txt"))}
+        for name, path in paths.items():
+            try:
+                signature = _signature(path)
+            except OSError:
+                continue
+            entry = _chapters.get(name)
+            if entry is None or entry["signature"] != signature:
+                _index_file(path)
+                rebuilt += 1
+        for name in [n for n in _chapters if n not in paths]:
+            _remove_chapter(name)
+            try:
+                os.remove(_shard_path(name))
+            except OSError:
+                pass
+    if rebuilt:
+        print(f"🗂️ 正文索引已更新 {rebuilt} 章")
+    return rebuilt
+
+def _contains(sorted_offsets, value):
+    i = bisect.bisect_left(sorted_offsets, value)
+    return i < len(sorted_offsets) and sorted_offsets[i] == value
+
+def lookup_term(term, chapters=None):
+    """
+    查询词语在各章节中的出现位置（至少 2 个字符）。
+    Args:
+        term: 查询词
+        chapters: 可选，只在这些章节文件名中查找
+    Returns:
+        {章节文件名: [起始偏移, ...]}，不含未命中的章节
+    """
+    if not term or len(term) < 2:
+        return {}
+    grams = [term[i:i + 2] for i in range(len(term) - 1)]
+    with _lock:
+        _load_shards()
+        maps = [_postings.get(gram) for gram in grams]
+        if not all(maps):
+            return {}
+        # 从最稀有的二元组开始求章节交集
+        candidates = set(min(maps, key=len))
+        for chapter_map in maps:
+            candidates &= chapter_map.keys()
+            if not candidates:
+                return {}
+        if chapters is not None:
+            candidates &= set(chapters)
+
+        results = {}
+        for name in candidates:
+            lists = [chapter_map[name] for chapter_map in maps]
+            # 以该章节中最稀有的二元组为锚点，其余二元组用二分查找校验相邻位置
+            anchor = min(range(len(lists)), key=lambda k: len(lists[k]))
+            positions = []
+            for offset in lists[anchor]:
+                start = offset - anchor
+                if all(k == anchor or _contains(offsets, start + k) for k, offsets in enumerate(lists)):
+                    positions.append(start)
+            if positions:
+                results[name] = positions
+    return results
+
+def lookup_terms(terms, chapters=None):
+    """批量查询，返回 {词语: {章节文件名: [偏移, ...]}}，只包含有命中的词语"""
+    results = {}
+    for term in dict.fromkeys(terms):
+        hits = lookup_term(term, chapters)
+        if hits:
+            results[term] = hits
+    return results
+
+def get_stats():
+    with _lock:
+        _load_shards()
+        return {"chapters": len(_chapters), "grams": len(_postings)}
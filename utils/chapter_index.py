@@ -0,0 +1,122 @@
+"""
+原著章节偏移索引
+逐行扫描原著文本，记录每个章节标题对应的字节偏移与长度，持久化到 .cache/chapter_index 下。
+文件的 mtime/size 变化后自动重建；查询时只 seek 读取目标章节，不再整本读入内存。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import config
+from utils import file_manager
+
+INDEX_VERSION = 1
+
+_lock = threading.Lock()
+# 绝对路径 -> 已加载的索引
+_loaded = {}
+
+def _index_path(path):
+    digest = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(config.DIR_CACHE, "chapter_index", f"{digest}.json")
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+def build_index(path, encoding='utf-8'):
+    """
+    扫描文件生成章节列表 [{"title", "number", "offset", "length"}]，偏移与长度均为字节数。
+    第一个标题之前的内容（书名、简介等）不计入任何章节。
+    """
+    chapters = []
+    offset = 0
+    with open(path, 'rb') as f:
+        for raw_line in f:
+            line = raw_line.decode(encoding, errors='replace').rstrip('\r\n')
+            if file_manager.CHAPTER_HEADER_RE.match(line):
+                if chapters:
+                    chapters[-1]["length"] = offset - chapters[-1]["offset"]
+                title = line.strip(' \t\u3000\ufeff')
+                chapters.append({
+                    "title": title,
+                    "number": file_manager.parse_chapter_number(title),
+                    "offset": offset,
+                    "length": 0
+                })
+            offset += len(raw_line)
+    if chapters:
+        chapters[-1]["length"] = offset - chapters[-1]["offset"]
+    return chapters
+
+def get_index(path=None, encoding='utf-8'):
+    """
+    获取章节索引：内存命中 -> 磁盘命中 -> 重新扫描，签名不一致时逐级失效。
+    """
+    path = os.path.abspath(path or config.FILE_ORIGINAL)
+    signature = _signature(path)
+
+    with _lock:
+        entry = _loaded.get(path)
+        if entry and entry["signature"] == signature and entry["encoding"] == encoding:
+            return entry["chapters"]
+
+    index_file = _index_path(path)
+    data = None
+    if os.path.exists(index_file):
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+    if not data or data.get("version") != INDEX_VERSION or data.get("signature") != signature \
+            or data.get("encoding") != encoding:
+        print(f"📑 正在建立章节索引: {os.path.basename(path)}")
+        data = {
+            "version": INDEX_VERSION,
+            "source": path,
+            "signature": signature,
+            "encoding": encoding,
+            "chapters": build_index(path, encoding)
+        }
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        tmp_path = index_file + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, index_file)
+
+    with _lock:
+        _loaded[path] = data
+    return data["chapters"]
+
+def find_chapter(chapter_hint, path=None):
+    """
+    按提示定位章节：优先按章节序号匹配（兼容中文数字），其次按标题包含关系匹配。
+    Returns:
+        章节条目，未找到返回 None
+    """
+    if not chapter_hint:
+        return None
+    chapters = get_index(path)
+    hint = chapter_hint.strip()
+
+    number = file_manager.parse_chapter_number(hint)
+    if number is not None:
+        for chapter in chapters:
+            if chapter["number"] == number:
+                return chapter
+
+    compact_hint = "".join(hint.split())
+    for chapter in chapters:
+        if compact_hint and compact_hint in "".join(chapter["title"].split()):
+            return chapter
+    return None
+
+def read_chapter(chapter, path=None, encoding='utf-8'):
+    """只读取单个章节的内容"""
+    path = path or config.FILE_ORIGINAL
+    with open(path, 'rb') as f:
+        f.seek(chapter["offset"])
+        data = f.read(chapter["length"])
+    return data.decode(encoding, errors='replace')
@@ -1,7 +1,23 @@
 import os
 import glob
 import config
-from utils import state_manager
+from utils import state_manager, summary_store, token_budget, file_cache
+
+# 提示词各段落的裁剪优先级（数字越小越优先保留）
+SECTION_PRIORITY = {
+    "state": 1,
+    "recap": 2,
+    "recent": 3,
+    "settings": 4,
+    "style": 5,
+}
+
+# 各段落占提示词预算的比例约束：设定与文风有保底，最近章节原文在预算紧张时不超过一半
+SECTION_SHARES = {
+    "recent": {"max_share": 0.5},
+    "settings": {"min_share": 0.2},
+    "style": {"min_share": 0.05},
+}
 
 def get_sorted_chapters():
     """Return list of chapter files sorted by name."""
@@ -26,8 +42,7 @@ def get_recent_chapters_content(n=5):
     
     content_parts = []
     for f in recent:
-        with open(f, 'r', encoding='utf-8') as file:
-            content_parts.append(f"--- File: {os.path.basename(f)} ---\n{file.read()}\n")
+        content_parts.append(f"--- File: {os.path.basename(f)} ---\n{file_cache.read_text(f)}\n")
             
     return "\n".join(content_parts)
 
@@ -37,19 +52,23 @@ def get_settings_summary():
     files = glob.glob(os.path.join(config.DIR_SETTINGS, "设定_*.txt"))
     for f in files:
         try:
-            with open(f, 'r', encoding='utf-8') as file:
-                settings_content.append(f"--- Setting: {os.path.basename(f)} ---\n{file.read()}\n")
+            settings_content.append(f"--- Setting: {os.path.basename(f)} ---\n{file_cache.read_text(f)}\n")
         except UnicodeDecodeError:
             # 如果UTF-8解码失败，尝试其他编码
             try:
-                with open(f, 'r', encoding='gbk') as file:
-                    settings_content.append(f"--- Setting: {os.path.basename(f)} ---\n{file.read()}\n")
+                settings_content.append(f"--- Setting: {os.path.basename(f)} ---\n{file_cache.read_text(f, encoding='gbk')}\n")
             except UnicodeDecodeError:
                 # 如果都失败，跳过该文件
                 print(f"警告：无法读取设定文件 {f}，跳过处理")
                 continue
     return "\n".join(settings_content)
 
+def get_relevant_settings(query, top_k=8):
+    """只返回与 query 最相关的 top_k 个设定片段（检索模式）"""
+    from utils import setting_index
+    hits = setting_index.search(query, top_k=top_k)
+    return "\n".join(f"--- Setting: {hit['file']} (相关片段) ---\n{hit['text']}\n" for hit in hits)
+
 def auto_style_loader():
     """
     自动扫描 assets/ 下的所有文档，提取文风指纹。
@@ -62,17 +81,38 @@ def auto_style_loader():
     style_contents = []
     for f in style_files:
         try:
-            with open(f, 'r', encoding='utf-8') as file:
-                # 读取内容，作为风格参考
-                content = file.read()
-                if content.strip():
-                    style_contents.append(f"--- 风格参考片段 ({os.path.basename(f)}) ---\n{content[:1500]}")
+            # 读取内容，作为风格参考
+            content = file_cache.read_text(f)
+            if content.strip():
+                style_contents.append(f"--- 风格参考片段 ({os.path.basename(f)}) ---\n{content[:1500]}")
         except Exception as e:
             print(f"读取文风文件 {f} 失败: {e}")
     
     return "\n\n".join(style_contents)
 
-def build_context_prompt(query, recent_n=5, include_style=True):
+def fit_sections_to_budget(sections, fixed_text="", context_tokens=None, model_name=None):
+    """
+    按 SECTION_PRIORITY 与 SECTION_SHARES 裁剪各段落，使整个提示词适配模型上下文。
+    Args:
+        sections: {段落名: (内容, 保留方向 "head"/"tail")}
+        fixed_text: 不参与裁剪的固定部分（任务说明、约束等）
+        context_tokens: 模型上下文大小，默认由 LLM_CONTEXT_TOKENS 或模型名推断
+        model_name: 模型名称，用于推断上下文大小
+    Returns:
+        {段落名: 裁剪后的内容}
+    """
+    budget = token_budget.get_prompt_budget(context_tokens, model_name=model_name) - token_budget.estimate_tokens(fixed_text)
+    return token_budget.allocate(
+        [
+            dict({"name": name, "text": text, "keep": keep, "priority": SECTION_PRIORITY.get(name, 99)},
+                 **SECTION_SHARES.get(name, {}))
+            for name, (text, keep) in sections.items()
+        ],
+        budget
+    )
+
+def build_context_prompt(query, recent_n=5, include_style=True, context_tokens=None, settings_top_k=None,
+                         model_name=None, settings_query=None):
     """
     Build the full context for the LLM.
     Includes:
@@ -82,37 +122,28 @@ def build_context_prompt(query, recent_n=5, include_style=True):
     4. Relevant Settings (Txts)
     5. Recent Story Context (Last N chapters)
     6. Auto Style Injection
+    Sections are trimmed by priority (state > layered recap > recent chapter
+    tail > settings > style samples) to fit context_tokens; settings and style
+    keep a guaranteed share and the recent tail is capped (see SECTION_SHARES).
+    If settings_top_k is set, only the settings chunks most relevant to
+    settings_query are injected instead of every 设定 file. settings_query
+    should be the outline / user instruction only (defaults to query), so the
+    boilerplate task text does not dilute the BM25 ranking.
     """
     
     # 1. State
     char_state = state_manager.get_character_state()
-    foreshadowing = state_manager.get_foreshadowing()
-    # Filter only pending foreshadowing? Or all? User said "check current foreshadowing"
-    active_foreshadowing = [f for f in foreshadowing if f.get('status') == 'pending']
+    active_foreshadowing = state_manager.get_foreshadowing(status='pending')
     
-    state_section = f"""
-# 当前状态信息
-## 角色状态
+    state_content = f"""## 角色状态
 {char_state}
 
 ## 待回收伏笔
-{active_foreshadowing}
-"""
-
-    # 2. Settings
-    settings_section = f"""
-# 世界观与设定
-{get_settings_summary()}
-"""
-
-    # 3. Recent Context
-    story_section = f"""
-# 最近剧情回顾 (参考上下文)
-{get_recent_chapters_content(n=recent_n)}
-"""
+{active_foreshadowing}"""
 
     # 4. Style Reference (Auto & Learned)
     style_section = ""
+    style_fingerprint = ""
     if include_style:
         # A. 基础素材指纹
         style_fingerprint = auto_style_loader()
@@ -158,7 +189,7 @@ def build_context_prompt(query, recent_n=5, include_style=True):
 - 侧重：侧重于主角的横推和路人的震惊反应。
 
 参考素材：
-{style_fingerprint}
+{{style_samples}}
 """
 
     # 添加内容质量和风格约束
@@ -181,6 +212,43 @@ def build_context_prompt(query, recent_n=5, include_style=True):
 - 设定遵循：严格遵守已建立的世界观设定
 """
     
+    # 按优先级裁剪：任务（含细纲）与约束固定保留，其余段落按预算分配
+    fitted = fit_sections_to_budget(
+        {
+            "state": (state_content, "head"),
+            "recap": (summary_store.get_recap(), "tail"),
+            "recent": (get_recent_chapters_content(n=recent_n), "tail"),
+            "settings": (get_relevant_settings(settings_query or query, settings_top_k) if settings_top_k else get_settings_summary(), "head"),
+            "style": (style_fingerprint if style_section else "", "head"),
+        },
+        fixed_text=query + quality_constraints + style_section + "# 当前状态信息 # 世界观与设定 # 前情回顾 # 最近剧情回顾 (参考上下文) # 当前任务",
+        context_tokens=context_tokens,
+        model_name=model_name
+    )
+    
+    state_section = f"""
+# 当前状态信息
+{fitted["state"]}
+"""
+
+    # 2. Settings
+    settings_section = f"""
+# 世界观与设定
+{fitted["settings"]}
+"""
+
+    # 3. Recent Context (layered recap first, then raw text of the latest chapters)
+    story_section = f"""
+# 前情回顾
+{fitted["recap"]}
+
+# 最近剧情回顾 (参考上下文)
+{fitted["recent"]}
+"""
+    
+    if style_section:
+        style_section = style_section.replace("{style_samples}", fitted["style"])
+
     # Combine
     full_prompt = f"""
 {state_section}
@@ -205,8 +273,7 @@ def build_setting_discussion_prompt(query, recent_n=3):
     """
     # 1. State
     char_state = state_manager.get_character_state()
-    foreshadowing = state_manager.get_foreshadowing()
-    active_foreshadowing = [f for f in foreshadowing if f.get('status') == 'pending']
+    active_foreshadowing = state_manager.get_foreshadowing(status='pending')
     
     # 2. Context sections
     state_section = f"""
@@ -276,8 +343,7 @@ def build_outline_discussion_prompt(query, recent_n=5):
     """
     # 1. State
     char_state = state_manager.get_character_state()
-    foreshadowing = state_manager.get_foreshadowing()
-    active_foreshadowing = [f for f in foreshadowing if f.get('status') == 'pending']
+    active_foreshadowing = state_manager.get_foreshadowing(status='pending')
     
     # 2. Context sections
     state_section = f"""
@@ -300,7 +366,10 @@ def build_outline_discussion_prompt(query, recent_n=5):
 """
 
     story_section = f"""
-## 4. 前情提要 (最近章节)
+## 4. 前情回顾
+{summary_store.get_recap()}
+
+## 5. 前情提要 (最近章节)
 {get_recent_chapters_content(n=recent_n)}
 """
 
@@ -0,0 +1,261 @@
+"""
+实体合并去重
+合并多窗口/多分块的提取结果时，用规范化键（去掉括号注释、境界/层级后缀、空白与标点）做哈希索引，
+"断山刀" 与 "断山刀（在手）"、"金刚不坏体·大成" 与 "金刚不坏体" 视为同一实体（敌人、势力不去层级后缀，
+"青狼帮三品" 与 "青狼帮五品" 是不同的条目）；可选的字符二元组相似度
+（Dice 系数）用于伏笔描述这类措辞略有差异的长文本。命中后按字段策略合并，整个合并过程是线性的。
+
+字段策略：
+    latest   后出现的非空值覆盖（默认，后面的窗口代表更新的状态）
+    first    保留最早的非空值
+    longest  保留较长的文本
+    sum      数值相加
+    union    列表按规范化键取并集
+"""
+
+import re
+import unicodedata
+
+FUZZY_THRESHOLD = 0.75
+# 模糊匹配时最多精算相似度的候选数
+FUZZY_MAX_CANDIDATES = 20
+# 只用文档频率最低的若干个二元组召回候选；出现在过多条目中的二元组（如 "沈仪"）不参与召回，
+# 每次查找的开销因此有上限，整个合并保持线性
+FUZZY_RARE_GRAMS = 4
+FUZZY_MAX_GRAM_DF = 64
+
+_BRACKETS_RE = re.compile(r'[（(【\[［〔][^（）()【】\[\]［］〔〕]*[）)】\]］〕]')
+_GRADE_SUFFIX_RE = re.compile(
+    r'[·・\-—:：]?(?:第?[0-9一二三四五六七八九十百]+(?:层|重|阶|级|品|段|境)|入门|小成|大成|圆满|巅峰|极致|登峰造极)$'
+)
+_STRIP_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+def canonical_key(text, strip_grade=True):
+    """规范化实体名：全半角统一、去括号注释、去境界/层级后缀（strip_grade 为假时保留）、去空白和标点"""
+    if text is None:
+        return ""
+    text = unicodedata.normalize("NFKC", str(text)).strip()
+    stripped = _BRACKETS_RE.sub("", text)
+    text = stripped if stripped.strip() else text
+    while strip_grade:
+        shorter = _GRADE_SUFFIX_RE.sub("", text)
+        if shorter == text or not shorter.strip():
+            break
+        text = shorter
+    key = _STRIP_RE.sub("", text).lower()
+    return key or _STRIP_RE.sub("", str(text)).lower()
+
+def split_grade(text):
+    """把名称末尾的境界/层级后缀拆出来："幽煞刀·大成" -> ("幽煞刀", "大成")，没有后缀时返回 (原文, "")"""
+    text = str(text).strip()
+    match = _GRADE_SUFFIX_RE.search(text)
+    if not match or not text[:match.start()].strip():
+        return text, ""
+    return text[:match.start()].strip(), match.group(0).lstrip("·・-—:：")
+
+def _grams(key):
+    if len(key) < 2:
+        return {key} if key else set()
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+def similarity(a, b):
+    """两个规范化键的二元组 Dice 系数（0~1）"""
+    return _dice(_grams(a), _grams(b))
+
+def _dice(ga, gb):
+    if not ga or not gb:
+        return 0.0
+    return 2 * len(ga & gb) / (len(ga) + len(gb))
+
+def _is_empty(value):
+    return value is None or value == "" or value == [] or value == {}
+
+def _display_key(item, key_field):
+    if isinstance(item, dict):
+        return item.get(key_field) if key_field else None
+    return item
+
+def merge_value(old, new, policy="latest"):
+    """按策略合并单个字段值；新值为空时总是保留旧值"""
+    if _is_empty(new):
+        return old
+    if _is_empty(old):
+        return new
+    if policy == "first":
+        return old
+    if policy == "longest":
+        return new if len(str(new)) > len(str(old)) else old
+    if policy == "sum":
+        try:
+            return old + new
+        except TypeError:
+            return new
+    if policy == "union" and isinstance(old, list) and isinstance(new, list):
+        index = EntityIndex(list(old), key_field="name")
+        index.extend(new)
+        return index.items
+    return new
+
+def merge_record(old, new, policies=None, default_policy="latest"):
+    """合并两个实体：字典逐字段按策略合并，其它类型按 default_policy 整体合并"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        policies = policies or {}
+        result = dict(old)
+        for field, value in new.items():
+            result[field] = merge_value(old.get(field), value, policies.get(field, default_policy))
+        return result
+    return merge_value(old, new, default_policy)
+
+class KeyMatcher:
+    """规范化键 -> 引用 的哈希索引，可选二元组倒排表做模糊匹配"""
+
+    def __init__(self, fuzzy=False, threshold=FUZZY_THRESHOLD):
+        self.fuzzy = fuzzy
+        self.threshold = threshold
+        self._exact = {}
+        # 模糊匹配用：规范化键 -> (引用, 二元组集合)
+        self._keys = {}
+        self._postings = {}
+
+    def add(self, key, ref):
+        if not key:
+            return
+        self._exact.setdefault(key, ref)
+        if self.fuzzy and key not in self._keys:
+            grams = _grams(key)
+            self._keys[key] = (ref, grams)
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(key)
+
+    def find(self, key):
+        if not key:
+            return None
+        ref = self._exact.get(key)
+        if ref is not None or not self.fuzzy:
+            return ref
+        grams = _grams(key)
+        postings = [self._postings[gram] for gram in grams
+                    if 0 < len(self._postings.get(gram, ())) <= FUZZY_MAX_GRAM_DF]
+        postings.sort(key=len)
+        shared = {}
+        for candidates in postings[:FUZZY_RARE_GRAMS]:
+            for candidate in candidates:
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best, best_score = None, self.threshold
+        for candidate in sorted(shared, key=shared.get, reverse=True)[:FUZZY_MAX_CANDIDATES]:
+            score = _dice(grams, self._keys[candidate][1])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return self._keys[best][0] if best is not None else None
+
+class EntityIndex:
+    """
+    列表型实体（装备、武技、天赋、伏笔）的去重合并，直接修改传入的列表。
+    用法：
+        skills = EntityIndex(merged_skills, key_field="name", policies={"level": "latest"}, grade_field="level")
+        skills.extend(window_skills)
+    设置 grade_field 时，名称里的层级后缀会移到该字段（"幽煞刀·大成" -> name 幽煞刀、level 大成），
+    避免合并后名称与层级互相矛盾。
+    """
+
+    def __init__(self, items=None, key_field=None, policies=None, default_policy="latest",
+                 fuzzy=False, threshold=FUZZY_THRESHOLD, grade_field=None):
+        self.items = items if items is not None else []
+        self.key_field = key_field
+        self.grade_field = grade_field
+        self.policies = policies or {}
+        self.default_policy = default_policy
+        self._matcher = KeyMatcher(fuzzy, threshold)
+        for position, item in enumerate(self.items):
+            self._matcher.add(self._key(item), position)
+
+    def _key(self, item):
+        # 字典条目缺少 key_field 时（如武技只写了字符串），退回按字符串本身比较
+        text = _display_key(item, self.key_field)
+        return canonical_key(text if text is not None else item if not isinstance(item, dict) else "")
+
+    def add(self, item):
+        """加入一个实体，与已有实体重复时合并；返回其在列表中的位置（空实体返回 None）"""
+        if isinstance(item, str) and self.key_field:
+            item = {self.key_field: item}
+        if self.grade_field and isinstance(item, dict) and item.get(self.key_field):
+            name, grade = split_grade(item[self.key_field])
+            if grade:
+                # 名称自带的层级比单独给出的更具体，以名称为准
+                item = dict(item, **{self.key_field: name, self.grade_field: grade})
+        key = self._key(item)
+        if not key:
+            return None
+        position = self._matcher.find(key)
+        if position is None:
+            position = len(self.items)
+            self.items.append(item)
+        else:
+            self.items[position] = merge_record(self.items[position], item, self.policies, self.default_policy)
+        self._matcher.add(key, position)
+        # 合并后展示名可能变化（如 latest 策略取了新写法），新键也指向同一位置
+        self._matcher.add(self._key(self.items[position]), position)
+        return position
+
+    def extend(self, items):
+        if isinstance(items, list):
+            for item in items:
+                self.add(item)
+        return self.items
+
+class EntityMap:
+    """
+    以名称为键的实体（敌人、势力）合并，直接修改传入的字典；同一实体沿用第一次出现的名称。
+    名称里的品阶通常是区分不同个体的一部分（"青狼帮三品" / "青狼帮五品"），默认不去层级后缀。
+    """
+
+    def __init__(self, mapping=None, policies=None, default_policy="latest", fuzzy=False, threshold=FUZZY_THRESHOLD,
+                 strip_grade=False):
+        self.mapping = mapping if mapping is not None else {}
+        self.policies = policies or {}
+        self.default_policy = default_policy
+        self.strip_grade = strip_grade
+        self._matcher = KeyMatcher(fuzzy, threshold)
+        for name in self.mapping:
+            self._matcher.add(self._key(name), name)
+
+    def _key(self, name):
+        return canonical_key(name, strip_grade=self.strip_grade)
+
+    def add(self, name, value):
+        key = self._key(name)
+        if not key:
+            return None
+        existing = self._matcher.find(key)
+        if existing is None:
+            self.mapping[name] = value
+            existing = name
+        else:
+            self.mapping[existing] = merge_record(self.mapping[existing], value, self.policies, self.default_policy)
+        self._matcher.add(key, existing)
+        return existing
+
+    def update(self, incoming):
+        if isinstance(incoming, dict):
+            for name, value in incoming.items():
+                self.add(name, value)
+        return self.mapping
+
+# 提取结果中各字段的合并方式
+LEDGER_POLICIES = {"id": "first", "desc": "longest", "status": "latest"}
+
+def merge_indexes(merged):
+    """
+    为 merge_window_results / merge_chunk_results 的汇总结构建立各字段的合并索引，
+    索引直接修改 merged 中对应的列表和字典。
+    """
+    shen_yi = merged["shen_yi"]
+    cultivation = shen_yi["cultivation"]
+    return {
+        "equipment": EntityIndex(shen_yi["equipment"]),
+        "martial_skills": EntityIndex(cultivation["martial_skills"], key_field="name", grade_field="level"),
+        "physical_talents": EntityIndex(cultivation["physical_talents"], key_field="name", policies={"effect": "longest"}),
+        "enemy_tracker": EntityMap(merged["enemy_tracker"]),
+        "world_event": EntityMap(merged["world_event"]),
+        "ledger_update": EntityIndex(merged["ledger_update"], key_field="desc", policies=LEDGER_POLICIES, fuzzy=True),
+    }
@@ -0,0 +1,184 @@
+"""
+提取结果的结构定义与校验
+以 JSON Schema 描述 沈仪 / 敌人 / 势力 / 伏笔 等提取结构：既作为 response_format 发给支持结构化输出的模型，
+也用于本地校验模型返回的数据——类型不符的字段就地修正（如 "1,200" -> 1200、字符串装备 -> 列表），
+无法修正的字段丢弃并记录问题，保证合并逻辑拿到的数据类型始终正确。
+缺失的字段保持缺失，不用空值补齐，以免覆盖前面窗口的结果；
+同理 schema 只把条目的标识字段（武技名、伏笔描述等）设为 required，片段未提及的字段允许模型省略。
+"""
+
+import json
+import re
+
+_INT_RE = re.compile(r'-?\d+')
+_NUM_RE = re.compile(r'-?\d+(?:\.\d+)?')
+_DROP = object()
+
+def _string(default=""):
+    return {"type": "string", "default": default}
+
+def _object(properties, required=(), **extra):
+    schema = {"type": "object", "properties": properties}
+    if required:
+        schema["required"] = list(required)
+    schema.update(extra)
+    return schema
+
+def _map(value_schema):
+    """以名称为键的对象（敌人名 -> 信息）"""
+    return {"type": "object", "additionalProperties": value_schema}
+
+def _array(item_schema):
+    return {"type": "array", "items": item_schema}
+
+_CULTIVATION = _object({
+    "core_manual": _object({"name": _string(), "level": _string(), "features": _string()}, required=["name"]),
+    "martial_skills": _array(_object({"name": _string(), "level": _string()}, required=["name"])),
+    "physical_talents": _array(_object({"name": _string(), "type": _string(), "effect": _string()}, required=["name"])),
+})
+_ENEMY = _object({"identity": _string(), "realm": _string(), "status": _string(), "threat_level": _string()})
+_WORLD_EVENT = _object({"current_action": _string(), "threat_origin": _string()})
+_LEDGER_ITEM = _object({"id": _string(), "desc": _string(), "status": _string("active")}, required=["desc"])
+
+# 分段/分块提取（smart_extractor 窗口、stream_handler 分块）
+WINDOW_SCHEMA = _object({
+    "shen_yi": _object({
+        "basic_info": _object({
+            "name": _string("沈仪"),
+            "realm": _string(),
+            "killing_points": {"type": "integer"},
+            "current_status": _string(),
+        }),
+        "equipment": _array(_string()),
+        "cultivation": _CULTIVATION,
+    }),
+    "enemy_tracker": _map(_ENEMY),
+    "world_event": _map(_WORLD_EVENT),
+    "ledger_update": _array(_LEDGER_ITEM),
+    "settings": _string(),
+    "outline": _string(),
+})
+
+# 全文一次性提取（extractor.extract_all_from_text）
+FULL_SCHEMA = _object({
+    "shen_yi": _object({
+        "basic_info": _object({"name": _string("沈仪"), "current_status": _string()}),
+        "realm": _string(),
+        "assets": _object({
+            "killing_points": {"type": "integer"},
+            "monster_cores": _map({"type": "integer"}),
+        }),
+        "equipment": _array(_string()),
+        "cultivation": _CULTIVATION,
+    }),
+    "enemy_tracker": _map(_ENEMY),
+    "world_event": _map(_WORLD_EVENT),
+    "ledger_update": _array(_LEDGER_ITEM),
+    "settings": _string(),
+    "outline": _string(),
+})
+
+def empty(schema):
+    """按结构生成全部字段为空值的结果（解析失败时的占位）"""
+    kind = schema.get("type")
+    if "default" in schema:
+        return schema["default"]
+    if kind == "object":
+        return {key: empty(sub) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return ""
+
+def _coerce(value, schema, path, problems):
+    kind = schema.get("type")
+    if kind == "object":
+        properties = schema.get("properties", {})
+        if isinstance(value, str) and value.strip():
+            # 武技/天赋/伏笔偶尔只给出名称或描述字符串
+            for key in ("name", "desc"):
+                if key in properties:
+                    return {key: value}
+        if not isinstance(value, dict):
+            problems.append(f"{path}: 应为对象，已丢弃")
+            return _DROP
+        extra_schema = schema.get("additionalProperties")
+        result = {}
+        for key, item in value.items():
+            sub = properties.get(key, extra_schema if isinstance(extra_schema, dict) else None)
+            if sub is None:
+                result[key] = item
+                continue
+            item = _coerce(item, sub, f"{path}.{key}", problems)
+            if item is not _DROP:
+                result[key] = item
+        return result
+
+    if kind == "array":
+        if isinstance(value, dict):
+            # 模型有时把列表写成 {序号: 条目}
+            value = list(value.values())
+        elif isinstance(value, str):
+            value = [value] if value.strip() else []
+        elif not isinstance(value, list):
+            problems.append(f"{path}: 应为列表，已丢弃")
+            return _DROP
+        item_schema = schema.get("items", {})
+        result = []
+        for i, item in enumerate(value):
+            item = _coerce(item, item_schema, f"{path}[{i}]", problems)
+            if item is not _DROP:
+                result.append(item)
+        return result
+
+    if kind == "string":
+        if isinstance(value, str):
+            return value
+        if value is None:
+            return ""
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            return "\n".join(value)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return str(value)
+
+    if kind in ("integer", "number"):
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (int, float)):
+            return int(value) if kind == "integer" else value
+        if isinstance(value, str):
+            match = (_INT_RE if kind == "integer" else _NUM_RE).search(value.replace(",", "").replace("，", ""))
+            if match:
+                return int(match.group(0)) if kind == "integer" else float(match.group(0))
+        problems.append(f"{path}: 无法转换为数值 {value!r}，已丢弃")
+        return _DROP
+
+    if kind == "boolean":
+        if isinstance(value, str):
+            return value.strip().lower() in ("true", "1", "yes", "是")
+        return bool(value)
+    return value
+
+def validate(data, schema):
+    """
+    按结构校验并修正数据。
+    Returns:
+        (修正后的数据, 问题列表)
+    Raises:
+        ValueError: 顶层不是对象
+    """
+    if not isinstance(data, dict):
+        raise ValueError(f"提取结果应为 JSON 对象，实际为 {type(data).__name__}")
+    problems = []
+    return _coerce(data, schema, "$", problems), problems
+
+def normalize(data, schema):
+    """validate() 的便捷版本：打印修正记录，只返回修正后的数据"""
+    data, problems = validate(data, schema)
+    if problems:
+        print(f"⚠️ 结构校验修正 {len(problems)} 处: {'; '.join(problems[:3])}")
+    return data
@@ -1,12 +1,14 @@
-import json
 import os
 import config
-from utils import llm_client, state_manager, stream_handler
+from utils import entity_merge, extraction_schema, json_repair, json_stream, llm_client, state_manager, stream_handler, summary_store
 
-def extract_all_from_text(full_text, model_name=None):
+def extract_all_from_text(full_text, model_name=None, on_section=None, bypass_cache=False):
     """
     Uses LLM to extract comprehensive state from full text.
     Returns a dict with keys matching the required optimization rules.
+    If on_section is given the response is streamed and on_section(key, value)
+    is called as each top-level section completes.
+    bypass_cache skips the response cache lookup and always calls the model.
     """
     print(f"🔄 开始全量提取，文本长度: {len(full_text)} 字符")
     if model_name:
@@ -82,40 +84,24 @@ def extract_all_from_text(full_text, model_name=None):
 """
     
     try:
-        response = llm_client.generate_content(prompt, model_name=model_name)
-        
-        # 显示原始响应用于调试
-        print(f"🔍 原始AI响应长度: {len(response)} 字符")
-        print(f"🔍 原始响应预览: {response[:200]}..." if len(response) > 200 else f"🔍 原始响应: {response}")
-        
-        # Clean response if it contains markdown code blocks
-        clean_response = response.strip()
-        if clean_response.startswith("```json"):
-            clean_response = clean_response[7:]
-        if clean_response.endswith("```"):
-            clean_response = clean_response[:-3]
-        
-        # Remove any control characters and clean up the JSON
-        import re
-        # 更加健壮的JSON清理逻辑
-        clean_response = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', clean_response)
-        # 提取可能的JSON对象或数组部分
-        json_match = re.search(r'(\{.*\}|\[.*\])', clean_response, re.DOTALL)
-        if json_match:
-            clean_response = json_match.group(1)
-        
-        print(f"🧹 清理后响应长度: {len(clean_response)} 字符")
-        print(f"🧹 清理后响应预览: {clean_response[:200]}..." if len(clean_response) > 200 else f"🧹 清理后响应: {clean_response}")
-        
-        data = json.loads(clean_response)
+        if on_section:
+            deltas = llm_client.stream_content(prompt, model_name=model_name, use_cache=True, bypass_cache=bypass_cache)
+            data, parser = json_stream.parse_stream(deltas, on_section=on_section)
+            if parser.partial_key:
+                print(f"⚠️ 响应不完整，字段 {parser.partial_key} 为截断前的部分内容")
+            if data:
+                print(f"✅ 流式解析完成，共 {len(data)} 个字段")
+                return extraction_schema.normalize(data, extraction_schema.FULL_SCHEMA)
+            # 容错解析：代码块、前后说明文字、截断、多余逗号等一次处理
+            data = extraction_schema.normalize(json_repair.loads(parser.text), extraction_schema.FULL_SCHEMA)
+        else:
+            # 结构化调用：服务端支持时按 schema 约束输出，本地再做一次类型校验
+            data = llm_client.generate_structured(prompt, extraction_schema.FULL_SCHEMA, "full_extraction",
+                                                  model_name=model_name, use_cache=True, bypass_cache=bypass_cache)
         print(f"✅ JSON解析成功!")
         return data
-    except json.JSONDecodeError as e:
+    except ValueError as e:
         print(f"❌ JSON解析失败: {e}")
-        print(f"   错误位置: 行 {e.lineno}, 列 {e.colno}")
-        print(f"   错误字符附近: {clean_response[max(0, e.pos-20):e.pos+20]}")
-        import traceback
-        traceback.print_exc()
         return None
     except Exception as e:
         print(f"❌ 提取过程出错: {e}")
@@ -174,6 +160,7 @@ def merge_chunk_results(chunk_results):
     
     successful_chunks = 0
     failed_chunks = 0
+    indexes = entity_merge.merge_indexes(merged)
     
     for result in chunk_results:
         if "error" in result:
@@ -182,25 +169,18 @@ def merge_chunk_results(chunk_results):
         
         successful_chunks += 1
         try:
-            extraction_text = result["extraction"].strip()
-            if extraction_text.startswith("```json"):
-                extraction_text = extraction_text[7:]
-            if extraction_text.endswith("```"):
-                extraction_text = extraction_text[:-3]
-            
-            import re
-            extraction_text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', extraction_text)
-            
-            data = json.loads(extraction_text)
+            data = result.get("data")
+            if data is None:
+                data = json_repair.loads(result["extraction"])
             
             # 合并沈仪状态
             if "shen_yi" in data:
                 sy = data["shen_yi"]
                 bi = sy.get("basic_info", {})
                 
-                # 境界
-                merged["shen_yi"]["realm"] = sy.get("realm", merged["shen_yi"]["realm"])
-                merged["shen_yi"]["basic_info"]["current_status"] = bi.get("current_status", merged["shen_yi"]["basic_info"]["current_status"])
+                # 境界与状态：分块未提及时（缺失或为空）保留前面分块的值
+                merged["shen_yi"]["realm"] = entity_merge.merge_value(merged["shen_yi"]["realm"], sy.get("realm"))
+                merged["shen_yi"]["basic_info"]["current_status"] = entity_merge.merge_value(merged["shen_yi"]["basic_info"]["current_status"], bi.get("current_status"))
                 
                 # 资产 (杀戮点 & 妖丹)
                 assets = sy.get("assets", {})
@@ -216,12 +196,8 @@ def merge_chunk_results(chunk_results):
                     for grade, count in cores.items():
                         merged["shen_yi"]["assets"]["monster_cores"][grade] = merged["shen_yi"]["assets"]["monster_cores"].get(grade, 0) + count
                 
-                # 装备去重：确保为列表
-                equipment = sy.get("equipment", [])
-                if isinstance(equipment, list):
-                    for i in equipment:
-                        if i and i not in merged["shen_yi"]["equipment"]:
-                            merged["shen_yi"]["equipment"].append(i)
+                # 装备去重："断山刀" 与 "断山刀（在手）" 视为同一件，保留最新的状态描述
+                indexes["equipment"].extend(sy.get("equipment", []))
                 
                 if "cultivation" in sy:
                     cult = sy["cultivation"]
@@ -230,38 +206,15 @@ def merge_chunk_results(chunk_results):
                     if cult.get("core_manual", {}).get("name"):
                         merged["shen_yi"]["cultivation"]["core_manual"] = cult["core_manual"]
                     
-                    martial_skills = cult.get("martial_skills", [])
-                    if isinstance(martial_skills, list):
-                        for s in martial_skills:
-                            s_name = s.get("name") if isinstance(s, dict) else s
-                            if not s_name: continue
-                            existing_names = [sk.get("name") if isinstance(sk, dict) else sk for sk in merged["shen_yi"]["cultivation"]["martial_skills"]]
-                            if s_name not in existing_names:
-                                merged["shen_yi"]["cultivation"]["martial_skills"].append(s)
-                                
-                    physical_talents = cult.get("physical_talents", [])
-                    if isinstance(physical_talents, list):
-                        for t in physical_talents:
-                            t_name = t.get("name") if isinstance(t, dict) else t
-                            if not t_name: continue
-                            existing_names = [tk.get("name") if isinstance(tk, dict) else tk for tk in merged["shen_yi"]["cultivation"]["physical_talents"]]
-                            if t_name not in existing_names:
-                                merged["shen_yi"]["cultivation"]["physical_talents"].append(t)
+                    indexes["martial_skills"].extend(cult.get("martial_skills", []))
+                    indexes["physical_talents"].extend(cult.get("physical_talents", []))
             
-            # 合并敌人
-            if "enemy_tracker" in data:
-                merged["enemy_tracker"].update(data["enemy_tracker"])
+            # 合并敌人 / 世界事件（同名实体逐字段合并，空值不覆盖）
+            indexes["enemy_tracker"].update(data.get("enemy_tracker"))
+            indexes["world_event"].update(data.get("world_event"))
             
-            # 合并世界事件
-            if "world_event" in data:
-                merged["world_event"].update(data["world_event"])
-            
-            # 合并伏笔 (ledger_update)
-            if "ledger_update" in data:
-                for item in data["ledger_update"]:
-                    existing_descs = [i.get("desc") for i in merged["ledger_update"]]
-                    if item.get("desc") not in existing_descs:
-                        merged["ledger_update"].append(item)
+            # 合并伏笔 (ledger_update)：按描述模糊去重，状态取最新
+            indexes["ledger_update"].extend(data.get("ledger_update", []))
             
             # 合并设定
             if "settings" in data:
@@ -285,30 +238,31 @@ def merge_chunk_results(chunk_results):
     return merged
 
 
-def save_extracted_data(data):
+def save_extracted_data(data, model_name=None):
     """
     Save the extracted data to respective files.
     Adapts to the new detailed JSON structure.
+    model_name is used to condense the extracted outline into the summary store.
     """
     results = []
     
     # 1. Save Character State & World/Enemy Info
-    # Load existing state to preserve other information
-    char_state = state_manager.get_character_state()
+    # Only the extracted entities are written (as change-log entries); other information is preserved
+    char_updates = {}
     
     if "shen_yi" in data:
-        char_state["沈仪"] = data["shen_yi"]
+        char_updates["沈仪"] = data["shen_yi"]
         
     if "enemy_tracker" in data and isinstance(data["enemy_tracker"], dict):
         for enemy_name, enemy_info in data["enemy_tracker"].items():
-            char_state[f"敌人_{enemy_name}"] = enemy_info
+            char_updates[f"敌人_{enemy_name}"] = enemy_info
             
     if "world_event" in data and isinstance(data["world_event"], dict):
         for entity_name, entity_info in data["world_event"].items():
-            char_state[f"势力_{entity_name}"] = entity_info
+            char_updates[f"势力_{entity_name}"] = entity_info
 
-    if char_state:
-        state_manager.save_character_state(char_state)
+    if char_updates:
+        state_manager.set_entities(char_updates)
         results.append(f"已更新: {os.path.basename(config.FILE_CHARACTER_STATE)}")
         
     # 2. Save Ledger Update (Foreshadowing)
@@ -336,16 +290,10 @@ def save_extracted_data(data):
         results.append(f"已创建: {os.path.basename(path)}")
         
     # 4. Save Outline
+    # The extracted outline feeds the book-level synopsis of the summary store,
+    # which regenerates "剧情回顾.txt" at a bounded size instead of dumping it verbatim
     if "outline" in data:
-        path = os.path.join(config.DIR_OUTLINES, "当前细纲.txt") # Or a separate summary file? 
-        # User asked for "Outline" extraction. 
-        # "Summary of what happened" is useful for "Discuss Outline".
-        # Let's append or overwrite "剧情回顾.txt" maybe? 
-        # Or just overwrite "当前细纲.txt" if it's treated as "The state of the story".
-        # Let's save as "剧情回顾.txt" to distinguish from "Future Outline".
-        path = os.path.join(config.DIR_OUTLINES, "剧情回顾.txt")
-        with open(path, 'w', encoding='utf-8') as f:
-            f.write(data["outline"])
-        results.append(f"已创建: {os.path.basename(path)}")
+        summary_store.set_extracted_outline(data.get("outline_parts") or data["outline"], model_name=model_name)
+        results.append("已更新: 剧情回顾.txt")
         
     return results
@@ -0,0 +1,91 @@
+"""
+文件读取缓存
+以 (路径, mtime, size) 为键缓存文本与解析后的 JSON，文件变化后自动失效。
+Streamlit 每次交互都会重跑脚本，状态 JSON、设定文件、最近章节会被反复读取，
+经过这一层后同一文件在未修改前只读一次。
+"""
+
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = 256
+
+_lock = threading.Lock()
+# (kind, path, encoding) -> (signature, value)
+_entries = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def _signature(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def _lookup(key, signature):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == signature:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return True, entry[1]
+        _stats["misses"] += 1
+        return False, None
+
+def _store(key, signature, value):
+    with _lock:
+        _entries[key] = (signature, value)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+def read_text(path, encoding='utf-8'):
+    """
+    读取文本文件（带缓存）。文件不存在或解码失败时抛出与 open() 相同的异常。
+    """
+    signature = _signature(path)
+    key = ("text", os.path.abspath(path), encoding)
+    found, value = _lookup(key, signature)
+    if found:
+        return value
+    with open(path, 'r', encoding=encoding) as f:
+        value = f.read()
+    _store(key, signature, value)
+    return value
+
+def load_json(path, copy_result=True):
+    """
+    读取并解析 JSON 文件（带缓存）。
+    默认返回深拷贝，调用方可以放心修改；只读场景可传 copy_result=False。
+    """
+    signature = _signature(path)
+    key = ("json", os.path.abspath(path), 'utf-8')
+    found, value = _lookup(key, signature)
+    if not found:
+        with open(path, 'r', encoding='utf-8') as f:
+            value = json.load(f)
+        _store(key, signature, value)
+    return copy.deepcopy(value) if copy_result else value
+
+def invalidate(path=None):
+    """使某个文件（或全部）缓存失效；写文件后调用，避免同一时间戳内的修改被忽略"""
+    with _lock:
+        if path is None:
+            removed = len(_entries)
+            _entries.clear()
+        else:
+            abs_path = os.path.abspath(path)
+            keys = [key for key in _entries if key[1] == abs_path]
+            for key in keys:
+                del _entries[key]
+            removed = len(keys)
+        _stats["invalidations"] += removed
+
+def get_stats():
+    """返回命中/未命中次数与当前缓存条目数"""
+    with _lock:
+        stats = dict(_stats)
+        stats["entries"] = len(_entries)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
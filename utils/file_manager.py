@@ -1,8 +1,62 @@
 import os
 import re
 import shutil
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Tuple
 import config
+from utils import mmap_text
+
+# 章节标题格式：独占一行的 [第x章{章节名}] 或 第x章 章节名
+CHAPTER_TITLE_PATTERN = r'(\[第.*?章.*?\])'
+CHAPTER_HEADER_RE = re.compile(
+    r'^[ \t\u3000\ufeff]*(?:\[第.*?章.*?\]|第[0-9０-９零〇一二三四五六七八九十百千万两]+章[^\n]{0,40})[ \t]*$',
+    re.MULTILINE
+)
+
+# 章节序号：支持阿拉伯数字、全角数字与中文数字（如 第二百一十二章 / 第212章 / 212）
+CHAPTER_NUMBER_RE = re.compile(r'第\s*([0-9０-９零〇一二三四五六七八九十百千万两]+)\s*[章回节]')
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100, '千': 1000}
+_FULLWIDTH_DIGITS = str.maketrans('０１２３４５６７８９', '0123456789')
+
+def chinese_numeral_to_int(text):
+    """
+    中文数字转整数，如 "二百一十二" -> 212、"十" -> 10、"一零五" -> 105。
+    无法识别时返回 None。
+    """
+    if not text:
+        return None
+    if not any(ch in _CN_UNITS or ch == '万' for ch in text):
+        # 逐位书写的数字（如 一零五）
+        if all(ch in _CN_DIGITS for ch in text):
+            return int("".join(str(_CN_DIGITS[ch]) for ch in text))
+        return None
+
+    total, section, number = 0, 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            number = _CN_DIGITS[ch]
+        elif ch in _CN_UNITS:
+            section += (number or 1) * _CN_UNITS[ch]
+            number = 0
+        elif ch == '万':
+            total += (section + number) * 10000
+            section, number = 0, 0
+        else:
+            return None
+    return total + section + number
+
+def parse_chapter_number(text):
+    """
+    从章节标题或检索提示中解析章节序号，"第二百一十二章 战利品"、"第212章"、"212" 均返回 212。
+    无法解析时返回 None。
+    """
+    if not text:
+        return None
+    match = CHAPTER_NUMBER_RE.search(text)
+    token = (match.group(1) if match else text.strip()).translate(_FULLWIDTH_DIGITS)
+    if token.isdigit():
+        return int(token)
+    return chinese_numeral_to_int(token)
 
 def ensure_directories():
     """Create all required directories if they don't exist."""
@@ -19,69 +73,53 @@ def parse_chapters(file_path: str) -> List[Tuple[str, str]]:
     Returns a list of (filename, content).
     Format: [第x章{ChapterName}]
     """
+    return list(iter_chapters(file_path))
+
+def iter_chapters(file_path: str) -> Iterator[Tuple[str, str]]:
+    """
+    Streaming version of parse_chapters: yields (title, content) as soon as each chapter closes.
+    Only the current chapter is decoded, so memory stays bounded by the largest chapter.
+    """
     if not os.path.exists(file_path):
-        return []
+        return
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+    # Scan the memory-mapped file for headers instead of reading and re.split-ing the whole text.
+    # The title pattern only contains literal CJK characters, so it can run as a byte regex directly.
+    with mmap_text.MappedText(file_path) as text:
+        previous = None
+        for match in text.finditer(CHAPTER_TITLE_PATTERN):
+            if previous is not None:
+                yield _chapter_from_match(text, previous, match.start())
+            previous = match
+        if previous is not None:
+            yield _chapter_from_match(text, previous, len(text))
 
-    # Regex to match chapter headers: [第x章...]
-    # We look for [第...章...] at the start of line or file
-    # Pattern: ^\[第(.*?)章(.*?)\]
-    # But user said: [第x章{章节名}]
-    
-    # Let's try a robust split.
-    # We will split by the pattern, but keep the delimiter.
-    
-    pattern = r'(\[第.*?章.*?\])'
-    parts = re.split(pattern, content)
-    
-    chapters = []
-    current_title = ""
-    current_body = []
-    
-    # parts[0] might be pre-text (intro) if file doesn't start with chapter
-    if parts[0].strip():
-        # Handle intro if needed, or just ignore if it's empty
-        pass
+def _chapter_from_match(text, match, body_end):
+    title = match.group(0).decode('utf-8')
+    # Example: [第01章 开端] -> 第01章 开端
+    clean_title = title.strip().strip("[]")
+    # Keep the [Title] line in the chapter file for consistency with "My Body.txt"
+    body = text.read_bytes(match.end(), body_end)
+    return clean_title, (title + "\n" + body).strip()
 
-    # The split result will be: [pre, title1, body1, title2, body2, ...]
-    # So we iterate starting from index 1 usually, but let's check.
-    
-    for part in parts:
-        if not part:
-            continue
-            
-        if re.match(pattern, part):
-            # It is a title
-            # Save previous chapter if exists
-            if current_title:
-                chapters.append((current_title, "".join(current_body).strip()))
-            
-            # Start new chapter
-            # Extract chapter number for sorting/filename
-            # Example: [第01章 开端] -> 01
-            # Clean the title for filename
-            clean_title = part.strip().strip("[]") # 第01章 开端
-            current_title = clean_title
-            current_body = [part + "\n"] # Include the title in the file content? 
-            # Usually individual files might not need the [Title] line if filename has it, 
-            # but for consistency with "My Body.txt", keeping it is safer.
-            # User requirement: "每章单独写入 正文/ 下（如 正文/第01章 xxx.txt）"
-        else:
-            # It is body
-            if current_title:
-                current_body.append(part)
-    
-    # Append the last chapter
-    if current_title:
-        chapters.append((current_title, "".join(current_body).strip()))
-        
-    return chapters
+def atomic_write_text(file_path: str, content: str, encoding: str = 'utf-8'):
+    """
+    Write via a temp file in the same directory and os.replace it into place,
+    so readers never see a half-written file.
+    """
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding=encoding) as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-def save_chapters_to_files(chapters: List[Tuple[str, str]], target_dir: str) -> List[str]:
+def save_chapters_to_files(chapters: Iterable[Tuple[str, str]], target_dir: str) -> List[str]:
     """
     Save parsed chapters to individual files.
+    Accepts any iterable (e.g. iter_chapters) and writes each chapter as it arrives.
     Returns list of saved file paths.
     """
     saved_files = []
@@ -92,8 +130,7 @@ def save_chapters_to_files(chapters: List[Tuple[str, str]], target_dir: str) ->
         file_path = os.path.join(target_dir, filename)
         
         # Write file
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        atomic_write_text(file_path, content)
         saved_files.append(filename)
         
     return saved_files
@@ -0,0 +1,194 @@
+"""
+增量章节提取
+按章节保存提取结果与内容哈希，只对内容变化的章节重新调用模型，
+再通过 smart_extractor.merge_window_results 按章节顺序合并。
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+from utils import smart_extractor
+
+MANIFEST_VERSION = 1
+
+def _manifest_path():
+    return os.path.join(config.DIR_CACHE, "chapter_extractions.json")
+
+def load_manifest():
+    """读取章节提取记录 {文件名: {hash, result, extracted_at}}"""
+    path = _manifest_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"⚠️ 章节提取记录损坏，将全部重新提取: {e}")
+        return {}
+    if data.get("version") != MANIFEST_VERSION:
+        return {}
+    return data.get("chapters", {})
+
+def save_manifest(chapters):
+    path = _manifest_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": MANIFEST_VERSION, "chapters": chapters}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _extract_chapter(name, text, model_name, window_size, overlap, prior_state=None, bypass_cache=False):
+    """
+    单章提取：短章节一次调用，超长章节（如合并文件）走滑动窗口。
+    prior_state 为前文累计状态，提供时注入提示词（不使用响应缓存）。
+    任一窗口解析失败都会抛出 ValueError，整章记为失败、不写入提取记录，下次运行时重新提取。
+    """
+    if len(text) <= window_size:
+        return smart_extractor.extract_from_window(text, model_name, window_info=f"章节《{name}》", prior_state=prior_state,
+                                                   bypass_cache=bypass_cache)
+    window_results = []
+    for i, (window_text, context_info) in enumerate(smart_extractor.create_sliding_windows(text, window_size, overlap)):
+        result = smart_extractor.extract_from_window(window_text, model_name, window_info=f"章节《{name}》{context_info}",
+                                                     prior_state=prior_state, bypass_cache=bypass_cache)
+        window_results.append({"window_index": i, "context_info": context_info, "result": result, "success": True})
+    return smart_extractor.merge_window_results(window_results)
+
+def _run_async(items, model_name, max_concurrency, bypass_cache=False):
+    """通过异步客户端批量提取短章节，返回 (name, digest, result, error) 列表"""
+    if not items:
+        return []
+    from utils import async_llm_client
+
+    prompts = [smart_extractor.build_window_prompt(text, window_info=f"章节《{name}》") for name, text, _ in items]
+    responses = async_llm_client.run_batch(prompts, model_name=model_name, use_cache=True, max_concurrency=max_concurrency,
+                                           bypass_cache=bypass_cache)
+    outcomes = []
+    for (name, _, digest), response in zip(items, responses):
+        if not isinstance(response, Exception):
+            try:
+                outcomes.append((name, digest, smart_extractor.parse_window_response(response), None))
+                print(f"✅ {name} 提取完成")
+                continue
+            except ValueError as e:
+                response = e
+        print(f"❌ {name} 提取失败: {response}")
+        outcomes.append((name, digest, None, str(response)))
+    return outcomes
+
+def _run_in_order(chapters, stale, manifest, run):
+    """按章节顺序提取 stale 中的章节，每章以此前各章（复用或刚提取的结果）合并后的状态作为前文"""
+    stale_names = {name for name, _, _ in stale}
+    prior_results = []
+    outcomes = []
+    for name, text, digest in chapters:
+        if name in stale_names:
+            prior_state = smart_extractor.merge_window_results(prior_results) if prior_results else None
+            outcome = run((name, text, digest), prior_state)
+            outcomes.append(outcome)
+            result = outcome[2]
+        else:
+            result = manifest[name]["result"]
+        if result is not None:
+            prior_results.append({"window_index": len(prior_results), "context_info": name, "result": result, "success": True})
+    return outcomes
+
+def extract_incremental(chapter_paths, model_name=None, order_dependent=False, max_workers=1,
+                        window_size=8000, overlap=1500, use_async=False, bypass_cache=False):
+    """
+    增量提取章节状态。
+    Args:
+        chapter_paths: 按阅读顺序排列的章节文件路径
+        model_name: 模型名称
+        order_dependent: 为真时，首个变更章节之后的所有章节都重新提取，并按章节顺序逐章进行：
+            每章的提示词附带此前各章合并后的状态（忽略 max_workers / use_async，不使用响应缓存）
+        max_workers: 最大并发请求数
+        window_size / overlap: 超长章节的分窗参数
+        use_async: 短章节通过异步客户端批量提取（RPM/TPM 限流 + 自适应并发）
+        bypass_cache: 跳过响应缓存读取，强制重新调用模型
+    Returns:
+        (合并后的提取结果, 报告 {"extracted", "reused", "failed"})
+    """
+    manifest = load_manifest()
+    report = {"extracted": [], "reused": [], "failed": []}
+
+    chapters = []
+    for path in chapter_paths:
+        name = os.path.basename(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        chapters.append((name, text, content_hash(text)))
+
+    # 找出需要重新提取的章节
+    stale = []
+    changed_seen = False
+    for name, text, digest in chapters:
+        entry = manifest.get(name)
+        unchanged = entry is not None and entry.get("hash") == digest and entry.get("result") is not None
+        if not unchanged:
+            changed_seen = True
+        if not unchanged or (order_dependent and changed_seen):
+            stale.append((name, text, digest))
+        else:
+            report["reused"].append(name)
+
+    print(f"📚 增量提取: 共 {len(chapters)} 章，需重新提取 {len(stale)} 章，复用 {len(report['reused'])} 章")
+
+    def _run(item, prior_state=None):
+        name, text, digest = item
+        start = time.perf_counter()
+        try:
+            result = _extract_chapter(name, text, model_name, window_size, overlap, prior_state, bypass_cache)
+            print(f"✅ {name} 提取完成 ({time.perf_counter() - start:.1f}s)")
+            return name, digest, result, None
+        except Exception as e:
+            print(f"❌ {name} 提取失败: {e}")
+            return name, digest, None, str(e)
+
+    workers = max(1, min(int(max_workers or 1), len(stale) or 1))
+    outcomes = []
+    if order_dependent:
+        outcomes = _run_in_order(chapters, stale, manifest, _run)
+        stale = []
+    elif use_async:
+        # 短章节一次批量请求；超长章节仍走分窗提取
+        short = [item for item in stale if len(item[1]) <= window_size]
+        stale = [item for item in stale if len(item[1]) > window_size]
+        outcomes.extend(_run_async(short, model_name, workers, bypass_cache))
+    if workers == 1:
+        outcomes.extend(_run(item) for item in stale)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes.extend(executor.map(_run, stale))
+
+    now = datetime.datetime.now().isoformat()
+    for name, digest, result, error in outcomes:
+        if error is None:
+            manifest[name] = {"hash": digest, "result": result, "extracted_at": now}
+            report["extracted"].append(name)
+        else:
+            report["failed"].append(name)
+
+    # 移除已删除章节的记录，避免残留结果被合并
+    current_names = {name for name, _, _ in chapters}
+    manifest = {name: entry for name, entry in manifest.items() if name in current_names}
+    save_manifest(manifest)
+
+    # 按章节顺序折叠已保存的结果（失败章节若有旧结果也不参与，避免状态错位）
+    failed = set(report["failed"])
+    window_results = []
+    for i, (name, _, _) in enumerate(chapters):
+        entry = manifest.get(name)
+        if name in failed or entry is None:
+            window_results.append({"window_index": i, "context_info": name, "error": "提取失败", "success": False})
+        else:
+            window_results.append({"window_index": i, "context_info": name, "result": entry["result"], "success": True})
+
+    merged = smart_extractor.merge_window_results(window_results)
+    return merged, report
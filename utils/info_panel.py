@@ -3,7 +3,7 @@ import os
 import glob
 import re
 import config
-from utils import state_manager, context_manager
+from utils import state_manager, context_manager, file_cache
 
 def load_character_state():
     """加载并格式化角色状态信息"""
@@ -17,8 +17,7 @@ def load_character_state():
 def load_active_foreshadowing():
     """加载活跃伏笔信息（状态为pending的伏笔）"""
     try:
-        all_foreshadowing = state_manager.get_foreshadowing()
-        active_foreshadowing = [f for f in all_foreshadowing if f.get('status') == 'pending']
+        active_foreshadowing = state_manager.get_foreshadowing(status='pending')
         return active_foreshadowing if active_foreshadowing else []
     except Exception as e:
         print(f"加载活跃伏笔失败: {e}")
@@ -33,10 +32,9 @@ def load_setting_files():
         for file_path in setting_files:
             filename = os.path.basename(file_path)
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content:  # 只添加非空内容
-                        settings_content[filename] = content
+                content = file_cache.read_text(file_path).strip()
+                if content:  # 只添加非空内容
+                    settings_content[filename] = content
             except Exception as e:
                 print(f"读取设定文件 {filename} 失败: {e}")
                 
@@ -54,16 +52,15 @@ def get_recent_chapters_summary(n=5):
         summary = []
         for file_path in recent_files:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    # 提取章节标题和简要内容
-                    filename = os.path.basename(file_path)
-                    # 获取前200字符作为概要
-                    preview = content[:200] + "..." if len(content) > 200 else content
-                    summary.append({
-                        "title": filename,
-                        "preview": preview
-                    })
+                content = file_cache.read_text(file_path)
+                # 提取章节标题和简要内容
+                filename = os.path.basename(file_path)
+                # 获取前200字符作为概要
+                preview = content[:200] + "..." if len(content) > 200 else content
+                summary.append({
+                    "title": filename,
+                    "preview": preview
+                })
             except Exception as e:
                 print(f"读取章节 {file_path} 失败: {e}")
                 
@@ -0,0 +1,167 @@
+"""
+容错 JSON 解析
+模型返回的 JSON 常见问题：外面包着 Markdown 代码块或说明文字、被截断（字符串/数组/对象未闭合）、
+多余的逗号、字符串里夹着未转义的引号或换行。
+先走标准 json.loads；失败时用一个基于栈的单遍解析器直接构造结果，耗时与响应长度成线性关系。
+"""
+
+import json
+import re
+
+_NUMBER_RE = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$')
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_CLOSERS = {"}": dict, "]": list}
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+# 字符串结束引号之后允许出现的字符；其它字符说明这个引号是正文里未转义的引号
+_AFTER_STRING = set(',:}]')
+
+class JSONRepairError(ValueError):
+    pass
+
+_MISSING = object()
+
+def strip_code_fence(text):
+    """去掉首尾的 ```json ... ``` 标记"""
+    text = text.strip()
+    if text.startswith("```"):
+        newline = text.find("\n")
+        text = text[newline + 1:] if newline != -1 else text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+def _read_string(text, i, quote):
+    """从开引号之后读取字符串，返回 (值, 下一个位置)；到达结尾时视为被截断"""
+    n = len(text)
+    chars = []
+    while i < n:
+        ch = text[i]
+        if ch == '\\':
+            if i + 1 >= n:
+                i += 1
+                break
+            nxt = text[i + 1]
+            if nxt == 'u' and i + 6 <= n:
+                try:
+                    chars.append(chr(int(text[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                except ValueError:
+                    pass
+            chars.append(_ESCAPES.get(nxt, nxt))
+            i += 2
+            continue
+        if ch == quote:
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j >= n or text[j] in _AFTER_STRING or text[j] == '`':
+                return "".join(chars), i + 1
+            # 后面紧跟普通文字：正文里未转义的引号，保留为字符
+        chars.append(ch)
+        i += 1
+    return "".join(chars), i
+
+def _read_bare(text, i):
+    """读取未加引号的标量（数字、true/false/null 或裸字符串）"""
+    n = len(text)
+    start = i
+    while i < n and text[i] not in ',:}]\n' and text[i] not in '{["':
+        i += 1
+    token = text[start:i].strip()
+    if token in _LITERALS:
+        return _LITERALS[token], i
+    if _NUMBER_RE.match(token):
+        try:
+            return (float(token) if any(c in token for c in '.eE') else int(token)), i
+        except ValueError:
+            pass
+    return token, i
+
+def _find_start(text):
+    positions = [p for p in (text.find('{'), text.find('[')) if p != -1]
+    if not positions:
+        raise JSONRepairError("响应中没有 JSON 对象或数组")
+    return min(positions)
+
+def repair(text):
+    """
+    单遍容错解析，返回第一个顶层对象/数组。
+    未闭合的字符串、数组、对象在结尾处自动闭合；对象中只有键没有值的残缺项被丢弃。
+    """
+    i = _find_start(text)
+    n = len(text)
+    root = None
+    # 栈元素: [容器, 对象中已读到但尚未赋值的键]
+    stack = []
+
+    def _attach(value):
+        frame = stack[-1]
+        container = frame[0]
+        if isinstance(container, list):
+            container.append(value)
+        elif frame[1] is None:
+            frame[1] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        else:
+            container[frame[1]] = value
+            frame[1] = None
+
+    while i < n:
+        ch = text[i]
+        if ch in '{[':
+            container = {} if ch == '{' else []
+            if stack:
+                _attach(container)
+            else:
+                root = container
+            stack.append([container, None])
+            i += 1
+        elif ch in '}]':
+            # 括号类型不匹配时向外弹出到匹配的一层
+            expected = _CLOSERS[ch]
+            while stack and not isinstance(stack[-1][0], expected):
+                stack.pop()
+            if stack:
+                stack.pop()
+            i += 1
+            if not stack:
+                break
+        elif ch in ',:' or ch.isspace():
+            i += 1
+        elif not stack:
+            break
+        elif ch in '"\'“':
+            # 中文左引号作为分隔符时以右引号结束
+            value, i = _read_string(text, i + 1, '”' if ch == '“' else ch)
+            _attach(value)
+        elif ch == '/' and text.startswith('//', i):
+            newline = text.find('\n', i)
+            i = n if newline == -1 else newline + 1
+        else:
+            value, i = _read_bare(text, i)
+            _attach(value)
+
+    if root is None:
+        raise JSONRepairError("未能解析出 JSON 结构")
+    return root
+
+def loads(text, default=_MISSING):
+    """
+    解析模型返回的 JSON：先尝试标准解析，失败再单遍修复。
+    提供 default 时解析失败返回 default，否则抛出 JSONRepairError。
+    """
+    if not isinstance(text, str):
+        if default is _MISSING:
+            raise JSONRepairError("输入不是字符串")
+        return default
+    clean = strip_code_fence(text)
+    try:
+        return json.loads(clean)
+    except ValueError:
+        pass
+    try:
+        return repair(clean)
+    except JSONRepairError:
+        if default is _MISSING:
+            raise
+        return default
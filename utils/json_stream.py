@@ -0,0 +1,155 @@
+"""
+流式 JSON 分段解析
+逐段喂入模型的流式输出，顶层对象中的每个字段（shen_yi、enemy_tracker、ledger_update……）
+一闭合就立即解析并产出，界面可以边生成边展示；响应被截断（如达到 max_tokens）时，
+已经完整输出的字段依然可用。扫描只处理新到达的增量，总耗时与响应长度成线性关系。
+"""
+
+import json
+from utils import json_repair
+
+def _decode(text):
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json_repair.loads(text, default=text)
+
+class SectionParser:
+    """
+    用法：
+        parser = SectionParser()
+        for delta in llm_client.stream_content(prompt):
+            for key, value in parser.feed(delta):
+                ...
+        result = parser.finish()
+    """
+
+    def __init__(self):
+        # 已完成的顶层字段，按出现顺序
+        self.sections = {}
+        # 根对象是否已闭合
+        self.done = False
+        # finish() 时从截断处抢救出的字段名
+        self.partial_key = None
+        # parse_stream 中途断流时的异常
+        self.error = None
+        self._chunks = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        # 正在收集的键字符串 / 字段值文本（跨增量时分段保存）
+        self._key_parts = None
+        self._value_parts = None
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def _complete(self, tail):
+        value = _decode("".join(self._value_parts) + tail)
+        self.sections[self._key] = value
+        completed = (self._key, value)
+        self._key = None
+        self._value_parts = None
+        return completed
+
+    def feed(self, delta):
+        """喂入一段增量，返回本次新完成的 [(字段名, 值), ...]"""
+        completed = []
+        if self.done or not delta:
+            return completed
+        self._chunks.append(delta)
+        key_start = 0 if self._key_parts is not None else None
+        value_start = 0 if self._value_parts is not None else None
+
+        for i, ch in enumerate(delta):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if key_start is not None:
+                        self._key = _decode("".join(self._key_parts) + delta[key_start:i + 1])
+                        self._key_parts = None
+                        key_start = None
+                continue
+            if not self._started:
+                # 跳过代码块标记和前置说明文字
+                if ch == '{':
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and value_start is None:
+                    self._key_parts = []
+                    key_start = i
+            elif ch == ':' and self._depth == 1 and value_start is None and self._key is not None:
+                self._value_parts = []
+                value_start = i + 1
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    if value_start is not None:
+                        completed.append(self._complete(delta[value_start:i]))
+                        value_start = None
+                    self.done = True
+                    break
+            elif ch == ',' and self._depth == 1 and value_start is not None:
+                completed.append(self._complete(delta[value_start:i]))
+                value_start = None
+
+        if key_start is not None:
+            self._key_parts.append(delta[key_start:])
+        if value_start is not None:
+            self._value_parts.append(delta[value_start:])
+        return completed
+
+    def finish(self, salvage_partial=True):
+        """
+        流结束时调用，返回解析结果 dict。
+        根对象未闭合时，salvage_partial 为真则用容错解析抢救最后一个未完成的字段（记录在 partial_key）。
+        """
+        if not self.done and salvage_partial and self._value_parts is not None and self._key is not None:
+            # 包一层数组，使截断的字符串/数字也能走容错解析
+            wrapped = json_repair.loads("[" + "".join(self._value_parts), default=None)
+            if wrapped:
+                self.sections[self._key] = wrapped[0]
+                self.partial_key = self._key
+        if not self.sections:
+            # 不是预期的顶层对象（如模型只返回了数组），退回整体容错解析
+            data = json_repair.loads(self.text, default=None)
+            if isinstance(data, dict):
+                return data
+        return dict(self.sections)
+
+def parse_stream(deltas, on_section=None):
+    """
+    消费增量迭代器并解析。
+    Args:
+        deltas: 文本增量迭代器（如 llm_client.stream_content 的返回值）
+        on_section: 可选回调 on_section(字段名, 值)，每个顶层字段完成时调用
+    Returns:
+        (结果 dict, parser)
+    流在中途断开时，只要已有字段完成就返回已完成部分（parser.error 记录异常），否则原样抛出。
+    """
+    parser = SectionParser()
+    try:
+        for delta in deltas:
+            for key, value in parser.feed(delta):
+                if on_section:
+                    on_section(key, value)
+    except Exception as e:
+        if not parser.sections:
+            raise
+        parser.error = e
+        print(f"⚠️ 流式响应中断，保留已完成的 {len(parser.sections)} 个字段: {e}")
+    return parser.finish(), parser
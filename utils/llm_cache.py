@@ -0,0 +1,181 @@
+"""
+LLM 响应缓存
+以 (model, prompt, temperature, max_tokens) 的哈希为键，将模型响应持久化到磁盘。
+重复执行全量提取、设定分析等确定性提示词时直接命中缓存，不再重复计费。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import config
+
+# 默认参数（可通过环境变量 LLM_CACHE_MAX_MB / LLM_CACHE_TTL / LLM_CACHE_BYPASS 覆盖）
+DEFAULT_MAX_MB = 200
+DEFAULT_TTL = 7 * 24 * 3600  # 秒
+# 每写入 RESCAN_EVERY 次重新扫描一次目录，纠正其它进程写入或手动删除造成的偏差
+RESCAN_EVERY = 500
+# 超限时淘汰到上限的这个比例，避免缓存满后每次写入都触发扫描
+EVICT_TARGET = 0.9
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0}
+# 缓存目录 -> 总字节数（首次写入时扫描得到，之后随写入/删除增减）
+_size_totals = {}
+
+def _cache_dir():
+    return os.path.join(config.DIR_CACHE, "llm_responses")
+
+def _get_limits():
+    try:
+        max_bytes = float(os.environ.get("LLM_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+    except ValueError:
+        max_bytes = DEFAULT_MAX_MB * 1024 * 1024
+    try:
+        ttl = float(os.environ.get("LLM_CACHE_TTL", DEFAULT_TTL))
+    except ValueError:
+        ttl = DEFAULT_TTL
+    return max_bytes, ttl
+
+def bypass_enabled():
+    """全局绕过开关：为真时不读缓存（仍会写入新响应）"""
+    return os.environ.get("LLM_CACHE_BYPASS", "0").lower() in ("1", "true", "yes")
+
+def make_key(model, prompt, temperature, max_tokens):
+    payload = json.dumps([model, prompt, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _entry_path(key):
+    return os.path.join(_cache_dir(), key[:2], f"{key}.json")
+
+def get(key):
+    """
+    读取缓存。未命中或已过期返回 None。
+    命中时刷新文件 mtime，作为 LRU 淘汰依据。
+    """
+    path = _entry_path(key)
+    _, ttl = _get_limits()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        with _lock:
+            _stats["misses"] += 1
+        return None
+
+    if ttl > 0 and time.time() - entry.get("created_at", 0) > ttl:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            _adjust_total(-size)
+        except OSError:
+            pass
+        with _lock:
+            _stats["misses"] += 1
+            _stats["expired"] += 1
+        return None
+
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    with _lock:
+        _stats["hits"] += 1
+    return entry.get("response")
+
+def put(key, response, model=""):
+    """写入缓存（先写临时文件再替换，避免并发读到半截内容）"""
+    if response is None:
+        return
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {"model": model, "created_at": time.time(), "response": response}
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f, ensure_ascii=False)
+    delta = os.path.getsize(tmp_path)
+    try:
+        delta -= os.path.getsize(path)
+    except OSError:
+        pass
+    os.replace(tmp_path, path)
+    _adjust_total(delta)
+    with _lock:
+        _stats["writes"] += 1
+    _evict_if_needed()
+
+def _adjust_total(delta):
+    with _lock:
+        root = _cache_dir()
+        if root in _size_totals:
+            _size_totals[root] += delta
+
+def _iter_entries():
+    root = _cache_dir()
+    if not os.path.isdir(root):
+        return
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(".json"):
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+def _evict_if_needed():
+    """
+    总大小超过上限时，按最近访问时间从旧到新淘汰到上限的 EVICT_TARGET。
+    平时只比较内存中的累计大小；首次写入、累计值超过上限或每 RESCAN_EVERY 次写入时才扫描目录。
+    """
+    max_bytes, _ = _get_limits()
+    root = _cache_dir()
+    with _lock:
+        total = _size_totals.get(root)
+        rescan = total is None or _stats["writes"] % RESCAN_EVERY == 0
+    if not rescan and total <= max_bytes:
+        return
+
+    entries = list(_iter_entries())
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    if total > max_bytes:
+        entries.sort(key=lambda e: e[2])
+        for path, size, _ in entries:
+            if total <= max_bytes * EVICT_TARGET:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                continue
+    with _lock:
+        _size_totals[root] = total
+        _stats["evictions"] += evicted
+
+def clear():
+    """清空全部缓存文件，返回删除的条目数"""
+    removed = 0
+    for path, _, _ in list(_iter_entries()):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    with _lock:
+        _size_totals.pop(_cache_dir(), None)
+    return removed
+
+def get_stats():
+    """返回命中/未命中计数及磁盘占用"""
+    entries = list(_iter_entries())
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    stats["entries"] = len(entries)
+    stats["size_mb"] = round(sum(size for _, size, _ in entries) / 1024 / 1024, 2)
+    return stats
@@ -1,11 +1,34 @@
+import contextlib
 import os
+import threading
+import time
+from urllib.parse import urlparse
 import google.generativeai as genai
-from tenacity import retry, stop_after_attempt, wait_fixed
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_fixed
 from openai import OpenAI
+from utils import extraction_schema, json_repair, llm_cache, stream_handler
 
 # Global clients configuration
 CURRENT_PROVIDER = "openai" # 统一使用 OpenAI 兼容模式
 
+# 连接池默认参数（可通过环境变量 LLM_POOL_MAXSIZE / LLM_POOL_IDLE_TIMEOUT 覆盖）
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_POOL_IDLE_TIMEOUT = 300  # 秒，超过该时长未使用（且没有进行中的请求）的客户端会被回收
+REQUEST_TIMEOUT = 300
+
+# 生成参数（同时参与响应缓存键的计算；temperature 仅公司平台显式传入）
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_MAX_TOKENS = 4096
+
+# 结构化输出依次尝试的方式：JSON Schema 约束 -> JSON 模式 -> 仅靠提示词（本地校验兜底）
+STRUCTURED_MODES = ("json_schema", "json_object", "prompt")
+
+# 进程级客户端注册表: (base_url, api_key, provider) -> 池化客户端条目
+_client_registry = {}
+_registry_lock = threading.Lock()
+# (base_url, model) -> 服务端实际支持的第一种结构化方式，避免每次都被拒绝一轮
+_structured_support = {}
+
 def configure():
     """
     确保从环境变量或 session_state 获取最新的配置。
@@ -16,49 +39,359 @@ def configure():
     # 这里不需要抛出异常，因为有些配置可能在运行时通过 UI 输入
     pass
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(2), reraise=True)
-def generate_content(prompt, model_name=None, stream=False):
+def _get_pool_settings():
+    """读取连接池配置（每次调用时读取，兼容运行时通过 UI 修改环境变量）"""
+    try:
+        maxsize = int(os.environ.get("LLM_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE))
+    except ValueError:
+        maxsize = DEFAULT_POOL_MAXSIZE
+    try:
+        idle_timeout = float(os.environ.get("LLM_POOL_IDLE_TIMEOUT", DEFAULT_POOL_IDLE_TIMEOUT))
+    except ValueError:
+        idle_timeout = DEFAULT_POOL_IDLE_TIMEOUT
+    return max(1, maxsize), idle_timeout
+
+def _is_company_platform(base_url):
+    # 自动识别内网 IP 或特定端口作为公司平台
+    return bool(base_url) and (":9005" in base_url or "45.78" in base_url)
+
+def _strip_bearer(api_key):
+    return api_key if not api_key.startswith("Bearer ") else api_key.replace("Bearer ", "")
+
+def _create_client(base_url, api_key, provider):
+    """按 provider 创建带 keep-alive 连接池的底层客户端"""
+    maxsize, _ = _get_pool_settings()
+
+    if provider == "company":
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=maxsize, pool_maxsize=maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    import httpx
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=maxsize, max_keepalive_connections=maxsize),
+        timeout=REQUEST_TIMEOUT
+    )
+    return OpenAI(
+        api_key=_strip_bearer(api_key),
+        base_url=base_url if base_url else None,
+        timeout=REQUEST_TIMEOUT,
+        http_client=http_client
+    )
+
+def _close_client(client):
+    try:
+        client.close()
+    except Exception as e:
+        print(f"⚠️ 关闭连接池客户端失败: {e}")
+
+def evict_idle_clients(idle_timeout=None):
+    """
+    回收超过空闲时长且没有进行中请求的客户端，释放其连接池。
+    Returns:
+        被回收的客户端数量
+    """
+    if idle_timeout is None:
+        _, idle_timeout = _get_pool_settings()
+
+    now = time.monotonic()
+    evicted = []
+    with _registry_lock:
+        for key, entry in list(_client_registry.items()):
+            if entry["active"] == 0 and now - entry["last_used"] > idle_timeout:
+                evicted.append(_client_registry.pop(key)["client"])
+
+    for client in evicted:
+        _close_client(client)
+    return len(evicted)
+
+def _acquire(base_url, api_key, provider):
+    """取出（必要时创建）池化客户端条目，并登记一次进行中的使用"""
+    evict_idle_clients()
+
+    key = (base_url or "", api_key, provider)
+    with _registry_lock:
+        entry = _client_registry.get(key)
+        if entry is None:
+            entry = {
+                "client": _create_client(base_url, api_key, provider),
+                "created_at": time.monotonic(),
+                "last_used": time.monotonic(),
+                "uses": 0,
+                "active": 0,
+                "closed": False
+            }
+            _client_registry[key] = entry
+        entry["last_used"] = time.monotonic()
+        entry["uses"] += 1
+        entry["active"] += 1
+        return entry
+
+def _release(entry):
+    """结束一次使用：刷新 last_used；条目已被 close_all_clients 移出且无人使用时关闭客户端"""
+    with _registry_lock:
+        entry["active"] -= 1
+        entry["last_used"] = time.monotonic()
+        close = entry["closed"] and entry["active"] == 0
+    if close:
+        _close_client(entry["client"])
+
+@contextlib.contextmanager
+def lease_client(base_url, api_key, provider="openai"):
+    """
+    在 with 块内租用池化客户端：租用期间不会被空闲回收，归还时刷新空闲计时。
+    同一 (base_url, api_key, provider) 共享一个连接池，避免每次调用都重新握手。
+    provider: "openai" 为 OpenAI SDK 客户端；"company" 为 requests.Session
+    """
+    entry = _acquire(base_url, api_key, provider)
+    try:
+        yield entry["client"]
+    finally:
+        _release(entry)
+
+def _leased_iter(entry, iterator):
+    """流式响应迭代结束（或被关闭）后才归还客户端"""
+    try:
+        yield from iterator
+    finally:
+        _release(entry)
+
+def get_client(base_url, api_key, provider="openai"):
+    """
+    获取进程级复用的客户端（不登记租用，调用期间可能被空闲回收；长时间调用请使用 lease_client）。
+    provider: "openai" 返回 OpenAI SDK 客户端；"company" 返回 requests.Session
+    """
+    entry = _acquire(base_url, api_key, provider)
+    _release(entry)
+    return entry["client"]
+
+def close_all_clients():
+    """关闭并清空所有池化客户端（如切换 API 配置后手动释放）；使用中的客户端在归还时关闭"""
+    with _registry_lock:
+        entries = list(_client_registry.values())
+        _client_registry.clear()
+        for entry in entries:
+            entry["closed"] = True
+        idle = [entry["client"] for entry in entries if entry["active"] == 0]
+    for client in idle:
+        _close_client(client)
+
+def get_pool_stats():
+    """返回当前连接池注册表的统计信息（不含密钥）"""
+    now = time.monotonic()
+    with _registry_lock:
+        return [
+            {
+                "base_url": key[0],
+                "provider": key[2],
+                "uses": entry["uses"],
+                "active": entry["active"],
+                "idle_seconds": round(now - entry["last_used"], 1)
+            }
+            for key, entry in _client_registry.items()
+        ]
+
+def _resolve_model(model_name):
+    return model_name if model_name else os.environ.get("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
+
+def _effective_temperature():
+    # 标准 OpenAI 路径不传 temperature，使用服务端默认值
+    return DEFAULT_TEMPERATURE if _is_company_platform(os.environ.get("OPENAI_BASE_URL")) else None
+
+def generate_content(prompt, model_name=None, stream=False, use_cache=False, bypass_cache=False):
     """
     统一内容生成函数。
+    use_cache: 为确定性提示词（提取/分析类）开启磁盘响应缓存
+    bypass_cache: 跳过缓存读取强制调用模型（结果仍会写回缓存）
+    """
+    target_model = _resolve_model(model_name)
+    
+    cache_key = None
+    if use_cache:
+        cache_key = llm_cache.make_key(target_model, prompt, _effective_temperature(), DEFAULT_MAX_TOKENS)
+        if not (bypass_cache or llm_cache.bypass_enabled()):
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+    
+    if stream:
+        # 流式调用：在此处拼接增量，保证返回值与非流式一致
+        response = "".join(_open_stream(prompt, target_model))
+    else:
+        response = _generate_uncached(prompt, target_model)
+    if cache_key:
+        llm_cache.put(cache_key, response, model=target_model)
+    return response
+
+def stream_content(prompt, model_name=None, use_cache=False, bypass_cache=False):
     """
+    流式内容生成：逐段产出模型返回的文本增量，适合边生成边渲染。
+    use_cache 为真且命中缓存时，一次性产出完整缓存内容；bypass_cache 同 generate_content。
+    """
+    target_model = _resolve_model(model_name)
+    
+    cache_key = None
+    if use_cache:
+        cache_key = llm_cache.make_key(target_model, prompt, _effective_temperature(), DEFAULT_MAX_TOKENS)
+        if not (bypass_cache or llm_cache.bypass_enabled()):
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+    
+    parts = []
+    for delta in _open_stream(prompt, target_model):
+        parts.append(delta)
+        yield delta
+    
+    # 只缓存完整结束的流，中途中断不写入
+    if cache_key:
+        llm_cache.put(cache_key, "".join(parts), model=target_model)
+
+def _structured_modes():
+    """LLM_STRUCTURED_MODE: auto（默认，逐级降级）/ json_schema / json_object / prompt"""
+    mode = os.getenv("LLM_STRUCTURED_MODE", "auto").strip().lower()
+    if mode in STRUCTURED_MODES:
+        return STRUCTURED_MODES[STRUCTURED_MODES.index(mode):]
+    return STRUCTURED_MODES
+
+def _response_format(mode, schema, schema_name):
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": schema_name, "schema": schema, "strict": False}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+def _is_format_rejection(error):
+    """服务端不支持 response_format 时通常返回 400/422"""
+    status = getattr(error, "status_code", None)
+    text = str(error)
+    return status in (400, 422) or "API Error 400" in text or "API Error 422" in text or "response_format" in text
+
+def generate_structured(prompt, schema, schema_name="extraction", model_name=None, use_cache=False, bypass_cache=False):
+    """
+    结构化输出：按服务端能力使用 json_schema / json_object 约束输出格式，
+    不支持时退回普通调用；结果统一经容错解析与结构校验后返回 dict。
+    use_cache / bypass_cache 同 generate_content。
+    Raises:
+        ValueError: 响应无法解析为 JSON 对象
+    """
+    target_model = _resolve_model(model_name)
+    base_url = os.environ.get("OPENAI_BASE_URL")
+
+    # 与 generate_content 共用缓存键：缓存的是原始文本，本地校验对两种调用一致
+    cache_key = None
+    response = None
+    if use_cache:
+        cache_key = llm_cache.make_key(target_model, prompt, _effective_temperature(), DEFAULT_MAX_TOKENS)
+        if not (bypass_cache or llm_cache.bypass_enabled()):
+            response = llm_cache.get(cache_key)
+
+    if response is None:
+        modes = _structured_modes()
+        support_key = (base_url, target_model)
+        if support_key in _structured_support and _structured_support[support_key] in modes:
+            modes = modes[modes.index(_structured_support[support_key]):]
+        for mode in modes:
+            try:
+                response = _generate_uncached(prompt, target_model, response_format=_response_format(mode, schema, schema_name))
+            except Exception as e:
+                if mode != "prompt" and _is_format_rejection(e):
+                    print(f"⚠️ 服务端不支持 {mode} 结构化输出，降级重试: {e}")
+                    continue
+                raise
+            _structured_support[support_key] = mode
+            break
+
+    data = extraction_schema.normalize(json_repair.loads(response), schema)
+    # 只缓存能解析的响应
+    if cache_key:
+        llm_cache.put(cache_key, response, model=target_model)
+    return data
+
+def _build_company_request(prompt, target_model, base_url, api_key, stream):
+    full_url = f"{base_url}/chat/completions" if not base_url.endswith('/chat/completions') else base_url
+    headers = {
+        "Authorization": api_key if api_key.startswith("Bearer ") else f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "User-Agent": "StreamlitApp/2.0"
+    }
+    # 提取 Host (处理 http://... 或 https://... 情况)
+    host_header = urlparse(base_url).netloc
+    if host_header: headers["Host"] = host_header
+    
+    payload = {
+        "model": target_model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": DEFAULT_TEMPERATURE,
+        "max_tokens": DEFAULT_MAX_TOKENS,
+        "stream": stream
+    }
+    return full_url, headers, payload
+
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(2), reraise=True)
+def _open_stream(prompt, target_model):
+    """
+    建立流式连接并返回文本增量迭代器。
+    重试只覆盖建立连接阶段；开始产出内容后出错直接抛出，避免重复输出。
+    """
+    base_url = os.environ.get("OPENAI_BASE_URL")
+    api_key = os.environ.get("OPENAI_API_KEY")
+    
+    if not api_key:
+        raise ValueError("❌ 错误：未检测到 API 密钥。请在侧边栏配置或检查 .env 文件。")
+
+    if _is_company_platform(base_url):
+        full_url, headers, payload = _build_company_request(prompt, target_model, base_url, api_key, stream=True)
+        entry = _acquire(base_url, api_key, "company")
+        try:
+            response = entry["client"].post(full_url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT, stream=True)
+            if response.status_code != 200:
+                raise Exception(f"API Error {response.status_code}: {response.text}")
+        except Exception:
+            _release(entry)
+            raise
+        return _leased_iter(entry, stream_handler.iter_sse_deltas(response))
+
+    entry = _acquire(base_url, api_key, "openai")
+    try:
+        response = entry["client"].chat.completions.create(
+            model=target_model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=DEFAULT_MAX_TOKENS,
+            stream=True
+        )
+    except Exception:
+        _release(entry)
+        raise
+    return _leased_iter(entry, (chunk.choices[0].delta.content for chunk in response
+                                if chunk.choices and chunk.choices[0].delta.content))
+
+# 请求参数被拒绝（400/422）重试也不会成功，直接抛出交给结构化输出降级
+@retry(stop=stop_after_attempt(3), wait=wait_fixed(2), reraise=True, retry=retry_if_exception(lambda e: not _is_format_rejection(e)))
+def _generate_uncached(prompt, target_model, response_format=None):
     # 优先使用环境变量（.env），如果为空则由 app.py 通过会话状态动态设置
     base_url = os.environ.get("OPENAI_BASE_URL")
     api_key = os.environ.get("OPENAI_API_KEY")
-    target_model = model_name if model_name else os.environ.get("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
     
     if not api_key:
         raise ValueError("❌ 错误：未检测到 API 密钥。请在侧边栏配置或检查 .env 文件。")
 
     # 逻辑适配：针对公司测试平台或标准 OpenAI 平台
-    # 自动识别内网 IP 或特定端口作为公司平台
-    is_company_platform = base_url and (":9005" in base_url or "45.78" in base_url)
-    
-    # 提取 Host (处理 http://... 或 https://... 情况)
-    from urllib.parse import urlparse
-    parsed_url = urlparse(base_url) if base_url else None
-    host_header = parsed_url.netloc if parsed_url else None
+    is_company_platform = _is_company_platform(base_url)
 
     if is_company_platform:
-        import requests
-        import json
-        
-        full_url = f"{base_url}/chat/completions" if not base_url.endswith('/chat/completions') else base_url
-        headers = {
-            "Authorization": api_key if api_key.startswith("Bearer ") else f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "User-Agent": "StreamlitApp/2.0"
-        }
-        if host_header: headers["Host"] = host_header
+        full_url, headers, payload = _build_company_request(prompt, target_model, base_url, api_key, stream=False)
+        if response_format:
+            payload["response_format"] = response_format
         
-        payload = {
-            "model": target_model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7,
-            "max_tokens": 4096,
-            "stream": stream
-        }
-        
-        response = requests.post(full_url, headers=headers, json=payload, timeout=300)
+        with lease_client(base_url, api_key, provider="company") as session:
+            response = session.post(full_url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
             return response.json()["choices"][0]["message"]["content"]
         else:
@@ -66,17 +399,14 @@ def generate_content(prompt, model_name=None, stream=False):
             
     else:
         # 标准 OpenAI 兼容 API
-        client = OpenAI(
-            api_key=api_key if not api_key.startswith("Bearer ") else api_key.replace("Bearer ", ""),
-            base_url=base_url if base_url else None,
-            timeout=300
-        )
-        
-        response = client.chat.completions.create(
-            model=target_model,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=4096
-        )
+        extra = {"response_format": response_format} if response_format else {}
+        with lease_client(base_url, api_key, provider="openai") as client:
+            response = client.chat.completions.create(
+                model=target_model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=DEFAULT_MAX_TOKENS,
+                **extra
+            )
         return response.choices[0].message.content
 
 def chat_with_model(history, new_message, model_name=None):
@@ -85,18 +415,13 @@ def chat_with_model(history, new_message, model_name=None):
     """
     base_url = os.environ.get("OPENAI_BASE_URL")
     api_key = os.environ.get("OPENAI_API_KEY")
-    target_model = model_name if model_name else os.environ.get("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
+    target_model = _resolve_model(model_name)
 
-    client = OpenAI(
-        api_key=api_key if not api_key.startswith("Bearer ") else api_key.replace("Bearer ", ""),
-        base_url=base_url if base_url else None,
-        timeout=300
-    )
-    
     messages = history + [{"role": "user", "content": new_message}]
-    response = client.chat.completions.create(
-        model=target_model,
-        messages=messages,
-        max_tokens=4096
-    )
+    with lease_client(base_url, api_key, provider="openai") as client:
+        response = client.chat.completions.create(
+            model=target_model,
+            messages=messages,
+            max_tokens=DEFAULT_MAX_TOKENS
+        )
     return response.choices[0].message.content
@@ -0,0 +1,132 @@
+"""
+内存映射文本访问层
+以 mmap 只读映射大文本（原著、合并正文），按需解码所需片段，
+多个会话同时打开同一文件时共享操作系统页缓存，进程常驻内存不随文件大小增长。
+所有偏移默认以字节计；按字符访问通过稀疏检查点换算。
+"""
+
+import bisect
+import mmap
+import re
+
+# 每隔多少字节记录一个 (字节偏移, 字符偏移) 检查点
+CHECKPOINT_BYTES = 64 * 1024
+
+def _is_continuation(byte):
+    return 0x80 <= byte < 0xC0
+
+class MappedText:
+    """
+    UTF-8 文本文件的只读内存映射。
+    用法：
+        with MappedText(path) as text:
+            pos = text.find("关键词")
+            snippet = text.read_bytes(pos - 1500, pos + 3000)
+    """
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self._mm = b""
+        self._checkpoints = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __len__(self):
+        """字节长度"""
+        return len(self._mm)
+
+    def align(self, offset, forward=False):
+        """把字节偏移对齐到 UTF-8 字符边界（默认向前回退，forward=True 时向后推进）"""
+        offset = max(0, min(offset, len(self._mm)))
+        if forward:
+            while offset < len(self._mm) and _is_continuation(self._mm[offset]):
+                offset += 1
+        else:
+            while offset > 0 and offset < len(self._mm) and _is_continuation(self._mm[offset]):
+                offset -= 1
+        return offset
+
+    def read_bytes(self, start=0, end=None):
+        """按字节区间读取并解码，区间两端自动对齐到字符边界，不会截断多字节字符"""
+        end = len(self._mm) if end is None else end
+        start = self.align(start)
+        end = self.align(end)
+        if end <= start:
+            return ""
+        return self._mm[start:end].decode(self.encoding, errors='replace')
+
+    def find(self, text, start=0, end=None):
+        """查找子串，返回字节偏移，未找到返回 -1（UTF-8 自同步，按字节查找不会误命中半个字符）"""
+        end = len(self._mm) if end is None else end
+        return self._mm.find(text.encode(self.encoding), start, end)
+
+    def finditer(self, pattern, start=0, end=None):
+        """
+        在映射上直接执行字节正则，产出 re.Match（偏移为字节）。
+        str 模式会按 UTF-8 编码后编译：字面量中文没有问题，但含中文的字符类（如 [一二三]）
+        在字节层面无法正确匹配，此类模式请使用 iter_lines 逐行匹配。
+        """
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern.encode(self.encoding))
+        elif isinstance(pattern.pattern, str):
+            pattern = re.compile(pattern.pattern.encode(self.encoding), pattern.flags & ~re.UNICODE)
+        end = len(self._mm) if end is None else end
+        return pattern.finditer(self._mm, start, end)
+
+    def iter_lines(self, start=0):
+        """逐行产出 (字节偏移, 行文本)，行文本不含换行符"""
+        offset = start
+        size = len(self._mm)
+        while offset < size:
+            newline = self._mm.find(b"\n", offset)
+            line_end = size if newline == -1 else newline + 1
+            yield offset, self._mm[offset:line_end].decode(self.encoding, errors='replace').rstrip('\r\n')
+            offset = line_end
+
+    def _build_checkpoints(self):
+        checkpoints = [(0, 0)]
+        byte_pos, char_pos = 0, 0
+        size = len(self._mm)
+        while byte_pos < size:
+            next_pos = self.align(byte_pos + CHECKPOINT_BYTES)
+            if next_pos <= byte_pos:
+                next_pos = size
+            char_pos += len(self._mm[byte_pos:next_pos].decode(self.encoding, errors='replace'))
+            byte_pos = next_pos
+            checkpoints.append((byte_pos, char_pos))
+        self._checkpoints = checkpoints
+
+    def char_to_byte(self, char_offset):
+        """字符偏移换算为字节偏移（只解码检查点之间的一小段）"""
+        if self._checkpoints is None:
+            self._build_checkpoints()
+        char_offset = max(0, char_offset)
+        chars = [c for _, c in self._checkpoints]
+        i = max(0, bisect.bisect_right(chars, char_offset) - 1)
+        byte_pos, char_pos = self._checkpoints[i]
+        if char_pos == char_offset:
+            return byte_pos
+        segment_end = self._checkpoints[i + 1][0] if i + 1 < len(self._checkpoints) else len(self._mm)
+        segment = self._mm[byte_pos:segment_end].decode(self.encoding, errors='replace')
+        return byte_pos + len(segment[:char_offset - char_pos].encode(self.encoding))
+
+    def slice_chars(self, start=0, end=None):
+        """按字符区间读取，与 str[start:end] 语义一致（不支持负数下标）"""
+        start_byte = self.char_to_byte(start)
+        end_byte = len(self._mm) if end is None else self.char_to_byte(end)
+        return self.read_bytes(start_byte, end_byte)
@@ -1,6 +1,13 @@
+import hashlib
+import json
 import re
 import os
 import config
+from utils import chapter_index, mmap_text
+from utils.aho_corasick import AhoCorasick
+
+SNIPPET_BEFORE = 500
+SNIPPET_AFTER = 1000
 
 def parse_sample_file():
     """
@@ -19,8 +26,14 @@ def parse_sample_file():
     # Let's iterate lines.
     entries = []
     lines = content.split('\n')
+    source_chapter = ""
     
     for line in lines:
+        # Knowledge-base format keeps the chapter on its own line: > [出自哪一章]：第一章 妖魔乱世
+        source_match = re.search(r'\[出自哪一章\]：(.*)', line)
+        if source_match and '【原文查找指引：' not in line:
+            source_chapter = source_match.group(1).strip()
+            continue
         if '【原文查找指引：' in line:
             try:
                 # Extract Chapter
@@ -30,6 +43,10 @@ def parse_sample_file():
                 end_idx = line.find('【')
                 if start_idx != -1 and end_idx != -1:
                     chapter_part = line[start_idx+1:end_idx].strip()
+                    if not chapter_part:
+                        # Guide on its own line: use the preceding [出自哪一章] or "及第xx章"
+                        guide_match = re.search(r'及(第.+?章)', line)
+                        chapter_part = source_chapter or (guide_match.group(1) if guide_match else "")
                     
                     # Extract Keyword
                     # ...搜索关键词"堆积如山的灵石"...
@@ -42,6 +59,7 @@ def parse_sample_file():
                         "keyword": keyword,
                         "raw_line": line
                     })
+                    source_chapter = ""
             except Exception:
                 continue
     return entries
@@ -56,28 +74,19 @@ def find_original_segment(chapter_hint, keyword):
     if not os.path.exists(config.FILE_ORIGINAL):
         return "原著文件不存在"
 
-    # Optimization: If file is huge, caching chapter offsets would be better.
-    # For now, read full text.
-    with open(config.FILE_ORIGINAL, 'r', encoding='utf-8') as f:
-        full_text = f.read()
-
-    # 1. Find Chapter
-    # chapter_hint might be "第二百一十二章" or "212"
-    # Try to find the chapter header.
-    # Assuming headers are like "第xxx章" or just Chinese numbers.
-    # If hint contains "第二百一十二章", search for that.
-    
-    chapter_start = full_text.find(chapter_hint)
-    if chapter_start == -1:
-        # Try fuzzy match or simplified
-        return f"未找到章节: {chapter_hint}"
-
-    # Find next chapter to bound the search
-    # This is tricky without strict format. 
-    # Let's just search forward from chapter_start for the keyword.
-    
-    # Limit search scope to e.g. 20000 chars after chapter start
-    search_window = full_text[chapter_start : chapter_start + 20000]
+    # 1. Find Chapter via the persisted offset index
+    # chapter_hint might be "第二百一十二章" or "212", both resolve to the same entry.
+    chapter = chapter_index.find_chapter(chapter_hint)
+    if chapter is not None:
+        search_window = chapter_index.read_chapter(chapter)
+    else:
+        # Headers not recognised by the index: fall back to a plain text search over the mmap.
+        with mmap_text.MappedText(config.FILE_ORIGINAL) as original:
+            chapter_start = original.find(chapter_hint)
+            if chapter_start == -1:
+                return f"未找到章节: {chapter_hint}"
+            # Limit search scope to e.g. 20000 chars after chapter start (UTF-8 is at most 4 bytes per char)
+            search_window = original.read_bytes(chapter_start, chapter_start + 20000 * 4)[:20000]
     
     if not keyword:
         return search_window[:2000] + "..." # Return start of chapter if no keyword
@@ -87,7 +96,111 @@ def find_original_segment(chapter_hint, keyword):
         return f"在章节 {chapter_hint} 中未找到关键词: {keyword}"
 
     # Return surrounding text (e.g. 500 chars before and after)
-    start = max(0, kw_pos - 500)
-    end = min(len(search_window), kw_pos + 1000)
+    start = max(0, kw_pos - SNIPPET_BEFORE)
+    end = min(len(search_window), kw_pos + SNIPPET_AFTER)
     
     return search_window[start:end]
+
+def _samples_cache_path():
+    return os.path.join(config.DIR_CACHE, "sample_segments.json")
+
+def _samples_cache_key(entries):
+    st = os.stat(config.FILE_ORIGINAL)
+    pairs = [[e.get("chapter_hint", ""), e.get("keyword", "")] for e in entries]
+    payload = json.dumps([st.st_mtime_ns, st.st_size, SNIPPET_BEFORE, SNIPPET_AFTER, pairs], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def resolve_samples(entries=None, use_cache=True):
+    """
+    Resolve every sample entry against the original in one sequential pass.
+    All keywords go into a single Aho-Corasick automaton; each chapter is decoded once
+    and a hit counts for the entries whose hint located that chapter. Keywords not found
+    in their chapter (e.g. hints marked 约略) fall back to the occurrence nearest that chapter
+    (or the first one in the book when the chapter could not be located).
+    Results are cached on disk until the original or the entry list changes.
+    Returns the entries with "segment", "chapter" and "found" added, in input order.
+    """
+    if entries is None:
+        entries = parse_sample_file()
+    if not entries:
+        return []
+    if not os.path.exists(config.FILE_ORIGINAL):
+        return [dict(e, segment="原著文件不存在", chapter=None, found=False) for e in entries]
+
+    cache_key = _samples_cache_key(entries)
+    cache_path = _samples_cache_path()
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("key") == cache_key:
+                return cached["results"]
+        except (OSError, ValueError):
+            pass
+
+    chapters = chapter_index.get_index()
+    located = [chapter_index.find_chapter(e.get("chapter_hint", "")) for e in entries]
+    # keyword -> chapter offsets it should be searched in
+    scoped = {}
+    for entry, chapter in zip(entries, located):
+        if entry.get("keyword") and chapter is not None:
+            scoped.setdefault(entry["keyword"], set()).add(chapter["offset"])
+    matcher = AhoCorasick(e.get("keyword", "") for e in entries)
+
+    scoped_hits = {}   # (keyword, chapter offset) -> snippet
+    global_hits = {}   # keyword -> (distance to hinted chapter, chapter title, snippet)
+    chapter_heads = {} # chapter offset -> text preview for entries without keyword
+    with mmap_text.MappedText(config.FILE_ORIGINAL) as original:
+        # Text before the first header is scanned too, so global fallbacks cover the whole file
+        spans = []
+        first_offset = chapters[0]["offset"] if chapters else len(original)
+        if first_offset > 0:
+            spans.append((None, 0, first_offset))
+        spans.extend((c, c["offset"], c["offset"] + c["length"]) for c in chapters)
+
+        wanted_heads = {c["offset"] for e, c in zip(entries, located) if c is not None and not e.get("keyword")}
+        for chapter, start, end in spans:
+            text = original.read_bytes(start, end)
+            title = chapter["title"] if chapter else None
+            if chapter and chapter["offset"] in wanted_heads:
+                chapter_heads[chapter["offset"]] = text[:2000] + "..."
+            if not matcher:
+                continue
+            for pos, keyword in matcher.iter_matches(text):
+                in_scope = chapter is not None and chapter["offset"] in scoped.get(keyword, ())
+                if in_scope and (keyword, chapter["offset"]) in scoped_hits:
+                    continue
+                distance = min((abs(start - target) for target in scoped.get(keyword, ())), default=0)
+                if not in_scope and keyword in global_hits and global_hits[keyword][0] <= distance:
+                    continue
+                snippet = text[max(0, pos - SNIPPET_BEFORE):pos + SNIPPET_AFTER]
+                if in_scope:
+                    scoped_hits[(keyword, chapter["offset"])] = snippet
+                if keyword not in global_hits or distance < global_hits[keyword][0]:
+                    global_hits[keyword] = (distance, title, snippet)
+
+    results = []
+    for entry, chapter in zip(entries, located):
+        keyword = entry.get("keyword", "")
+        hint = entry.get("chapter_hint", "")
+        result = dict(entry, segment="", chapter=chapter["title"] if chapter else None, found=False)
+        if not keyword:
+            if chapter is not None:
+                result.update(segment=chapter_heads.get(chapter["offset"], ""), found=True)
+            else:
+                result["segment"] = f"未找到章节: {hint}"
+        elif chapter is not None and (keyword, chapter["offset"]) in scoped_hits:
+            result.update(segment=scoped_hits[(keyword, chapter["offset"])], found=True)
+        elif keyword in global_hits:
+            _, title, snippet = global_hits[keyword]
+            result.update(segment=snippet, chapter=title, found=True)
+        else:
+            result["segment"] = f"在章节 {hint} 中未找到关键词: {keyword}"
+        results.append(result)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"key": cache_key, "results": results}, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    return results
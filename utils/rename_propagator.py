@@ -0,0 +1,259 @@
+"""
+改名批量传播
+把改文审计中确认的替换（如人名 A -> B）一次性应用到后续章节、设定文本与状态 JSON：
+先生成预览（只读，状态文件取内存中的最新状态），应用时先全部写入临时文件再统一替换，
+并把原文件快照到 历史版本/ 下，任一步失败都会从快照恢复，也可以事后整体回滚。
+预览后被改动的文件会拒绝应用；改名后又被编辑过的文件会拒绝回滚（可强制）。
+"""
+
+import datetime
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import config
+from utils import body_index, file_cache, state_manager
+
+PREVIEW_LINES = 20
+MANIFEST_NAME = "manifest.json"
+
+class StaleFileError(RuntimeError):
+    """文件在预览之后（或改名之后）被修改过；names 为涉及的文件名"""
+
+    def __init__(self, message, names):
+        super().__init__(f"{message}: {', '.join(names)}")
+        self.names = names
+
+def _state_view(path):
+    """角色状态 / 伏笔 的内存视图（已重放日志或来自 SQLite），其它 JSON 返回 None"""
+    path = os.path.abspath(path)
+    if path == os.path.abspath(config.FILE_CHARACTER_STATE):
+        return state_manager.get_character_state()
+    if path == os.path.abspath(config.FILE_FORESHADOWING):
+        return state_manager.get_foreshadowing()
+    return None
+
+def _read_state(path):
+    data = _state_view(path)
+    if data is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    return data
+
+def _fingerprint(path, kind):
+    """文件内容指纹；状态文件按内容（含未合并的日志）计算，不受格式化与快照合并影响"""
+    try:
+        if kind == "state":
+            payload = json.dumps(_read_state(path), ensure_ascii=False, sort_keys=True).encode("utf-8")
+        else:
+            with open(path, 'rb') as f:
+                payload = f.read()
+    except (OSError, ValueError):
+        return None
+    return hashlib.sha256(payload).hexdigest()
+
+def _build_pattern(replacements):
+    # 长词优先，避免 "沈仪" 先于 "沈仪之" 命中；所有替换同时生效，不会出现 A->B->C 的连锁
+    olds = sorted({r["old"] for r in replacements if r.get("old")}, key=len, reverse=True)
+    if not olds:
+        return None, {}
+    mapping = {r["old"]: r["new"] for r in replacements if r.get("old")}
+    return re.compile("|".join(re.escape(old) for old in olds)), mapping
+
+def _replace_text(text, pattern, mapping, counts):
+    def _sub(match):
+        counts[match.group(0)] = counts.get(match.group(0), 0) + 1
+        return mapping[match.group(0)]
+    return pattern.sub(_sub, text)
+
+def _replace_json(value, pattern, mapping, counts):
+    """递归替换 JSON 中的字符串值与对象键（角色状态以人名为键）"""
+    if isinstance(value, str):
+        return _replace_text(value, pattern, mapping, counts)
+    if isinstance(value, list):
+        return [_replace_json(item, pattern, mapping, counts) for item in value]
+    if isinstance(value, dict):
+        return {_replace_text(key, pattern, mapping, counts): _replace_json(item, pattern, mapping, counts)
+                for key, item in value.items()}
+    return value
+
+def collect_targets(start_chapter_index, all_chapters):
+    """后续章节 + 设定_*.txt + 设定_*.json，返回 [(路径, 类型)]"""
+    targets = [(path, "chapter") for path in all_chapters[start_chapter_index + 1:]]
+    targets += [(path, "setting") for path in sorted(glob.glob(os.path.join(config.DIR_SETTINGS, "设定_*.txt")))]
+    targets += [(path, "state") for path in sorted(glob.glob(os.path.join(config.DIR_SETTINGS, "设定_*.json")))]
+    return targets
+
+def _changed_lines(old_text, new_text):
+    samples = []
+    for line_no, (before, after) in enumerate(zip(old_text.splitlines(), new_text.splitlines()), start=1):
+        if before != after:
+            samples.append({"line": line_no, "before": before.strip(), "after": after.strip()})
+            if len(samples) >= PREVIEW_LINES:
+                break
+    return samples
+
+def plan(replacements, start_chapter_index, all_chapters):
+    """
+    生成替换计划（不写盘）。状态文件基于内存中的最新状态（含未合并的日志 / SQLite），
+    否则日志里的旧名字会在合并时被写回来。
+    Args:
+        replacements: [{"old": 原词, "new": 新词}, ...]
+    Returns:
+        [{"path", "name", "kind", "counts": {原词: 次数}, "samples": [...], "new_content", "fingerprint"}, ...]，
+        只含有改动的文件
+    """
+    pattern, mapping = _build_pattern(replacements)
+    if pattern is None:
+        return []
+
+    changes = []
+    for path, kind in collect_targets(start_chapter_index, all_chapters):
+        counts = {}
+        if kind == "state":
+            try:
+                data = _read_state(path)
+            except (OSError, ValueError):
+                print(f"⚠️ 状态文件无法解析，跳过: {path}")
+                continue
+            old_content = json.dumps(data, ensure_ascii=False, indent=2)
+            new_data = _replace_json(data, pattern, mapping, counts)
+            new_content = json.dumps(new_data, ensure_ascii=False, indent=2) if counts else old_content
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                old_content = f.read()
+            new_content = _replace_text(old_content, pattern, mapping, counts)
+        if counts:
+            changes.append({
+                "path": path,
+                "name": os.path.basename(path),
+                "kind": kind,
+                "counts": counts,
+                "samples": _changed_lines(old_content, new_content),
+                "new_content": new_content,
+                "fingerprint": _fingerprint(path, kind)
+            })
+    return changes
+
+def _restore(manifest, snapshot_dir):
+    for item in manifest["files"]:
+        shutil.copy2(os.path.join(snapshot_dir, item["backup"]), item["path"])
+    _refresh_caches(manifest["files"])
+
+def _refresh_caches(files):
+    for item in files:
+        file_cache.invalidate(item["path"])
+        if item["kind"] == "chapter":
+            body_index.update_chapter(item["path"])
+    if any(item["kind"] == "state" for item in files):
+        state_manager.reload()
+
+def apply(changes, replacements=None):
+    """
+    原子地应用 plan() 的结果：
+    1. 原文件复制到 历史版本/改名_时间戳/；
+    2. 所有新内容先写入同目录临时文件；
+    3. 全部成功后逐个 os.replace，中途失败则从快照恢复已替换的文件。
+    Returns:
+        快照目录路径
+    Raises:
+        StaleFileError: 预览之后有文件被修改（需重新预览），此时不做任何改动
+    """
+    if not changes:
+        return None
+    stale = [c["name"] for c in changes if c.get("fingerprint") and _fingerprint(c["path"], c["kind"]) != c["fingerprint"]]
+    if stale:
+        raise StaleFileError("以下文件在预览后被修改，请重新预览", stale)
+    if any(c["kind"] == "state" for c in changes):
+        # 确认应用后才把日志合并进快照 / 从 SQLite 导出，使快照备份的是完整的最新状态
+        state_manager.compact()
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    snapshot_dir = os.path.join(config.DIR_HISTORY, f"改名_{timestamp}")
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    manifest = {
+        "created_at": datetime.datetime.now().isoformat(),
+        "replacements": [{"old": r["old"], "new": r["new"]} for r in (replacements or [])],
+        "files": []
+    }
+    for i, change in enumerate(changes):
+        backup = f"{i:04d}_{change['name']}"
+        shutil.copy2(change["path"], os.path.join(snapshot_dir, backup))
+        manifest["files"].append({"path": change["path"], "backup": backup, "kind": change["kind"]})
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    # 阶段一：写临时文件，失败时原文件尚未改动
+    tmp_paths = []
+    try:
+        for change in changes:
+            tmp_path = f"{change['path']}.rename.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(change["new_content"])
+            tmp_paths.append(tmp_path)
+    except Exception:
+        for tmp_path in tmp_paths:
+            os.remove(tmp_path)
+        raise
+
+    # 阶段二：统一替换，失败则整体回滚
+    try:
+        for change, tmp_path in zip(changes, tmp_paths):
+            os.replace(tmp_path, change["path"])
+    except Exception:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _restore(manifest, snapshot_dir)
+        raise
+
+    _refresh_caches(manifest["files"])
+    # 记录改名后的内容指纹，回滚前据此判断文件是否又被编辑过
+    for item in manifest["files"]:
+        item["applied_fingerprint"] = _fingerprint(item["path"], item["kind"])
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"✏️ 已替换 {len(changes)} 个文件，快照: {snapshot_dir}")
+    return snapshot_dir
+
+def rollback_conflicts(snapshot_dir):
+    """返回改名之后又被修改过的文件名（回滚会丢失这些修改）"""
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    return [os.path.basename(item["path"]) for item in manifest["files"]
+            if item.get("applied_fingerprint") and _fingerprint(item["path"], item["kind"]) != item["applied_fingerprint"]]
+
+def rollback(snapshot_dir, force=False):
+    """
+    从改名快照恢复全部文件并删除该快照，返回恢复的文件数。
+    Raises:
+        StaleFileError: 有文件在改名后被修改过且未指定 force，此时不做任何改动
+    """
+    with open(os.path.join(snapshot_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    conflicts = rollback_conflicts(snapshot_dir)
+    if conflicts and not force:
+        raise StaleFileError("以下文件在改名后被修改过，回滚会丢失这些修改", conflicts)
+    _restore(manifest, snapshot_dir)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    return len(manifest["files"])
+
+def list_snapshots():
+    """按时间倒序列出改名快照 [{"path", "created_at", "replacements", "files"}]"""
+    snapshots = []
+    for manifest_path in glob.glob(os.path.join(config.DIR_HISTORY, "改名_*", MANIFEST_NAME)):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshots.append({
+            "path": os.path.dirname(manifest_path),
+            "created_at": manifest.get("created_at", ""),
+            "replacements": manifest.get("replacements", []),
+            "files": len(manifest.get("files", []))
+        })
+    snapshots.sort(key=lambda s: s["created_at"], reverse=True)
+    return snapshots
@@ -0,0 +1,140 @@
+"""
+设定检索索引
+将 设定_*.txt 按段落切块，使用字符二元组 + BM25 打分，
+只向提示词注入与当前细纲/需求最相关的设定片段。
+文件按 mtime/size 增量重建，未变化的文件不会重新切块。
+"""
+
+import glob
+import math
+import os
+import re
+import threading
+from collections import Counter
+import config
+from utils import file_cache
+
+MAX_CHUNK_CHARS = 600
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 每次保存设定时追加的时间戳分隔行，对检索无意义
+_UPDATE_HEADER_RE = re.compile(r'^===.*===\s*$', re.MULTILINE)
+_CJK_RUN_RE = re.compile(r'[一-鿿㐀-䶿]+')
+_WORD_RE = re.compile(r'[A-Za-z0-9]+')
+
+_lock = threading.Lock()
+# path -> {"signature": (mtime_ns, size), "chunks": [{"text", "tf", "length"}]}
+_files = {}
+
+def tokenize(text):
+    """中文取相邻字符二元组（单字片段保留单字），英文/数字按词切分"""
+    tokens = []
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(w.lower() for w in _WORD_RE.findall(text))
+    return tokens
+
+def _split_chunks(content):
+    """按空行切分段落；超长段落按行打包到 MAX_CHUNK_CHARS 以内"""
+    content = _UPDATE_HEADER_RE.sub("", content)
+    chunks = []
+    for para in re.split(r'\n\s*\n', content):
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) <= MAX_CHUNK_CHARS:
+            chunks.append(para)
+            continue
+        current = ""
+        for line in para.split("\n"):
+            if current and len(current) + len(line) + 1 > MAX_CHUNK_CHARS:
+                chunks.append(current)
+                current = line
+            else:
+                current = f"{current}\n{line}" if current else line
+        if current:
+            chunks.append(current)
+    return chunks
+
+def _read_setting(path):
+    for encoding in ("utf-8", "gbk"):
+        try:
+            return file_cache.read_text(path, encoding=encoding)
+        except UnicodeDecodeError:
+            continue
+    print(f"警告：无法读取设定文件 {path}，跳过索引")
+    return ""
+
+def refresh(settings_dir=None):
+    """
+    同步索引与设定目录：新增/修改的文件重新切块，删除的文件移出索引。
+    Returns:
+        本次重建的文件数
+    """
+    settings_dir = settings_dir or config.DIR_SETTINGS
+    paths = glob.glob(os.path.join(settings_dir, "设定_*.txt"))
+    rebuilt = 0
+    with _lock:
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature = (st.st_mtime_ns, st.st_size)
+            entry = _files.get(path)
+            if entry and entry["signature"] == signature:
+                continue
+            chunks = []
+            for text in _split_chunks(_read_setting(path)):
+                tokens = tokenize(text)
+                chunks.append({"text": text, "tf": Counter(tokens), "length": len(tokens)})
+            _files[path] = {"signature": signature, "chunks": chunks}
+            rebuilt += 1
+
+        current = set(paths)
+        index_dir = os.path.dirname(os.path.join(settings_dir, "设定_"))
+        for path in [p for p in _files if p not in current and os.path.dirname(p) == index_dir]:
+            del _files[path]
+    return rebuilt
+
+def search(query, top_k=8, settings_dir=None):
+    """
+    检索与 query 最相关的设定片段。
+    Returns:
+        [{"file": 文件名, "text": 片段, "score": 分数}, ...]，按分数降序
+    """
+    refresh(settings_dir)
+    query_terms = set(tokenize(query))
+    if not query_terms:
+        return []
+
+    with _lock:
+        docs = [(path, chunk) for path, entry in _files.items() for chunk in entry["chunks"]]
+    if not docs:
+        return []
+
+    n_docs = len(docs)
+    avg_len = sum(chunk["length"] for _, chunk in docs) / n_docs or 1
+    df = Counter()
+    for _, chunk in docs:
+        df.update(term for term in query_terms if term in chunk["tf"])
+
+    scored = []
+    for path, chunk in docs:
+        score = 0.0
+        for term in query_terms:
+            tf = chunk["tf"].get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n_docs - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * chunk["length"] / avg_len)
+            score += idf * tf * (BM25_K1 + 1) / norm
+        if score > 0:
+            scored.append({"file": os.path.basename(path), "text": chunk["text"], "score": round(score, 3)})
+
+    scored.sort(key=lambda item: item["score"], reverse=True)
+    return scored[:top_k]
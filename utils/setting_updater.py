@@ -4,13 +4,12 @@
 """
 
 import os
-import json
 import re
 from datetime import datetime
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils import llm_client
+from utils import json_repair, llm_client, summary_store
 import config
 
 def analyze_and_update_settings(chapter_content, chapter_title=""):
@@ -83,19 +82,12 @@ def analyze_and_update_settings(chapter_content, chapter_title=""):
         
         # 调用LLM进行分析
         current_model = os.environ.get("DEFAULT_MODEL_NAME", "deepseek-v3.2-251201-hs")
-        analysis_result = llm_client.generate_content(analysis_prompt, model_name=current_model)
+        analysis_result = llm_client.generate_content(analysis_prompt, model_name=current_model, use_cache=True)
         
-        # 解析分析结果
+        # 解析分析结果（兼容 Markdown 代码块、截断等）
         try:
-            # 兼容 Markdown 代码块
-            json_str = analysis_result.strip()
-            if "```json" in json_str:
-                json_str = json_str.split("```json")[1].split("```")[0].strip()
-            elif "```" in json_str:
-                json_str = json_str.split("```")[1].split("```")[0].strip()
-            
-            parsed_analysis = json.loads(json_str)
-        except json.JSONDecodeError as e:
+            parsed_analysis = json_repair.loads(analysis_result)
+        except json_repair.JSONRepairError as e:
             print(f"JSON解析失败: {e}")
             return results
         
@@ -128,7 +120,7 @@ def analyze_and_update_settings(chapter_content, chapter_title=""):
             
         # 4. 更新剧情回顾 (Txt)
         if parsed_analysis.get("plot_summary"):
-            append_to_plot_review(parsed_analysis["plot_summary"], chapter_title)
+            append_to_plot_review(parsed_analysis["plot_summary"], chapter_title, model_name=current_model)
             results["updated_files"].append("剧情回顾.txt")
         
         # 5. 更新自动提取汇总
@@ -196,6 +188,7 @@ def update_character_state(state_updates):
     """更新角色状态 JSON 文件 - 深度分级管理版本"""
     from utils import state_manager
     state = state_manager.get_character_state()
+    original_state = state_manager.get_character_state()  # 返回的是独立副本，用于比对变化
     
     main_char = "沈仪"
     if main_char in state:
@@ -302,22 +295,16 @@ def update_character_state(state_updates):
         if 'plot_summary' in state_updates:
              state[main_char]["basic_info"]["current_status"] = state_updates['plot_summary']
     
-    # 记录历史
-    if 'history' not in state: state['history'] = []
-    state['history'].append({"time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "updates": state_updates})
+    # 只为发生变化的条目追加变更日志，不再整体重写状态文件
+    changed = {key: value for key, value in state.items() if original_state.get(key) != value}
+    state_manager.set_entities(changed)
     
-    state_manager.save_character_state(state)
+    # 记录历史（独立的追加日志，不再写入状态文件）
+    state_manager.append_history(state_updates)
 
-def append_to_plot_review(summary, chapter_title):
-    """追加到剧情回顾.txt"""
-    review_file = os.path.join(config.DIR_OUTLINES, "剧情回顾.txt")
-    os.makedirs(os.path.dirname(review_file), exist_ok=True)
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    entry = f"\n\n--- {chapter_title} ({timestamp}) ---\n{summary}\n"
-    
-    with open(review_file, 'a', encoding='utf-8') as f:
-        f.write(entry)
+def append_to_plot_review(summary, chapter_title, model_name=None):
+    """写入本章摘要；剧情回顾.txt 由摘要库按 章节 -> 篇章 -> 全书 分层重新生成，不再无限追加"""
+    summary_store.update_chapter(chapter_title, summary, model_name=model_name)
 
 def update_auto_extract_summary(setting_dir, analysis_data, chapter_title):
     """
@@ -1,8 +1,11 @@
 import json
 import os
-from utils import llm_client
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import entity_merge, extraction_schema, json_repair, json_stream, llm_client, file_manager, token_budget
 
-def smart_extract_large_text(full_text, model_name=None, window_size=5000, overlap=1000):
+def smart_extract_large_text(full_text, model_name=None, window_size=5000, overlap=1000, max_workers=1, max_window_tokens=None, use_async=False, on_section=None, bypass_cache=False):
     """
     智能提取大文本内容 - 保持上下文完整性
     Args:
@@ -10,6 +13,12 @@ def smart_extract_large_text(full_text, model_name=None, window_size=5000, overl
         model_name: 模型名称
         window_size: 窗口大小（字符数）
         overlap: 重叠大小（字符数）
+        max_workers: 最大并发请求数（1 为顺序处理）
+        max_window_tokens: 可选，每个窗口的 token 上限
+        use_async: 使用异步客户端（RPM/TPM 限流 + 自适应并发），max_workers 作为并发上限
+        on_section: 可选回调 on_section(窗口序号, 字段名, 值)；提供时顺序模式改为流式请求，
+            每个顶层字段一完成就回调（并发/异步模式下在窗口完成后回调）
+        bypass_cache: 跳过响应缓存读取，强制重新调用模型
     Returns:
         合并后的提取结果
     """
@@ -17,90 +26,257 @@ def smart_extract_large_text(full_text, model_name=None, window_size=5000, overl
     print(f"   文本总长度: {len(full_text)} 字符")
     print(f"   窗口大小: {window_size} 字符")
     print(f"   重叠大小: {overlap} 字符")
+    print(f"   并发请求数: {max_workers}")
     
     # 计算需要处理的窗口数量
     if len(full_text) <= window_size:
         # 文本较短，直接处理
         print("📄 文本较短，直接处理...")
-        return extract_from_window(full_text, model_name, is_single_window=True)
+        try:
+            if on_section:
+                return extract_from_window_streaming(full_text, model_name, is_single_window=True,
+                                                     on_section=lambda key, value: on_section(0, key, value),
+                                                     bypass_cache=bypass_cache)
+            return extract_from_window(full_text, model_name, is_single_window=True, bypass_cache=bypass_cache)
+        except ValueError as e:
+            # 只有一个窗口时没有可合并的结果，返回空结构
+            print(f"⚠️ JSON解析失败: {e}")
+            return extraction_schema.empty(extraction_schema.WINDOW_SCHEMA)
     
     # 分窗处理
-    windows = create_sliding_windows(full_text, window_size, overlap)
+    windows = create_sliding_windows(full_text, window_size, overlap, max_window_tokens=max_window_tokens)
     print(f"📊 需要处理 {len(windows)} 个窗口...")
     
-    # 处理每个窗口
-    window_results = []
-    for i, (window_text, context_info) in enumerate(windows):
-        print(f"\n🔄 处理窗口 {i+1}/{len(windows)} ({context_info})")
-        
-        try:
-            result = extract_from_window(window_text, model_name, window_info=context_info)
-            window_results.append({
-                "window_index": i,
-                "context_info": context_info,
-                "result": result,
-                "success": True
-            })
-            print(f"✅ 窗口 {i+1} 处理完成")
-        except Exception as e:
-            print(f"❌ 窗口 {i+1} 处理失败: {e}")
-            window_results.append({
-                "window_index": i,
-                "context_info": context_info,
-                "error": str(e),
-                "success": False
-            })
+    # 处理每个窗口（executor.map 与异步批量调用都按窗口顺序返回结果，可直接按序合并）
+    scan_start = time.perf_counter()
+    tasks = [(i, len(windows), window_text, context_info, model_name, bypass_cache)
+             for i, (window_text, context_info) in enumerate(windows)]
+    max_workers = max(1, min(int(max_workers or 1), len(windows)))
+    if use_async:
+        window_results = _process_windows_async(windows, model_name, max_workers, bypass_cache)
+    elif max_workers == 1:
+        window_results = [_process_window(*task, on_section=on_section) for task in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            window_results = list(executor.map(lambda task: _process_window(*task), tasks))
+    if on_section and (use_async or max_workers > 1):
+        # 并发模式下请求不走流式，按窗口顺序补发回调
+        for r in window_results:
+            for key, value in r.get("result", {}).items():
+                on_section(r["window_index"], key, value)
+    
+    total_elapsed = time.perf_counter() - scan_start
+    if use_async:
+        print(f"\n⏱️ 窗口处理总耗时 {total_elapsed:.1f}s")
+    else:
+        window_elapsed = sum(r["elapsed"] for r in window_results)
+        print(f"\n⏱️ 窗口处理总耗时 {total_elapsed:.1f}s（各窗口累计 {window_elapsed:.1f}s）")
     
     # 合并结果
     print("\n🔄 合并所有窗口结果...")
     merged_result = merge_window_results(window_results)
     return merged_result
 
-def create_sliding_windows(text, window_size, overlap):
+def _process_window(i, total, window_text, context_info, model_name, bypass_cache=False, on_section=None):
+    """
+    处理单个窗口并记录耗时，供顺序/并发两种模式共用。
+    """
+    print(f"\n🔄 处理窗口 {i+1}/{total} ({context_info})")
+    start = time.perf_counter()
+    try:
+        if on_section:
+            result = extract_from_window_streaming(window_text, model_name, window_info=context_info,
+                                                   on_section=lambda key, value: on_section(i, key, value),
+                                                   bypass_cache=bypass_cache)
+        else:
+            result = extract_from_window(window_text, model_name, window_info=context_info, bypass_cache=bypass_cache)
+        elapsed = time.perf_counter() - start
+        print(f"✅ 窗口 {i+1} 处理完成 ({elapsed:.1f}s)")
+        return {
+            "window_index": i,
+            "context_info": context_info,
+            "result": result,
+            "success": True,
+            "elapsed": elapsed
+        }
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        print(f"❌ 窗口 {i+1} 处理失败 ({elapsed:.1f}s): {e}")
+        return {
+            "window_index": i,
+            "context_info": context_info,
+            "error": str(e),
+            "success": False,
+            "elapsed": elapsed
+        }
+
+def _process_windows_async(windows, model_name, max_concurrency, bypass_cache=False):
+    """
+    通过异步客户端批量处理所有窗口，结果格式与 _process_window 一致。
+    """
+    from utils import async_llm_client
+
+    prompts = [build_window_prompt(window_text, window_info=context_info) for window_text, context_info in windows]
+    responses = async_llm_client.run_batch(prompts, model_name=model_name, use_cache=True, max_concurrency=max_concurrency,
+                                           bypass_cache=bypass_cache)
+
+    window_results = []
+    for i, ((_, context_info), response) in enumerate(zip(windows, responses)):
+        if not isinstance(response, Exception):
+            try:
+                window_results.append({"window_index": i, "context_info": context_info, "result": parse_window_response(response), "success": True})
+                continue
+            except ValueError as e:
+                response = e
+        print(f"❌ 窗口 {i+1} 处理失败: {response}")
+        window_results.append({"window_index": i, "context_info": context_info, "error": str(response), "success": False})
+    return window_results
+
+def create_sliding_windows(text, window_size, overlap, max_window_tokens=None):
     """
-    创建滑动窗口
+    创建按章节对齐的窗口
+    先按章节标题切分，再将整章贪心打包进窗口；单章超过窗口大小时，
+    在段落/句末处切开，仅在该章内部保留重叠。
     Args:
         text: 输入文本
-        window_size: 窗口大小
-        overlap: 重叠大小
+        window_size: 窗口大小（字符数）
+        overlap: 超长章节内部切分时的重叠大小（字符数）
+        max_window_tokens: 可选，每个窗口的 token 上限（本地估算）
     Returns:
         窗口列表 [(文本, 上下文信息), ...]
     """
-    windows = []
     text_length = len(text)
-    
-    start = 0
-    window_index = 0
-    
-    while start < text_length:
-        end = min(start + window_size, text_length)
-        window_text = text[start:end]
-        
+    if text_length == 0:
+        return []
+
+    def _fits(start, end):
+        if end - start > window_size:
+            return False
+        return max_window_tokens is None or token_budget.estimate_tokens(text[start:end]) <= max_window_tokens
+
+    # 1. 章节单元 (start, end, title)，超长章节再切成若干片段
+    units = []
+    for start, end, title in _split_chapter_units(text):
+        if _fits(start, end):
+            units.append((start, end, title, False))
+        else:
+            for p_start, p_end in _split_long_span(text, start, end, window_size, overlap):
+                units.append((p_start, p_end, title, True))
+
+    # 2. 贪心打包整章（被切开的章节片段各自独占窗口，避免重叠部分跨窗重复）
+    windows = []
+    current = None  # [start, end, first_title, last_title]
+    for u_start, u_end, title, is_piece in units:
+        if current and not is_piece and _fits(current[0], u_end):
+            current[1] = u_end
+            current[2] = current[2] or title
+            current[3] = title
+            continue
+        if current:
+            windows.append(current)
+        current = [u_start, u_end, title, title]
+        if is_piece:
+            windows.append(current)
+            current = None
+    if current:
+        windows.append(current)
+
+    result = []
+    for w_start, w_end, first_title, last_title in windows:
         # 确定上下文信息
-        if start == 0 and end == text_length:
-            context_info = "完整文本"
-        elif start == 0:
-            context_info = f"开头部分(1-{end}字符)"
-        elif end == text_length:
-            context_info = f"结尾部分({start+1}-{text_length}字符)"
+        if w_start == 0 and w_end == text_length:
+            position = "完整文本"
         else:
-            context_info = f"中间部分({start+1}-{end}字符)"
-        
-        windows.append((window_text, context_info))
-        
-        # 移动到下一个窗口
-        start += (window_size - overlap)
-        window_index += 1
-        
-        # 避免无限循环
-        if window_index > 100:  # 最多处理100个窗口
+            position = f"{w_start+1}-{w_end}字符"
+        if first_title and last_title and first_title != last_title:
+            context_info = f"{first_title} 至 {last_title}（{position}）"
+        elif first_title:
+            context_info = f"{first_title}（{position}）"
+        else:
+            context_info = position
+        result.append((text[w_start:w_end], context_info))
+
+    return result
+
+def _split_chapter_units(text):
+    """按章节标题切分文本，返回 [(start, end, title), ...]；首个标题前的内容单独成块"""
+    headers = [(m.start(), m.group(0).strip().lstrip("\ufeff").strip("[]")) for m in file_manager.CHAPTER_HEADER_RE.finditer(text)]
+    if not headers or headers[0][0] > 0:
+        headers.insert(0, (0, ""))
+
+    units = []
+    for i, (start, title) in enumerate(headers):
+        end = headers[i + 1][0] if i + 1 < len(headers) else len(text)
+        if text[start:end].strip():
+            units.append((start, end, title))
+    return units
+
+# 句末/段落边界：句末标点（含后随引号）或换行
+_SENTENCE_END_RE = re.compile(r'[。！？!?…]+[”’」』"]?\s*|\n+')
+
+def _split_long_span(text, start, end, window_size, overlap):
+    """在段落或句末处切分超长片段，片段之间保留约 overlap 字符的重叠"""
+    pieces = []
+    pos = start
+    while pos < end:
+        limit = min(pos + window_size, end)
+        cut = limit if limit == end else _find_cut(text, pos, limit)
+        pieces.append((pos, cut))
+        if cut >= end:
             break
-    
-    return windows
+        # 重叠起点同样吸附到句末之后，保证下一片段从完整句子开始
+        next_pos = max(cut - overlap, pos + 1)
+        boundary = _SENTENCE_END_RE.search(text, next_pos, cut)
+        if boundary and boundary.end() < cut:
+            next_pos = boundary.end()
+        pos = next_pos
+    return pieces
+
+def _find_cut(text, start, limit):
+    """在 (start, limit] 的后半段中寻找最靠后的段落边界，其次是句末边界"""
+    half = start + (limit - start) // 2
+    para = text.rfind("\n", half, limit)
+    if para != -1:
+        return para + 1
+    last = None
+    for m in _SENTENCE_END_RE.finditer(text, half, limit):
+        last = m.end()
+    return last if last else limit
 
-def extract_from_window(window_text, model_name=None, is_single_window=False, window_info=""):
+def extract_from_window(window_text, model_name=None, is_single_window=False, window_info="", prior_state=None,
+                        bypass_cache=False):
     """
     从单个窗口提取信息，采用优化的规则和格式。
+    prior_state 为前文累计状态（见 build_window_prompt），提供时不使用响应缓存；
+    bypass_cache 为真时跳过缓存读取，强制重新调用模型。
+    Raises:
+        ValueError: 响应无法解析为 JSON 对象（由调用方把该窗口记为失败，避免空结果参与合并）
+    """
+    prompt = build_window_prompt(window_text, is_single_window, window_info, prior_state=prior_state)
+    
+    # 结构化调用：服务端支持时按 schema 约束输出，返回值已经过类型校验
+    return llm_client.generate_structured(prompt, extraction_schema.WINDOW_SCHEMA, "window_extraction",
+                                          model_name=model_name, use_cache=prior_state is None, bypass_cache=bypass_cache)
+
+def extract_from_window_streaming(window_text, model_name=None, is_single_window=False, window_info="", on_section=None,
+                                  bypass_cache=False):
+    """
+    流式版本的 extract_from_window：边接收边解析，每个顶层字段（shen_yi、ledger_update 等）
+    完成时调用 on_section(字段名, 值)。响应被截断或中途断流时返回已完成的字段。
+    """
+    prompt = build_window_prompt(window_text, is_single_window, window_info)
+    deltas = llm_client.stream_content(prompt, model_name=model_name, use_cache=True, bypass_cache=bypass_cache)
+    result, parser = json_stream.parse_stream(deltas, on_section=on_section)
+    if parser.partial_key:
+        print(f"⚠️ 响应不完整，字段 {parser.partial_key} 为截断前的部分内容")
+    if not result:
+        return parse_window_response(parser.text)
+    return extraction_schema.normalize(result, extraction_schema.WINDOW_SCHEMA)
+
+def build_window_prompt(window_text, is_single_window=False, window_info="", prior_state=None):
+    """
+    构造单个窗口的提取提示词（同步/异步批量调用共用）。
+    prior_state: 可选，前文累计状态（merge_window_results 的结果），供模型统一名称、判断境界变化与伏笔回收。
     """
     # 构造通用规则说明
     rules_instruction = """
@@ -150,6 +326,14 @@ def extract_from_window(window_text, model_name=None, is_single_window=False, wi
   "settings": "片段涉及的世界观、势力、规则等设定信息",
   "outline": "片段内的关键情节发展"
 }
+"""
+
+    if prior_state:
+        rules_instruction += f"""
+### 前文累计状态（截至本片段之前）：
+以下状态仅作参考：沿用其中的人物、功法、装备名称，据此判断境界变化与伏笔是否回收。
+返回结果仍只记录本片段内获得/消耗的杀戮点，以及本片段结束时的状态。
+{format_prior_state(prior_state)}
 """
 
     if is_single_window:
@@ -166,99 +350,32 @@ def extract_from_window(window_text, model_name=None, is_single_window=False, wi
 小说片段内容：
 {window_text}
 """
+    return prompt
 
-    # 调用模型
-    response = llm_client.generate_content(prompt, model_name=model_name)
-    
-    # 清理和解析响应
-    clean_response = response.strip()
-    
-    # 移除可能的markdown代码块标记
-    if clean_response.startswith("```json"):
-        clean_response = clean_response[7:]
-    if clean_response.endswith("```"):
-        clean_response = clean_response[:-3]
-    
-    # 移除控制字符和非法Unicode字符
-    import re
-    # 更加健壮的JSON清理逻辑
-    clean_response = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', clean_response)
-    # 提取可能的JSON对象或数组部分
-    json_match = re.search(r'(\{.*\}|\[.*\])', clean_response, re.DOTALL)
-    if json_match:
-        clean_response = json_match.group(1)
-    
-    # 修复不完整的JSON字符串
-    # 处理未闭合的引号
-    quote_count = clean_response.count('"')
-    if quote_count % 2 != 0:
-        # 如果引号数量为奇数，尝试修复
-        last_quote_pos = clean_response.rfind('"')
-        if last_quote_pos != -1:
-            # 在最后一个引号后添加闭合引号
-            clean_response = clean_response[:last_quote_pos+1] + '"' + clean_response[last_quote_pos+1:]
-    
-    # 处理未闭合的大括号
-    open_braces = clean_response.count('{')
-    close_braces = clean_response.count('}')
-    if open_braces > close_braces:
-        clean_response += '}' * (open_braces - close_braces)
-    
-    open_brackets = clean_response.count('[')
-    close_brackets = clean_response.count(']')
-    if open_brackets > close_brackets:
-        clean_response += ']' * (open_brackets - close_brackets)
-    
-    # 解析JSON
-    try:
-        data = json.loads(clean_response)
-        return data
-    except json.JSONDecodeError as e:
-        print(f"⚠️ JSON解析失败: {e}")
-        print(f"响应长度: {len(clean_response)} 字符")
-        print(f"响应预览: {clean_response[:300]}...")
-        
-        # 尝试更宽松的解析方法
-        try:
-            # 尝试找到JSON对象的开始和结束
-            start_pos = clean_response.find('{')
-            if start_pos != -1:
-                # 从第一个{开始解析
-                remaining_text = clean_response[start_pos:]
-                # 尝试逐步缩短文本直到能解析为止
-                for i in range(len(remaining_text), 0, -1):
-                    try:
-                        partial_json = remaining_text[:i]
-                        data = json.loads(partial_json)
-                        print(f"✅ 部分解析成功，使用前{i}个字符")
-                        return data
-                    except:
-                        continue
-        except:
-            pass
-        
-        # 返回空的结果结构
-        return {
-            "shen_yi": {
-                "basic_info": {
-                    "name": "沈仪",
-                    "realm": "",
-                    "killing_points": 0,
-                    "current_status": ""
-                },
-                "equipment": [],
-                "cultivation": {
-                    "core_manual": {"name": "", "level": "", "features": ""},
-                    "martial_skills": [],
-                    "physical_talents": []
-                }
-            },
-            "enemy_tracker": {},
-            "world_event": {},
-            "ledger_update": [],
-            "settings": "",
-            "outline": ""
-        }
+# 注入提示词的前文状态上限
+PRIOR_STATE_MAX_TOKENS = 2000
+
+def format_prior_state(state):
+    """把合并后的状态压缩为提示词中的 JSON（去掉设定/大纲长文本，超出上限时截断）"""
+    keys = ("shen_yi", "enemy_tracker", "world_event", "ledger_update")
+    text = json.dumps({key: state[key] for key in keys if state.get(key)}, ensure_ascii=False)
+    return token_budget.truncate_to_tokens(text, PRIOR_STATE_MAX_TOKENS)
+
+def parse_window_response(response):
+    """
+    清理并解析模型返回的窗口提取结果（按 WINDOW_SCHEMA 校验）。
+    Raises:
+        ValueError: 响应无法解析为 JSON 对象
+    """
+    # 标准解析失败时单遍修复（截断、多余逗号、未转义引号、前后说明文字）
+    data = json_repair.loads(response, default=None)
+    if isinstance(data, dict):
+        return extraction_schema.normalize(data, extraction_schema.WINDOW_SCHEMA)
+
+    print(f"⚠️ JSON解析失败")
+    print(f"响应长度: {len(response)} 字符")
+    print(f"响应预览: {response[:300]}...")
+    raise ValueError("窗口响应无法解析为 JSON 对象")
 
 def merge_window_results(window_results):
     """
@@ -283,11 +400,14 @@ def merge_window_results(window_results):
         "world_event": {},
         "ledger_update": [],
         "settings": "",
-        "outline": ""
+        "outline": "",
+        # 各窗口的大纲原样保留，保存时由 summary_store 分批压缩（map-reduce）
+        "outline_parts": []
     }
     
     successful_windows = 0
     failed_windows = 0
+    indexes = entity_merge.merge_indexes(merged)
     
     # 按顺序处理，以保证状态更新正确
     for result in window_results:
@@ -310,15 +430,12 @@ def merge_window_results(window_results):
                 except (ValueError, TypeError):
                     kp = 0
                 merged["shen_yi"]["basic_info"]["killing_points"] += kp
-                merged["shen_yi"]["basic_info"]["realm"] = bi.get("realm", merged["shen_yi"]["basic_info"]["realm"])
-                merged["shen_yi"]["basic_info"]["current_status"] = bi.get("current_status", merged["shen_yi"]["basic_info"]["current_status"])
+                # 窗口未提及境界/状态时（缺失或为空）保留前面窗口的值
+                for field in ("realm", "current_status"):
+                    merged["shen_yi"]["basic_info"][field] = entity_merge.merge_value(merged["shen_yi"]["basic_info"][field], bi.get(field))
                 
-                # 装备去重：确保为列表
-                equipment = sy.get("equipment", [])
-                if isinstance(equipment, list):
-                    for i in equipment:
-                        if i and i not in merged["shen_yi"]["equipment"]:
-                            merged["shen_yi"]["equipment"].append(i)
+                # 装备去重："断山刀" 与 "断山刀（在手）" 视为同一件，保留最新的状态描述
+                indexes["equipment"].extend(sy.get("equipment", []))
                 
                 if "cultivation" in sy:
                     cult = sy["cultivation"]
@@ -327,39 +444,15 @@ def merge_window_results(window_results):
                     if cult.get("core_manual", {}).get("name"):
                         merged["shen_yi"]["cultivation"]["core_manual"] = cult["core_manual"]
                     
-                    martial_skills = cult.get("martial_skills", [])
-                    if isinstance(martial_skills, list):
-                        for s in martial_skills:
-                            s_name = s.get("name") if isinstance(s, dict) else s
-                            if not s_name: continue
-                            existing_names = [sk.get("name") if isinstance(sk, dict) else sk for sk in merged["shen_yi"]["cultivation"]["martial_skills"]]
-                            if s_name not in existing_names:
-                                merged["shen_yi"]["cultivation"]["martial_skills"].append(s)
-                                
-                    physical_talents = cult.get("physical_talents", [])
-                    if isinstance(physical_talents, list):
-                        for t in physical_talents:
-                            t_name = t.get("name") if isinstance(t, dict) else t
-                            if not t_name: continue
-                            existing_names = [tk.get("name") if isinstance(tk, dict) else tk for tk in merged["shen_yi"]["cultivation"]["physical_talents"]]
-                            if t_name not in existing_names:
-                                merged["shen_yi"]["cultivation"]["physical_talents"].append(t)
-            
-            # 合并敌人
-            if "enemy_tracker" in window_data:
-                merged["enemy_tracker"].update(window_data["enemy_tracker"])
+                    indexes["martial_skills"].extend(cult.get("martial_skills", []))
+                    indexes["physical_talents"].extend(cult.get("physical_talents", []))
             
-            # 合并世界事件
-            if "world_event" in window_data:
-                merged["world_event"].update(window_data["world_event"])
+            # 合并敌人 / 世界事件（同名实体逐字段合并，空值不覆盖）
+            indexes["enemy_tracker"].update(window_data.get("enemy_tracker"))
+            indexes["world_event"].update(window_data.get("world_event"))
             
-            # 合并伏笔（ledger_update）
-            if "ledger_update" in window_data:
-                for item in window_data["ledger_update"]:
-                    # 简单去重：基于desc
-                    existing_descs = [i.get("desc") for i in merged["ledger_update"]]
-                    if item.get("desc") not in existing_descs:
-                        merged["ledger_update"].append(item)
+            # 合并伏笔（ledger_update）：按描述模糊去重，状态取最新
+            indexes["ledger_update"].extend(window_data.get("ledger_update", []))
             
             # 合并设定
             if "settings" in window_data and window_data["settings"]:
@@ -370,6 +463,7 @@ def merge_window_results(window_results):
             
             # 合并大纲
             if "outline" in window_data and window_data["outline"]:
+                merged["outline_parts"].append(window_data["outline"])
                 if merged["outline"]:
                     merged["outline"] += "\n" + window_data["outline"]
                 else:
@@ -0,0 +1,219 @@
+"""
+SQLite 状态后端
+设置环境变量 STATE_BACKEND=sqlite 后，state_manager 的读写改走这里：
+角色/敌人/势力存入 entities 表（按类型建索引），伏笔存入 foreshadowing 表
+（按状态、创建章节、回收章节建索引），数据库开启 WAL，多个 Streamlit 会话可以同时读写。
+import_from_json / export_to_json 负责与现有 JSON 文件互相转换。
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+import config
+from utils import file_manager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    name TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_entities_type ON entities(type);
+
+CREATE TABLE IF NOT EXISTS foreshadowing (
+    id TEXT PRIMARY KEY,
+    content TEXT,
+    status TEXT,
+    chapter_created TEXT,
+    chapter_created_no INTEGER,
+    chapter_resolved TEXT,
+    chapter_resolved_no INTEGER,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fs_status_created ON foreshadowing(status, chapter_created_no);
+CREATE INDEX IF NOT EXISTS idx_fs_resolved ON foreshadowing(chapter_resolved_no);
+"""
+
+# 角色状态 JSON 中以前缀区分条目类型
+ENTITY_PREFIXES = {"敌人_": "enemy", "势力_": "faction"}
+
+_initialized = set()
+
+def _db_path():
+    return config.FILE_STATE_DB
+
+@contextmanager
+def _connect(write=False):
+    """每次调用独立连接；写操作使用 BEGIN IMMEDIATE 避免并发会话的写冲突"""
+    path = _db_path()
+    with closing(sqlite3.connect(path, timeout=30, isolation_level=None)) as conn:
+        conn.execute("PRAGMA busy_timeout = 30000")
+        if path not in _initialized:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+            _initialized.add(path)
+        if write:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        else:
+            yield conn
+
+def entity_type(name):
+    for prefix, kind in ENTITY_PREFIXES.items():
+        if name.startswith(prefix):
+            return kind, name[len(prefix):]
+    return "character", name
+
+def _chapter_no(chapter):
+    return file_manager.parse_chapter_number(chapter) if isinstance(chapter, str) else None
+
+def _upsert_entity(conn, name, value, updated_at=None):
+    kind, display_name = entity_type(name)
+    conn.execute(
+        "INSERT INTO entities(name, type, display_name, data, updated_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET type=excluded.type, display_name=excluded.display_name, "
+        "data=excluded.data, updated_at=excluded.updated_at",
+        (name, kind, display_name, json.dumps(value, ensure_ascii=False), updated_at)
+    )
+
+def _upsert_foreshadowing(conn, item):
+    conn.execute(
+        "INSERT INTO foreshadowing(id, content, status, chapter_created, chapter_created_no, "
+        "chapter_resolved, chapter_resolved_no, created_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET content=excluded.content, status=excluded.status, "
+        "chapter_created=excluded.chapter_created, chapter_created_no=excluded.chapter_created_no, "
+        "chapter_resolved=excluded.chapter_resolved, chapter_resolved_no=excluded.chapter_resolved_no, "
+        "created_at=excluded.created_at, data=excluded.data",
+        (
+            str(item.get("id")), item.get("content"), item.get("status"),
+            item.get("chapter_created"), _chapter_no(item.get("chapter_created")),
+            item.get("chapter_resolved"), _chapter_no(item.get("chapter_resolved")),
+            item.get("created_at"), json.dumps(item, ensure_ascii=False)
+        )
+    )
+
+# --- 角色 / 敌人 / 势力 ---
+
+def _read_entities(conn):
+    rows = conn.execute("SELECT name, data FROM entities ORDER BY rowid").fetchall()
+    return {name: json.loads(data) for name, data in rows}
+
+def _replace_entities(conn, data):
+    conn.execute("DELETE FROM entities")
+    for name, value in data.items():
+        _upsert_entity(conn, name, value)
+
+def get_character_state():
+    with _connect() as conn:
+        return _read_entities(conn)
+
+def save_character_state(data):
+    with _connect(write=True) as conn:
+        _replace_entities(conn, data)
+
+def set_entities(entities):
+    with _connect(write=True) as conn:
+        for name, value in entities.items():
+            _upsert_entity(conn, name, value)
+
+def merge_entity(name, updates):
+    """浅合并更新一个条目（读改写在同一事务内），返回合并后的值"""
+    with _connect(write=True) as conn:
+        row = conn.execute("SELECT data FROM entities WHERE name = ?", (name,)).fetchone()
+        value = json.loads(row[0]) if row else {}
+        if not isinstance(value, dict):
+            value = {}
+        value.update(updates)
+        _upsert_entity(conn, name, value, updates.get("updated_at"))
+    return value
+
+def get_entities_by_type(kind):
+    """按类型（character / enemy / faction）读取条目，返回 {显示名: 数据}"""
+    with _connect() as conn:
+        rows = conn.execute("SELECT display_name, data FROM entities WHERE type = ? ORDER BY rowid", (kind,)).fetchall()
+    return {name: json.loads(data) for name, data in rows}
+
+# --- 伏笔 ---
+
+def _read_foreshadowing(conn, status=None):
+    if status:
+        rows = conn.execute("SELECT data FROM foreshadowing WHERE status = ? ORDER BY rowid", (status,)).fetchall()
+    else:
+        rows = conn.execute("SELECT data FROM foreshadowing ORDER BY rowid").fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+def _replace_foreshadowing(conn, data):
+    conn.execute("DELETE FROM foreshadowing")
+    for item in data:
+        _upsert_foreshadowing(conn, item)
+
+def get_foreshadowing(status=None):
+    with _connect() as conn:
+        return _read_foreshadowing(conn, status)
+
+def save_foreshadowing(data):
+    with _connect(write=True) as conn:
+        _replace_foreshadowing(conn, data)
+
+def add_foreshadowing(item):
+    with _connect(write=True) as conn:
+        _upsert_foreshadowing(conn, item)
+
+def update_foreshadowing(item_id, updates):
+    with _connect(write=True) as conn:
+        row = conn.execute("SELECT data FROM foreshadowing WHERE id = ?", (str(item_id),)).fetchone()
+        if row is None:
+            return None
+        item = json.loads(row[0])
+        item.update(updates)
+        _upsert_foreshadowing(conn, item)
+    return item
+
+def get_stale_foreshadowing(current_chapter, min_age=50):
+    """
+    创建后超过 min_age 章仍未回收的伏笔（走 status + chapter_created_no 复合索引）。
+    current_chapter 可以是章节号或章节标题；无法识别章节号的伏笔（如 "全量提取"）不参与。
+    """
+    current_no = current_chapter if isinstance(current_chapter, int) else _chapter_no(current_chapter)
+    if current_no is None:
+        return []
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT data FROM foreshadowing WHERE status = 'pending' AND chapter_created_no <= ? "
+            "ORDER BY chapter_created_no",
+            (current_no - min_age,)
+        ).fetchall()
+    return [json.loads(row[0]) for row in rows]
+
+# --- JSON 桥接 ---
+
+def import_from_json(character_state, foreshadowing):
+    """用 JSON 后端的完整状态覆盖数据库（同一事务内完成，其它会话不会读到只导入了一半的状态）"""
+    with _connect(write=True) as conn:
+        _replace_entities(conn, character_state)
+        _replace_foreshadowing(conn, foreshadowing)
+
+def export_to_json():
+    """把数据库内容写回 设定_角色状态.json / 设定_伏笔.json（两张表在同一读事务内读取）"""
+    from utils import state_manager
+    with _connect() as conn:
+        conn.execute("BEGIN")
+        try:
+            character_state = _read_entities(conn)
+            foreshadowing = _read_foreshadowing(conn)
+        finally:
+            conn.execute("COMMIT")
+    state_manager.save_json(config.FILE_CHARACTER_STATE, character_state)
+    state_manager.save_json(config.FILE_FORESHADOWING, foreshadowing)
+
+def exists():
+    return os.path.exists(_db_path())
@@ -1,34 +1,245 @@
+import copy
 import json
 import os
 import shutil
 import datetime
+import threading
 import uuid
 import config
+from utils import file_cache
+
+# 角色状态 / 伏笔采用 "快照 JSON + 追加日志 JSONL"：
+# 单次修改只向日志追加一行，读取时在快照上重放日志；日志超过 COMPACT_EVERY 条后合并回快照。
+# 设置 STATE_BACKEND=sqlite 时改用 utils/state_db（带索引的 SQLite），JSON 文件仅作导入/导出。
+COMPACT_EVERY = 200
+
+_STORES = {
+    "character": {"snapshot": lambda: config.FILE_CHARACTER_STATE, "log": lambda: config.FILE_CHARACTER_LOG, "default": dict},
+    "foreshadowing": {"snapshot": lambda: config.FILE_FORESHADOWING, "log": lambda: config.FILE_FORESHADOWING_LOG, "default": list},
+}
+
+_lock = threading.RLock()
+# kind -> {"snapshot_sig", "log_offset", "events", "state"}
+_materialized = {}
+# 已完成 JSON -> SQLite 首次导入的数据库路径
+_sqlite_ready = set()
 
 def load_json(file_path, default=None):
     if not os.path.exists(file_path):
         return default if default is not None else []
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return file_cache.load_json(file_path)
     except Exception:
         return default if default is not None else []
 
 def save_json(file_path, data):
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    file_cache.invalidate(file_path)
+
+def _use_sqlite():
+    return os.getenv("STATE_BACKEND", "json").strip().lower() == "sqlite"
+
+def _db():
+    """返回 SQLite 后端模块；数据库首次创建时从现有 JSON 状态导入"""
+    from utils import state_db
+    with _lock:
+        if config.FILE_STATE_DB not in _sqlite_ready:
+            if not state_db.exists():
+                _compact_json()
+                state_db.import_from_json(_materialize("character")["state"], _materialize("foreshadowing")["state"])
+                print(f"📦 已将 JSON 状态导入 {os.path.basename(config.FILE_STATE_DB)}")
+            _sqlite_ready.add(config.FILE_STATE_DB)
+    return state_db
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _apply_event(kind, state, event):
+    """事件重放；所有操作都是幂等的，合并中途中断导致的重复重放不会出错"""
+    op = event.get("op")
+    if kind == "character":
+        name = event.get("name")
+        if op == "merge":
+            if not isinstance(state.get(name), dict):
+                state[name] = {}
+            state[name].update(event.get("updates", {}))
+        elif op == "set":
+            state[name] = event.get("value")
+        elif op == "delete":
+            state.pop(name, None)
+    else:
+        if op == "add":
+            item = event.get("item", {})
+            if not any(f.get("id") == item.get("id") for f in state):
+                state.append(item)
+        elif op == "update":
+            for f in state:
+                if f.get("id") == event.get("id"):
+                    f.update(event.get("updates", {}))
+
+def _load_snapshot(kind):
+    store = _STORES[kind]
+    path = store["snapshot"]()
+    state = load_json(path, default=store["default"]())
+    if kind == "character" and isinstance(state, dict) and "history" in state:
+        # 一次性迁移：旧版本把历史记录存在状态文件里，移到独立的历史日志
+        history = state.pop("history")
+        for entry in history if isinstance(history, list) else []:
+            _append_line(config.FILE_STATE_HISTORY, entry)
+        save_json(path, state)
+        print(f"📦 已将 {len(history)} 条状态历史迁移到 {os.path.basename(config.FILE_STATE_HISTORY)}")
+    return state
+
+def _materialize(kind):
+    """快照 + 增量重放日志；只读取上次之后新追加的日志行"""
+    store = _STORES[kind]
+    log_path = store["log"]()
+    with _lock:
+        entry = _materialized.get(kind)
+        log_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        if entry is None or entry["snapshot_sig"] != _signature(store["snapshot"]()) or log_size < entry["log_offset"]:
+            state = _load_snapshot(kind)
+            entry = {"snapshot_sig": _signature(store["snapshot"]()), "log_offset": 0, "events": 0, "state": state}
+            _materialized[kind] = entry
+
+        if log_size > entry["log_offset"]:
+            with open(log_path, 'rb') as f:
+                f.seek(entry["log_offset"])
+                data = f.read(log_size - entry["log_offset"])
+            # 只消费完整的行，写了一半的行留到下次
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    _apply_event(kind, entry["state"], json.loads(line))
+                    entry["events"] += 1
+                except ValueError:
+                    print(f"⚠️ 跳过损坏的状态日志行: {line[:80]!r}")
+            entry["log_offset"] += end
+        return entry
+
+def _append_line(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _append_event(kind, event):
+    event = dict(event, ts=datetime.datetime.now().isoformat())
+    with _lock:
+        _append_line(_STORES[kind]["log"](), event)
+        if _materialize(kind)["events"] >= COMPACT_EVERY:
+            compact(kind)
+
+def _write_baseline(kind, data):
+    """整体写入快照并清空日志（整体覆盖时使用）"""
+    store = _STORES[kind]
+    with _lock:
+        save_json(store["snapshot"](), data)
+        log_path = store["log"]()
+        if os.path.exists(log_path):
+            open(log_path, 'w', encoding='utf-8').close()
+        _materialized.pop(kind, None)
 
-def get_foreshadowing():
-    return load_json(config.FILE_FORESHADOWING, default=[])
+def _compact_json(kind=None):
+    kinds = [kind] if kind else list(_STORES)
+    with _lock:
+        for k in kinds:
+            entry = _materialize(k)
+            if entry["events"]:
+                _write_baseline(k, entry["state"])
+
+def compact(kind=None):
+    """
+    让 设定_角色状态.json / 设定_伏笔.json 反映最新状态：
+    JSON 后端把日志合并进快照（kind 为空时合并全部），SQLite 后端把数据库导出为 JSON。
+    """
+    if _use_sqlite():
+        _db().export_to_json()
+    else:
+        _compact_json(kind)
+
+def reload():
+    """状态 JSON 被外部改写后调用（如改名传播、回滚）：丢弃缓存，SQLite 后端重新导入"""
+    with _lock:
+        _materialized.clear()
+        if _use_sqlite():
+            _db().import_from_json(_materialize("character")["state"], _materialize("foreshadowing")["state"])
+
+def get_foreshadowing(status=None):
+    """读取伏笔列表，status 可按状态过滤（如 "pending"）"""
+    if _use_sqlite():
+        return _db().get_foreshadowing(status)
+    items = copy.deepcopy(_materialize("foreshadowing")["state"])
+    if status:
+        items = [f for f in items if f.get("status") == status]
+    return items
 
 def save_foreshadowing(data):
-    save_json(config.FILE_FORESHADOWING, data)
+    if _use_sqlite():
+        _db().save_foreshadowing(data)
+    else:
+        _write_baseline("foreshadowing", data)
+
+def get_stale_foreshadowing(current_chapter, min_age=50):
+    """创建已超过 min_age 章仍未回收的伏笔；current_chapter 为章节号或章节标题"""
+    if _use_sqlite():
+        return _db().get_stale_foreshadowing(current_chapter, min_age)
+    from utils import file_manager
+    current_no = current_chapter if isinstance(current_chapter, int) else file_manager.parse_chapter_number(current_chapter)
+    if current_no is None:
+        return []
+    stale = []
+    for item in get_foreshadowing("pending"):
+        created = item.get("chapter_created")
+        created_no = file_manager.parse_chapter_number(created) if isinstance(created, str) else None
+        if created_no is not None and created_no <= current_no - min_age:
+            stale.append((created_no, item))
+    stale.sort(key=lambda pair: pair[0])
+    return [item for _, item in stale]
 
 def get_character_state():
-    return load_json(config.FILE_CHARACTER_STATE, default={})
+    if _use_sqlite():
+        return _db().get_character_state()
+    return copy.deepcopy(_materialize("character")["state"])
 
 def save_character_state(data):
-    save_json(config.FILE_CHARACTER_STATE, data)
+    if _use_sqlite():
+        _db().save_character_state(data)
+    else:
+        _write_baseline("character", data)
+
+def set_entity(name, value):
+    """整体替换一个角色/敌人/势力条目（只追加一条日志）"""
+    if _use_sqlite():
+        _db().set_entities({name: value})
+    else:
+        _append_event("character", {"op": "set", "name": name, "value": value})
+
+def set_entities(entities):
+    if _use_sqlite():
+        _db().set_entities(entities)
+        return
+    for name, value in entities.items():
+        set_entity(name, value)
+
+def append_history(updates):
+    """追加一条状态变更历史（不进入角色状态，也就不会被注入提示词）"""
+    _append_line(config.FILE_STATE_HISTORY, {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "updates": updates})
+
+def get_history(limit=None):
+    """读取状态变更历史，limit 为最近条数"""
+    if not os.path.exists(config.FILE_STATE_HISTORY):
+        return []
+    with open(config.FILE_STATE_HISTORY, 'r', encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+    if limit:
+        lines = lines[-limit:]
+    return [json.loads(line) for line in lines]
 
 def create_snapshot(chapter_name):
     """
@@ -36,19 +247,20 @@ def create_snapshot(chapter_name):
     Naming: state_{chapter_name}_{timestamp}.json
     """
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    
+    # Fold pending log entries in first so the copies are complete
+    compact()
+
     # Snapshot Foreshadowing
     if os.path.exists(config.FILE_FORESHADOWING):
         dest = os.path.join(config.DIR_HISTORY, f"伏笔_{chapter_name}_{timestamp}.json")
         shutil.copy2(config.FILE_FORESHADOWING, dest)
-        
+
     # Snapshot Character State
     if os.path.exists(config.FILE_CHARACTER_STATE):
         dest = os.path.join(config.DIR_HISTORY, f"角色_{chapter_name}_{timestamp}.json")
         shutil.copy2(config.FILE_CHARACTER_STATE, dest)
 
 def add_foreshadowing(content, chapter, snippet=""):
-    data = get_foreshadowing()
     new_item = {
         "id": str(uuid.uuid4()),
         "content": content,
@@ -58,19 +270,26 @@ def add_foreshadowing(content, chapter, snippet=""):
         "original_text_snippet": snippet,
         "created_at": datetime.datetime.now().isoformat()
     }
-    data.append(new_item)
-    save_foreshadowing(data)
+    if _use_sqlite():
+        _db().add_foreshadowing(new_item)
+    else:
+        _append_event("foreshadowing", {"op": "add", "item": new_item})
     return new_item
 
+def update_foreshadowing(item_id, updates):
+    """修改单条伏笔（如标记回收），只追加一条日志"""
+    if _use_sqlite():
+        _db().update_foreshadowing(item_id, updates)
+        return
+    _append_event("foreshadowing", {"op": "update", "id": item_id, "updates": updates})
+
 def update_character(name, updates, chapter):
-    data = get_character_state()
-    if name not in data:
-        data[name] = {}
-    
+    updates = dict(updates)
+    updates["last_updated_chapter"] = chapter
+    updates["updated_at"] = datetime.datetime.now().isoformat()
+
     # Merge updates
-    data[name].update(updates)
-    data[name]["last_updated_chapter"] = chapter
-    data[name]["updated_at"] = datetime.datetime.now().isoformat()
-    
-    save_character_state(data)
-    return data[name]
+    if _use_sqlite():
+        return _db().merge_entity(name, updates)
+    _append_event("character", {"op": "merge", "name": name, "updates": updates})
+    return get_character_state().get(name, {})
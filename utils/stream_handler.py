@@ -1,3 +1,33 @@
+def iter_sse_deltas(response):
+    """
+    逐条解析 SSE 流式响应，产出文本增量
+    Args:
+        response: 以 stream=True 发起的 requests.Response对象
+    Yields:
+        每个 chunk 中 delta.content 的文本
+    """
+    import json
+    for line in response.iter_lines():
+        if not line:
+            continue
+        decoded_line = line.decode('utf-8') if isinstance(line, bytes) else line
+        # 处理SSE格式的数据
+        if not decoded_line.startswith('data:'):
+            continue
+        data = decoded_line[5:].strip()  # 移除 'data:' 前缀
+        if data == '[DONE]':
+            break
+        
+        try:
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+        if 'choices' in chunk and len(chunk['choices']) > 0:
+            delta = chunk['choices'][0].get('delta') or {}
+            content = delta.get('content')
+            if content:
+                yield content
+
 def stream_response_handler(response):
     """
     处理流式响应
@@ -9,27 +39,9 @@ def stream_response_handler(response):
     full_content = ""
     
     try:
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode('utf-8')
-                # 处理SSE格式的数据
-                if decoded_line.startswith('data: '):
-                    data = decoded_line[6:]  # 移除 'data: ' 前缀
-                    if data.strip() == '[DONE]':
-                        break
-                    
-                    try:
-                        import json
-                        chunk = json.loads(data)
-                        if 'choices' in chunk and len(chunk['choices']) > 0:
-                            delta = chunk['choices'][0].get('delta', {})
-                            if 'content' in delta:
-                                content = delta['content']
-                                full_content += content
-                                # 可以在这里添加实时显示逻辑
-                                print(content, end='', flush=True)
-                    except json.JSONDecodeError:
-                        continue
+        for content in iter_sse_deltas(response):
+            full_content += content
+            print(content, end='', flush=True)
         
         print()  # 换行
         return full_content
@@ -65,7 +77,7 @@ def streaming_extractor(text, model_name=None, chunk_size=2000):
     Returns:
         提取结果列表
     """
-    from . import llm_client
+    from . import extraction_schema, llm_client
     import json
     
     # 将文本分块
@@ -133,12 +145,14 @@ def streaming_extractor(text, model_name=None, chunk_size=2000):
 """
         
         try:
-            # 使用流式处理调用模型
-            result = llm_client.generate_content(prompt, model_name=model_name, stream=True)
+            # 结构化调用，返回已校验的 dict，合并时直接使用
+            data = llm_client.generate_structured(prompt, extraction_schema.WINDOW_SCHEMA, "chunk_extraction",
+                                                  model_name=model_name, use_cache=True)
             results.append({
                 "chunk_index": i,
                 "content_length": len(chunk),
-                "extraction": result
+                "extraction": json.dumps(data, ensure_ascii=False),
+                "data": data
             })
             print(f"✅ 第 {i+1} 块处理完成")
             
@@ -0,0 +1,293 @@
+"""
+分层剧情摘要
+章节摘要 -> 篇章摘要（每 ARC_SIZE 章一篇）-> 全书梗概，逐级由模型压缩（map-reduce）。
+每个篇章/全书摘要记录其来源内容的哈希，只有子级摘要变化时才重新计算。
+剧情回顾.txt 由摘要库渲染生成，长度有上限；提示词通过 get_recap() 取固定长度的前情回顾。
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import config
+from utils import file_cache, file_manager
+
+ARC_SIZE = 10
+ARC_MAX_CHARS = 600
+BOOK_MAX_CHARS = 1500
+RECAP_MAX_CHARS = 3000
+# 单次压缩请求的输入上限，超出时先分批压缩再合并
+REDUCE_INPUT_CHARS = 8000
+STORE_VERSION = 1
+
+_REVIEW_ENTRY_RE = re.compile(r'^--- (.+?)(?: \(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\))? ---$', re.MULTILINE)
+
+_lock = threading.RLock()
+
+def _store_path():
+    return os.path.join(config.DIR_OUTLINES, "剧情摘要.json")
+
+def _review_path():
+    return os.path.join(config.DIR_OUTLINES, "剧情回顾.txt")
+
+def _digest(parts):
+    return hashlib.sha256("\n\x1e".join(parts).encode("utf-8")).hexdigest()
+
+def _empty_store():
+    return {"version": STORE_VERSION, "chapters": {}, "arcs": {}, "book": {}, "extracted_outline": ""}
+
+def _import_review(store):
+    """首次使用时把旧版 剧情回顾.txt 导入摘要库：带标题的条目作为章节摘要，第一个条目之前的文本作为提取大纲"""
+    path = _review_path()
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    matches = list(_REVIEW_ENTRY_RE.finditer(text))
+    # 旧版 save_extracted_data 把全文大纲写在文件开头，之后才追加逐章摘要
+    store["extracted_outline"] = (text[:matches[0].start()] if matches else text).strip()
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        # 旧版以章节文件名作标题（如 "第13章 七品之威，断山难断.txt"），去掉扩展名
+        title = re.sub(r'\.txt$', '', match.group(1).strip(), flags=re.IGNORECASE)
+        _set_chapter(store, title, text[match.end():end].strip())
+    print(f"📦 已从 剧情回顾.txt 导入 {len(matches)} 条章节摘要")
+
+def _load():
+    path = _store_path()
+    if os.path.exists(path):
+        try:
+            store = file_cache.load_json(path)
+            if store.get("version") == STORE_VERSION:
+                return store
+        except (OSError, ValueError):
+            print(f"⚠️ 摘要库损坏，重新建立: {path}")
+    store = _empty_store()
+    _import_review(store)
+    return store
+
+def _save(store):
+    os.makedirs(config.DIR_OUTLINES, exist_ok=True)
+    file_manager.atomic_write_text(_store_path(), json.dumps(store, ensure_ascii=False, indent=2))
+    file_cache.invalidate(_store_path())
+
+def _set_chapter(store, chapter_title, summary):
+    """
+    写入章节摘要，返回是否有变化。
+    无法识别章节号的条目（序章、番外等）以 "t:标题" 为键单独存放，不占用真实章节号；
+    排序位置 order 取写入时最新章节号 + 0.5，即排在当时已有章节之后、下一章之前。
+    """
+    chapters = store["chapters"]
+    number = file_manager.parse_chapter_number(chapter_title)
+    if number is not None:
+        key, order = str(number), number
+    else:
+        key = "t:" + chapter_title
+        order = chapters[key]["order"] if key in chapters else \
+            max((c["number"] for c in chapters.values() if c["number"] is not None), default=0) + 0.5
+    entry = chapters.get(key)
+    if entry and entry["summary"] == summary and entry["title"] == chapter_title:
+        return False
+    chapters[key] = {
+        "number": number,
+        "order": order,
+        "title": chapter_title,
+        "summary": summary,
+        "updated_at": datetime.datetime.now().isoformat()
+    }
+    return True
+
+def _order(chapter):
+    # 早期写入的条目没有 order 字段
+    return chapter.get("order", chapter["number"])
+
+def _ordered_chapters(store):
+    # 排序稳定：order 相同的无章节号条目保持写入顺序
+    return sorted(store["chapters"].values(), key=_order)
+
+def _arc_groups(store):
+    """{篇章序号: [章节, ...]}，篇章按章节号分桶，插入旧章节不会挪动其它篇章；序章等归入其前一章所在的篇章"""
+    groups = {}
+    for chapter in _ordered_chapters(store):
+        groups.setdefault(max(0, (int(_order(chapter)) - 1) // ARC_SIZE), []).append(chapter)
+    return groups
+
+def _arc_range(arc_index, chapters):
+    numbers = [c["number"] for c in chapters if c["number"] is not None]
+    if not numbers:
+        return arc_index * ARC_SIZE + 1, arc_index * ARC_SIZE + 1
+    return min(numbers), max(numbers)
+
+def _summarize(text, max_chars, label, model_name=None):
+    from utils import llm_client
+    prompt = f"""请将以下{label}压缩为不超过{max_chars}字的连贯剧情概述。
+要求：保留关键人物、冲突与结果、境界与实力变化、尚未解决的伏笔；按时间顺序叙述；只输出概述正文。
+
+{text}
+"""
+    return llm_client.generate_content(prompt, model_name=model_name, use_cache=True).strip()
+
+def _clip(texts, max_chars):
+    """无法调用模型时的退化方案：每段按比例截取开头"""
+    budget = max(20, max_chars // max(1, len(texts)))
+    return "\n".join(t if len(t) <= budget else t[:budget] + "…" for t in texts)
+
+def reduce_texts(texts, max_chars, label="剧情摘要", use_llm=True, model_name=None):
+    """
+    map-reduce 压缩：总长不超过 max_chars 时直接拼接；否则按 REDUCE_INPUT_CHARS 分批压缩，
+    再对各批结果继续压缩，直到得到不超过 max_chars 的一段概述。model_name 为压缩所用模型。
+    """
+    texts = [t.strip() for t in texts if t and t.strip()]
+    joined = "\n".join(texts)
+    if len(joined) <= max_chars:
+        return joined
+    if not use_llm:
+        return _clip(texts, max_chars)
+    try:
+        batches, current, size = [], [], 0
+        for text in texts:
+            if current and size + len(text) > REDUCE_INPUT_CHARS:
+                batches.append(current)
+                current, size = [], 0
+            current.append(text[:REDUCE_INPUT_CHARS])
+            size += len(current[-1])
+        batches.append(current)
+        if len(batches) == 1:
+            return _summarize("\n".join(batches[0]), max_chars, label, model_name)
+        # 截断过长的中间结果，保证每轮批次数至少减半
+        partials = [_summarize("\n".join(batch), max_chars, label, model_name)[:max_chars * 2] for batch in batches]
+        return reduce_texts(partials, max_chars, label, use_llm, model_name)
+    except Exception as e:
+        print(f"⚠️ 摘要压缩失败，改用截取: {e}")
+        return _clip(texts, max_chars)
+
+def _rollup(store, use_llm=True, model_name=None):
+    """重新计算来源有变化的篇章与全书摘要；只汇总已写满的篇章，正在写的篇章直接使用章节摘要"""
+    recomputed = 0
+    groups = _arc_groups(store)
+    current_arc = max(groups) if groups else None
+    for arc_index in list(store["arcs"]):
+        if int(arc_index) not in groups or int(arc_index) == current_arc:
+            del store["arcs"][arc_index]
+
+    for arc_index, chapters in groups.items():
+        if arc_index == current_arc:
+            continue
+        source = [f"{c['title']}：{c['summary']}" for c in chapters]
+        digest = _digest(source)
+        arc = store["arcs"].get(str(arc_index))
+        if arc and arc["source_hash"] == digest:
+            continue
+        first, last = _arc_range(arc_index, chapters)
+        store["arcs"][str(arc_index)] = {
+            "range": [first, last],
+            "summary": reduce_texts(source, ARC_MAX_CHARS, f"第{first}-{last}章的章节摘要", use_llm, model_name),
+            "source_hash": digest
+        }
+        recomputed += 1
+
+    arc_texts = [f"第{a['range'][0]}-{a['range'][1]}章：{a['summary']}"
+                 for _, a in sorted(store["arcs"].items(), key=lambda item: int(item[0]))]
+    book_source = ([store["extracted_outline"]] if store.get("extracted_outline") else []) + arc_texts
+    digest = _digest(book_source)
+    if store["book"].get("source_hash") != digest:
+        store["book"] = {
+            "summary": reduce_texts(book_source, BOOK_MAX_CHARS, "全书各篇章的剧情摘要", use_llm, model_name),
+            "source_hash": digest
+        }
+        recomputed += 1
+    return recomputed
+
+def _render_review(store):
+    """剧情回顾.txt：全书梗概 + 各篇章摘要 + 当前篇章的逐章摘要"""
+    parts = []
+    if store["book"].get("summary"):
+        parts.append(f"=== 全书梗概 ===\n{store['book']['summary']}")
+    arcs = sorted(store["arcs"].items(), key=lambda item: int(item[0]))
+    if arcs:
+        parts.append("=== 篇章摘要 ===\n" + "\n\n".join(
+            f"【第{a['range'][0]}-{a['range'][1]}章】\n{a['summary']}" for _, a in arcs))
+    recent = _current_arc_chapters(store)
+    if recent:
+        parts.append("=== 本篇章节 ===\n" + "\n\n".join(f"--- {c['title']} ---\n{c['summary']}" for c in recent))
+    return "\n\n".join(parts) + "\n"
+
+def _current_arc_chapters(store):
+    groups = _arc_groups(store)
+    return groups[max(groups)] if groups else []
+
+def _commit(store, use_llm=True, model_name=None):
+    """汇总、保存摘要库并重新渲染 剧情回顾.txt，返回重新计算的摘要数"""
+    recomputed = _rollup(store, use_llm, model_name)
+    _save(store)
+    file_manager.atomic_write_text(_review_path(), _render_review(store))
+    file_cache.invalidate(_review_path())
+    return recomputed
+
+def update_chapter(chapter_title, summary, use_llm=True, model_name=None):
+    """
+    写入/更新一章的摘要，并按需重新汇总篇章与全书摘要（使用 model_name 压缩）。
+    Returns:
+        摘要是否有变化（无变化时不做任何计算）
+    """
+    with _lock:
+        store = _load()
+        if not _set_chapter(store, chapter_title, summary.strip()):
+            return False
+        _commit(store, use_llm, model_name)
+        return True
+
+def set_extracted_outline(outline, use_llm=True, model_name=None):
+    """
+    保存全量提取得到的大纲（可能很长，或由多个窗口的大纲拼接而成），
+    先压缩到全书梗概的长度，再参与全书摘要的汇总。
+    """
+    if isinstance(outline, list):
+        parts = outline
+    else:
+        parts = [p for p in str(outline or "").split("\n") if p.strip()]
+    with _lock:
+        store = _load()
+        store["extracted_outline"] = reduce_texts(parts, BOOK_MAX_CHARS, "全书剧情大纲", use_llm, model_name)
+        _commit(store, use_llm, model_name)
+
+def refresh(use_llm=True, model_name=None):
+    """手动重新汇总（如调整 ARC_SIZE 或修复摘要后），返回重新计算的摘要数"""
+    with _lock:
+        return _commit(_load(), use_llm, model_name)
+
+def get_chapter_summaries(n=None):
+    """按章节顺序返回 [{"number", "title", "summary"}, ...]，n 为最近条数；序章等条目的 number 为 None"""
+    with _lock:
+        chapters = _ordered_chapters(_load())
+    return chapters[-n:] if n else chapters
+
+def get_recap(max_chars=RECAP_MAX_CHARS, recent_chapters=ARC_SIZE):
+    """
+    固定长度的前情回顾：全书梗概 + 最近 recent_chapters 章的章节摘要。
+    超出 max_chars 时优先保留最近的章节摘要（整条舍弃较早的章节），梗概用剩余篇幅从开头截取。
+    """
+    with _lock:
+        store = _load()
+    recent = []
+    used = 0
+    for chapter in reversed(_ordered_chapters(store)[-recent_chapters:] if recent_chapters else []):
+        line = f"{chapter['title']}：{chapter['summary']}"
+        if used + len(line) + 1 > max_chars:
+            break
+        recent.insert(0, line)
+        used += len(line) + 1
+    recent_text = "\n".join(recent)
+
+    book = store["book"].get("summary", "")
+    if not book:
+        return recent_text
+    template = "【全书梗概】\n{book}\n\n【最近章节】\n{recent}" if recent_text else "【全书梗概】\n{book}"
+    budget = max_chars - len(template.format(book="", recent=recent_text))
+    if budget < 50:
+        return recent_text
+    if len(book) > budget:
+        book = book[:budget - 1] + "…"
+    return template.format(book=book, recent=recent_text)
@@ -1,8 +1,20 @@
-import difflib
 import re
 import os
-import glob
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+import config
+from utils import body_index
+from utils.aho_corasick import AhoCorasick
+
+# 冲突命中前后各保留的上下文字符数
+CONTEXT_CHARS = 30
+
+# 差分参数：句子级对齐后，只对不超过该长度的改动区间做字符级细分
+_SEGMENT_END_RE = re.compile(r'[。！？!?…]+[”’」』"]?|\n+')
+REFINE_MAX_CHARS = 4000
+REFINE_MAX_EDITS = 2000
+MERGE_GAP_CHARS = 1
+_CJK_CHAR_RE = re.compile(r'[一-鿿㐀-䶿]')
 
 def get_text_diff(old_text, new_text):
     """
@@ -28,35 +40,248 @@ def get_text_diff(old_text, new_text):
     # "User selects 'Modify', edits. System compares."
     
     # Let's implement a helper to find removed strings.
-    s = difflib.SequenceMatcher(None, old_text, new_text)
     removed_chunks = []
-    for tag, i1, i2, j1, j2 in s.get_opcodes():
-        if tag == 'replace' or tag == 'delete':
-            removed_chunks.append(old_text[i1:i2])
+    for change in diff_changes(old_text, new_text):
+        if change["type"] == 'replace' or change["type"] == 'delete':
+            removed_chunks.append(change["old"])
             
     return removed_chunks
 
-def scan_chapters_for_conflict(search_terms: List[str], start_chapter_index: int, all_chapters: List[str]) -> Dict[str, List[str]]:
+def scan_chapters_for_conflict(search_terms: List[str], start_chapter_index: int, all_chapters: List[str], max_workers: int = 1) -> Dict[str, List[str]]:
     """
     Scan subsequent chapters for presence of removed terms.
     all_chapters: list of file paths.
+    Returns {filename: [terms found]}; see find_conflict_hits for positions and context.
     """
     conflicts = {}
-    
-    for i in range(start_chapter_index + 1, len(all_chapters)):
-        filepath = all_chapters[i]
-        filename = os.path.basename(filepath)
-        
+    order = {term: i for i, term in enumerate(search_terms)}
+    for filename, hits in find_conflict_hits(search_terms, start_chapter_index, all_chapters, max_workers=max_workers).items():
+        terms = {hit["term"] for hit in hits}
+        conflicts[filename] = sorted(terms, key=order.get)
+    return conflicts
+
+def find_conflict_hits(search_terms: List[str], start_chapter_index: int, all_chapters: List[str],
+                       max_workers: int = 1, context_chars: int = CONTEXT_CHARS, use_index: bool = True) -> Dict[str, List[Dict]]:
+    """
+    Scan subsequent chapters with a single Aho-Corasick automaton built from all terms:
+    each chapter is read and scanned exactly once, whatever the number of terms.
+    With use_index, the body inverted index first narrows the scan to chapters that contain a term.
+    Returns {filename: [{"term", "position", "context"}, ...]} in chapter order, hits sorted by position.
+    """
+    matcher = AhoCorasick(term for term in search_terms if len(term) >= 2) # Ignore single chars
+    targets = all_chapters[start_chapter_index + 1:]
+    if not matcher or not targets:
+        return {}
+
+    body_dir = os.path.abspath(config.DIR_BODY)
+    if use_index and all(os.path.dirname(os.path.abspath(p)) == body_dir for p in targets):
+        body_index.refresh()
+        names = {os.path.basename(p) for p in targets}
+        matched = set()
+        for term in matcher.patterns:
+            matched.update(body_index.lookup_term(term, names))
+        targets = [p for p in targets if os.path.basename(p) in matched]
+        if not targets:
+            return {}
+
+    def _scan(filepath):
         with open(filepath, 'r', encoding='utf-8') as f:
             content = f.read()
-            
-        found_terms = []
-        for term in search_terms:
-            if len(term) < 2: continue # Ignore single chars
-            if term in content:
-                found_terms.append(term)
-                
-        if found_terms:
-            conflicts[filename] = found_terms
-            
-    return conflicts
+        hits = []
+        for position, term in matcher.iter_matches(content):
+            start = max(0, position - context_chars)
+            end = min(len(content), position + len(term) + context_chars)
+            hits.append({"term": term, "position": position, "context": content[start:end].replace("\n", " ")})
+        hits.sort(key=lambda hit: hit["position"])
+        return os.path.basename(filepath), hits
+
+    workers = max(1, min(int(max_workers or 1), len(targets)))
+    if workers == 1:
+        results = [_scan(path) for path in targets]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_scan, targets))
+
+    return {filename: hits for filename, hits in results if hits}
+
+def split_segments(text: str) -> List[str]:
+    """按句末标点/换行切分为句子片段，片段首尾相接等于原文"""
+    segments = []
+    prev = 0
+    for match in _SEGMENT_END_RE.finditer(text):
+        segments.append(text[prev:match.end()])
+        prev = match.end()
+    if prev < len(text):
+        segments.append(text[prev:])
+    return segments
+
+def myers_opcodes(a, b, max_edits=None):
+    """
+    Myers O(ND) 差分，返回与 difflib.get_opcodes 相同格式的 [(tag, i1, i2, j1, j2), ...]。
+    a / b 可以是字符串或任意可比较元素的序列；编辑距离超过 max_edits 时返回 None。
+    """
+    n, m = len(a), len(b)
+    # 先去掉公共前后缀，真实编辑通常只占很小一部分
+    prefix = 0
+    while prefix < n and prefix < m and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and suffix < m - prefix and a[n - 1 - suffix] == b[m - 1 - suffix]:
+        suffix += 1
+    core_a, core_b = a[prefix:n - suffix], b[prefix:m - suffix]
+
+    matches = _myers_matches(core_a, core_b, max_edits)
+    if matches is None:
+        return None
+    matches = [(i, i) for i in range(prefix)] + [(x + prefix, y + prefix) for x, y in matches] \
+        + [(n - suffix + i, m - suffix + i) for i in range(suffix)]
+
+    opcodes = []
+    i = j = 0
+    for x, y in matches:
+        if x > i or y > j:
+            opcodes.append([_gap_tag(i, x, j, y), i, x, j, y])
+        if opcodes and opcodes[-1][0] == 'equal' and opcodes[-1][2] == x and opcodes[-1][4] == y:
+            opcodes[-1][2] += 1
+            opcodes[-1][4] += 1
+        else:
+            opcodes.append(['equal', x, x + 1, y, y + 1])
+        i, j = x + 1, y + 1
+    if i < n or j < m:
+        opcodes.append([_gap_tag(i, n, j, m), i, n, j, m])
+    return [tuple(op) for op in opcodes]
+
+def _gap_tag(i1, i2, j1, j2):
+    if i2 > i1 and j2 > j1:
+        return 'replace'
+    return 'delete' if i2 > i1 else 'insert'
+
+def _myers_matches(a, b, max_edits=None):
+    """贪心 Myers 前向搜索 + 回溯，返回升序的匹配位置对 [(i, j), ...]"""
+    n, m = len(a), len(b)
+    limit = n + m if max_edits is None else min(n + m, max_edits)
+    v = {1: 0}
+    trace = []
+    for d in range(limit + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m)
+    return None
+
+def _myers_backtrack(trace, n, m):
+    matches = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((x, y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches
+
+def _merge_close_changes(opcodes):
+    """相邻改动之间只隔极短的相同片段时合并为一处，避免把 "沈仪" -> "陆沉" 拆成零碎单字"""
+    merged = []
+    for op in opcodes:
+        if op[0] != 'equal' and len(merged) >= 2 and merged[-1][0] == 'equal' and merged[-2][0] != 'equal' \
+                and merged[-1][2] - merged[-1][1] <= MERGE_GAP_CHARS:
+            merged.pop()
+            prev = merged.pop()
+            op = (_gap_tag(prev[1], op[2], prev[3], op[4]), prev[1], op[2], prev[3], op[4])
+        merged.append(op)
+    return merged
+
+def diff_changes(old_text: str, new_text: str) -> List[Dict]:
+    """
+    两级差分：先按句子对齐，只对改动的句子区间再做字符级差分。
+    Returns:
+        [{"type": "replace"/"delete"/"insert", "old", "new",
+          "old_start", "old_end", "new_start", "new_end"}, ...]，偏移为字符下标
+    """
+    old_segments = split_segments(old_text)
+    new_segments = split_segments(new_text)
+    old_offsets = _cumulative_offsets(old_segments)
+    new_offsets = _cumulative_offsets(new_segments)
+
+    segment_ops = myers_opcodes(old_segments, new_segments)
+    changes = []
+    for tag, i1, i2, j1, j2 in segment_ops:
+        if tag == 'equal':
+            continue
+        o1, o2 = old_offsets[i1], old_offsets[i2]
+        n1, n2 = new_offsets[j1], new_offsets[j2]
+        char_ops = None
+        if tag == 'replace' and o2 - o1 <= REFINE_MAX_CHARS and n2 - n1 <= REFINE_MAX_CHARS:
+            char_ops = myers_opcodes(old_text[o1:o2], new_text[n1:n2], max_edits=REFINE_MAX_EDITS)
+        if char_ops is None:
+            # 新增/删除整句，或改动过大（整段重写）时不再细分
+            char_ops = [(tag, 0, o2 - o1, 0, n2 - n1)]
+        for sub_tag, a1, a2, b1, b2 in _merge_close_changes(char_ops):
+            if sub_tag == 'equal':
+                continue
+            changes.append({
+                "type": sub_tag,
+                "old": old_text[o1 + a1:o1 + a2],
+                "new": new_text[n1 + b1:n1 + b2],
+                "old_start": o1 + a1,
+                "old_end": o1 + a2,
+                "new_start": n1 + b1,
+                "new_end": n1 + b2
+            })
+    return changes
+
+def _cumulative_offsets(segments):
+    offsets = [0]
+    for segment in segments:
+        offsets.append(offsets[-1] + len(segment))
+    return offsets
+
+def extract_replacements(changes: List[Dict], old_text: str = None, new_text: str = None, max_len: int = 12) -> List[Dict]:
+    """
+    从结构化改动中提取替换候选（如人名 A -> B），按首次出现排序并统计次数。
+    只保留两侧都是不含换行的短片段的 replace。
+    传入原文时，单字替换（如 沈仪 -> 沈毅 只差一个字）会向两侧相同的汉字扩展为完整词语。
+    """
+    candidates = {}
+    for change in changes:
+        if change["type"] != 'replace':
+            continue
+        old, new = change["old"], change["new"]
+        if old_text is not None and new_text is not None:
+            old, new = _widen_replacement(change, old_text, new_text)
+        old, new = old.strip(), new.strip()
+        if not old or not new or len(old) > max_len or len(new) > max_len or "\n" in old or "\n" in new:
+            continue
+        entry = candidates.setdefault((old, new), {"old": old, "new": new, "count": 0})
+        entry["count"] += 1
+    return list(candidates.values())
+
+def _widen_replacement(change, old_text, new_text, min_len=2):
+    o1, o2, n1, n2 = change["old_start"], change["old_end"], change["new_start"], change["new_end"]
+    while min(o2 - o1, n2 - n1) < min_len:
+        if o1 > 0 and n1 > 0 and old_text[o1 - 1] == new_text[n1 - 1] and _CJK_CHAR_RE.match(old_text[o1 - 1]):
+            o1, n1 = o1 - 1, n1 - 1
+        elif o2 < len(old_text) and n2 < len(new_text) and old_text[o2] == new_text[n2] and _CJK_CHAR_RE.match(old_text[o2]):
+            o2, n2 = o2 + 1, n2 + 1
+        else:
+            break
+    return old_text[o1:o2], new_text[n1:n2]
@@ -0,0 +1,122 @@
+"""
+Token 预算工具
+在本地粗略估算文本的 token 数，用于分窗与提示词裁剪，无需调用服务端分词器。
+"""
+
+import math
+import os
+import re
+
+# 中日韩文字与全角标点：主流模型分词器下约 1 字 ≈ 1 token（偏保守）
+_CJK_RE = re.compile(r'[　-〿㐀-䶿一-鿿豈-﫿＀-￯]')
+
+def estimate_tokens(text):
+    """估算文本 token 数：中文按字计，其余字符按 4 字符 ≈ 1 token 计"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + math.ceil(other / 4)
+
+# 常见模型系列的上下文大小（按模型名前缀匹配，取偏保守的值）
+MODEL_CONTEXT_TOKENS = [
+    ("gpt-3.5", 16000),
+    ("gpt-4o", 128000),
+    ("deepseek", 64000),
+    ("qwen", 32000),
+    ("glm", 128000),
+]
+# 未知模型的默认上下文，按 .env.example 默认的 gpt-3.5-turbo（16K）取值；
+# 可通过环境变量 LLM_CONTEXT_TOKENS 覆盖
+DEFAULT_CONTEXT_TOKENS = 16000
+DEFAULT_OUTPUT_RESERVE = 4096
+TRUNCATION_MARKER = "\n……（已按上下文预算截断）……\n"
+
+def get_context_tokens(model_name=None):
+    """模型上下文大小：LLM_CONTEXT_TOKENS > 模型系列表 > DEFAULT_CONTEXT_TOKENS"""
+    value = os.environ.get("LLM_CONTEXT_TOKENS")
+    if value:
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    name = (model_name or os.environ.get("OPENAI_MODEL_NAME") or "").lower()
+    for prefix, tokens in MODEL_CONTEXT_TOKENS:
+        if prefix in name:
+            return tokens
+    return DEFAULT_CONTEXT_TOKENS
+
+def get_prompt_budget(context_tokens=None, output_reserve=DEFAULT_OUTPUT_RESERVE, model_name=None):
+    """返回提示词可用的 token 预算 = 模型上下文 - 输出预留"""
+    if context_tokens is None:
+        context_tokens = get_context_tokens(model_name)
+    return max(0, context_tokens - output_reserve)
+
+def truncate_to_tokens(text, max_tokens, keep="head"):
+    """
+    将文本裁剪到 max_tokens 以内。
+    keep="head" 保留开头（设定、素材），keep="tail" 保留结尾（最近剧情）。
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    available = max_tokens - estimate_tokens(TRUNCATION_MARKER)
+    if available <= 0:
+        return ""
+
+    # 二分查找能放下的最大字符数
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        part = text[:mid] if keep == "head" else text[len(text) - mid:]
+        if estimate_tokens(part) <= available:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    if keep == "head":
+        return text[:lo] + TRUNCATION_MARKER
+    return TRUNCATION_MARKER + text[len(text) - lo:]
+
+def allocate(sections, budget):
+    """
+    分配 token 预算，分三轮：
+    1. 保底：min_share 的段落先得到 min(需求, 预算 × min_share)；保底总和超出预算时按比例缩减；
+    2. 按优先级补足，设了 max_share 的段落此轮最多到 预算 × max_share；
+    3. 仍有剩余时按优先级继续补足被 max_share 限制的段落。
+    Args:
+        sections: [{"name": 名称, "text": 内容, "priority": 数字越小越优先, "keep": "head"/"tail",
+                    "min_share": 可选保底比例, "max_share": 可选上限比例}]
+        budget: 可用 token 总数
+    Returns:
+        {名称: 裁剪后的内容}
+    """
+    budget = max(0, budget)
+    ordered = sorted(sections, key=lambda s: s["priority"])
+    need = {s["name"]: estimate_tokens(s.get("text") or "") for s in ordered}
+
+    grant = {s["name"]: min(need[s["name"]], int(budget * s.get("min_share", 0))) for s in ordered}
+    reserved = sum(grant.values())
+    if reserved > budget:
+        grant = {name: tokens * budget // reserved for name, tokens in grant.items()}
+    remaining = budget - sum(grant.values())
+
+    for capped in (True, False):
+        for section in ordered:
+            name = section["name"]
+            limit = need[name]
+            if capped and "max_share" in section:
+                limit = min(limit, int(budget * section["max_share"]))
+            extra = min(max(0, limit - grant[name]), remaining)
+            grant[name] += extra
+            remaining -= extra
+
+    fitted = {}
+    for section in ordered:
+        name = section["name"]
+        text = section.get("text") or ""
+        if grant[name] >= need[name]:
+            fitted[name] = text
+            continue
+        fitted[name] = truncate_to_tokens(text, grant[name], keep=section.get("keep", "head"))
+        print(f"✂️ 提示词段落「{name}」超出预算: {need[name]} → {estimate_tokens(fitted[name])} tokens")
+    return fitted